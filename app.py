@@ -1,148 +1,244 @@
-from dash import Dash, html, dcc, Output, Input, State
+from dash import Dash, html, dcc, Output, Input, State, Patch, no_update
 import dash_bootstrap_components as dbc
-from dataclasses import dataclass, field
-import threading
-from assistant import voice_loop, stop_event, log_manager, AppState
-import time
+from flask import Response
+import uuid
+from assistant import metrics
+from sessions import SessionLimit, SessionManager
 
 app = Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 server = app.server
 
-app_state = AppState()
+# Una conversazione per scheda del browser, con limite di sessioni e rimozione di quelle inattive
+sessions = SessionManager()
 
-app.layout = dbc.Container([
-    html.H2("🗣️ Assistente Vocale OpenAI", className="my-3"),
-    
-    dbc.Row([
-        dbc.Col([
-            dbc.Label("Lingua trascrizione"),
-            dcc.Dropdown(
-                id="lang-dropdown",
-                options=[{"label": "Italiano", "value": "it"}, {"label": "Inglese", "value": "en"}],
-                value="it"
-            )
-        ]),
-        dbc.Col([
-            dbc.Label("Modello GPT"),
-            dcc.Dropdown(
-                id="model-dropdown",
-                options=[
-                    {"label": "GPT-4 Turbo", "value": "gpt-4-turbo"},
-                    {"label": "GPT-3.5 Turbo", "value": "gpt-3.5-turbo"}
-                ],
-                value="gpt-4-turbo"
-            )
-        ]),
-        dbc.Col([
-            dbc.Label("Voce sintetica"),
-            dcc.Dropdown(
-                id="voice-dropdown",
-                options=[
-                    {"label": v.capitalize(), "value": v} for v in
-                    ["nova", "alloy", "shimmer", "fable", "onyx", "echo"]
-                ],
-                value="nova"
-            )
-        ]),
-        dbc.Col([
-            dbc.Label("Pausa (sec)"),
-            dcc.Input(id="pause-input", type="number", min=0.5, step=0.5, value=1.0)
+# Aggiornamento della pagina: rapido quando arrivano novità, poi sempre più rado finché la pipeline tace
+POLL_FAST_MS = 250
+POLL_MAX_MS = 2000
+POLL_BACKOFF = 2
+
+@server.route("/metrics")
+def prometheus_metrics():
+    # Istogrammi per stadio e contatori della pipeline nel formato testuale di Prometheus
+    return Response(metrics.render_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+def metrics_version(rows):
+    # Cambia solo con misure nuove: senza, il pannello non viene ritrasmesso
+    return "|".join(f"{row['stage']}:{row['count']}:{row['retries']}" for row in rows)
+
+def metrics_table(rows):
+    if not rows:
+        return html.Div("Nessuna misura" if metrics.enabled else "Misure disattivate (METRICS_ENABLED=0)")
+
+    def ms(value):
+        return f"{value * 1000:.0f}" if value is not None else "-"
+
+    header = html.Thead(html.Tr([html.Th(name) for name in ["Stadio", "N", "p50 ms", "p95 ms", "p99 ms", "KB su", "KB giù", "Retry"]]))
+    body = html.Tbody([
+        html.Tr([
+            html.Td(row["stage"]), html.Td(row["count"]),
+            html.Td(ms(row.get("p50"))), html.Td(ms(row.get("p95"))), html.Td(ms(row.get("p99"))),
+            html.Td(f"{row['upload_bytes'] / 1024:.1f}"), html.Td(f"{row['download_bytes'] / 1024:.1f}"),
+            html.Td(row["retries"]),
         ])
-    ], className="mb-4"),
-
-    dbc.Button("Avvia Conversazione", id="start-btn", color="success", className="me-2", disabled=False),
-    dbc.Button("Ferma", id="stop-btn", color="danger", disabled=True),
-
-    html.Hr(),
-
-    html.Div([
-        html.Div("Stato: ", style={"display": "inline", "fontWeight": "bold"}),
-        html.Span(id="status-text", children="Inattivo", style={"color": "gray", "fontWeight": "bold"})
-    ], className="mb-2"),
-
-    html.Div(id="conversation-log", style={
-        "whiteSpace": "pre-line",
-        "height": "300px",
-        "overflowY": "scroll",
-        "border": "1px solid #ccc",
-        "padding": "10px",
-        "backgroundColor": "#f9f9f9",
-        "fontFamily": "monospace",
-        "fontSize": "14px"
-    }),
+        for row in rows
+    ])
+    return dbc.Table([header, body], size="sm", striped=True, className="mb-0")
+
+def serve_layout():
+    # Layout generato a ogni caricamento: l'id nuovo vale solo se la scheda non ne ha già uno salvato
+    return dbc.Container([
+        dcc.Store(id="session-id", storage_type="session", data=str(uuid.uuid4())),
+        html.H2("🗣️ Assistente Vocale OpenAI", className="my-3"),
+    
+        dbc.Row([
+            dbc.Col([
+                dbc.Label("Lingua trascrizione"),
+                dcc.Dropdown(
+                    id="lang-dropdown",
+                    options=[{"label": "Italiano", "value": "it"}, {"label": "Inglese", "value": "en"}],
+                    value="it"
+                )
+            ]),
+            dbc.Col([
+                dbc.Label("Modello GPT"),
+                dcc.Dropdown(
+                    id="model-dropdown",
+                    options=[
+                        {"label": "GPT-4 Turbo", "value": "gpt-4-turbo"},
+                        {"label": "GPT-3.5 Turbo", "value": "gpt-3.5-turbo"}
+                    ],
+                    value="gpt-4-turbo"
+                )
+            ]),
+            dbc.Col([
+                dbc.Label("Voce sintetica"),
+                dcc.Dropdown(
+                    id="voice-dropdown",
+                    options=[
+                        {"label": v.capitalize(), "value": v} for v in
+                        ["nova", "alloy", "shimmer", "fable", "onyx", "echo"]
+                    ],
+                    value="nova"
+                )
+            ]),
+            dbc.Col([
+                dbc.Label("Pausa (sec)"),
+                dcc.Input(id="pause-input", type="number", min=0.5, step=0.5, value=1.0)
+            ])
+        ], className="mb-4"),
+
+        dbc.Button("Avvia Conversazione", id="start-btn", color="success", className="me-2", disabled=False),
+        dbc.Button("Ferma", id="stop-btn", color="danger", disabled=True),
+
+        html.Hr(),
+
+        html.Div([
+            html.Div("Stato: ", style={"display": "inline", "fontWeight": "bold"}),
+            html.Span(id="status-text", children="Inattivo", style={"color": "gray", "fontWeight": "bold"})
+        ], className="mb-2"),
+
+        html.Div(id="conversation-log", children=[], style={
+            "whiteSpace": "pre-line",
+            "height": "300px",
+            "overflowY": "scroll",
+            "border": "1px solid #ccc",
+            "padding": "10px",
+            "backgroundColor": "#f9f9f9",
+            "fontFamily": "monospace",
+            "fontSize": "14px"
+        }),
     
-    dcc.Interval(id="interval", interval=1000, n_intervals=0, disabled=True),
-    dcc.Store(id='conversation-store'),
+        dcc.Interval(id="interval", interval=POLL_FAST_MS, n_intervals=0, disabled=True),
+        # Posizione della scheda nella conversazione: epoca, righe ricevute, ultimo stato mostrato
+        dcc.Store(id='conversation-store'),
+        dcc.Store(id='metrics-version'),
     
-    dbc.Accordion([
-        dbc.AccordionItem(
-            title="Storico Conversazioni",
-            children=html.Div(id="history-log")
-        )
+        dbc.Accordion([
+            dbc.AccordionItem(
+                title="Storico Conversazioni",
+                children=html.Div(id="history-log")
+            ),
+            dbc.AccordionItem(
+                title="Latenze per stadio",
+                children=html.Div(id="metrics-panel")
+            )
+        ])
     ])
-])
+
+app.layout = serve_layout
 
 @app.callback(
     Output("interval", "disabled"),
     Output("start-btn", "disabled"),
     Output("stop-btn", "disabled"),
+    Output("interval", "interval", allow_duplicate=True),
+    Output("status-text", "children", allow_duplicate=True),
     Input("start-btn", "n_clicks"),
+    State("session-id", "data"),
     State("lang-dropdown", "value"),
     State("model-dropdown", "value"),
     State("voice-dropdown", "value"),
     State("pause-input", "value"),
     prevent_initial_call=True
 )
-def start_conversation(n_clicks, lang, model, voice, pause):
-    if app_state.is_running:
-        return False, True, False
+def start_conversation(n_clicks, session_id, lang, model, voice, pause):
+    try:
+        session = sessions.open(session_id)
+    except SessionLimit:
+        return True, False, True, no_update, "⛔ Troppe conversazioni attive, riprova più tardi"
 
-    app_state.reset()
-    app_state.update_settings(lang, model, voice, max(0.5, min(float(pause), 5.0)))
+    started = sessions.start(session, {
+        "language": lang,
+        "model": model,
+        "voice": voice,
+        "pause": max(0.5, min(float(pause), 5.0))
+    })
+    if not started:
+        # Il loop precedente non ha ancora finito di fermarsi: nessuna pipeline è stata avviata
+        return True, False, True, no_update, "⏳ La conversazione precedente si sta ancora chiudendo, riprova tra un attimo"
+    return False, True, False, POLL_FAST_MS, no_update
 
-    def start_thread():
-        try:
-            voice_loop(app_state.settings)
-        except Exception as e:
-            app_state.add_system_log(f"Errore thread: {str(e)}")
-            app_state.stop()
+def conversation_line(text):
+    return html.Div(text.rstrip("\n"), className="mb-3")
 
-    threading.Thread(target=start_thread, daemon=True).start()
-    return False, True, False
+@app.callback(
+    Output("interval", "disabled", allow_duplicate=True),
+    Output("start-btn", "disabled", allow_duplicate=True),
+    Output("stop-btn", "disabled", allow_duplicate=True),
+    Input("session-id", "data"),
+    prevent_initial_call="initial_duplicate"
+)
+def resume_session(session_id):
+    # Ricaricando la pagina la scheda ritrova la propria conversazione
+    session = sessions.get(session_id)
+    if session is None:
+        return no_update, no_update, no_update
+    running = session.running
+    return False, running, not running
 
 @app.callback(
     Output("conversation-log", "children"),
     Output("status-text", "children"),
+    Output("conversation-store", "data"),
+    Output("interval", "interval"),
     Input("interval", "n_intervals"),
+    State("session-id", "data"),
+    State("conversation-store", "data"),
+    State("interval", "interval"),
 )
-def update_output(n):
-    logs = log_manager.get_logs()
-    status = "Inattivo"
-    
-    for log in logs:
-        if log['user'] == "**[ASCOLTO]**":
-            status = "🎤 Ascolto"
-        elif "PENSO" in log['system']:
-            status = "⏳ Elaborazione"
-        elif "[PARLO]" in log['system']:
-            status = "🔊 Riproduzione"
-            app_state.add_conversation(log['user'], log['system'].replace("[PARLO]", ""))
-        elif log['system'] == "**[PRONTO]**":
-            status = "✅ Pronto"
-    
-    app_state.update_status(status)
-    return "\n".join(app_state.get_conversation()), app_state.current_status
+def update_output(n, session_id, cursor, interval):
+    # Ogni scheda riceve solo le righe nuove, aggiunte in coda con un Patch; la conversazione
+    # intera viene ritrasmessa solo alla prima richiesta o dopo un reset (nuova epoca)
+    session = sessions.get(session_id)
+    if session is None:
+        return no_update, no_update, no_update, no_update
+    cursor = cursor or {}
+    known = cursor.get("count", 0)
+    epoch, count, lines, status = session.state.sync(session.log, cursor.get("epoch"), known)
+    if epoch == cursor.get("epoch") and count == known and not lines and status == cursor.get("status"):
+        slower = min(int(interval * POLL_BACKOFF), POLL_MAX_MS)
+        return no_update, no_update, no_update, slower if slower != interval else no_update
+
+    if epoch != cursor.get("epoch") or count != known:
+        children = [conversation_line(line) for line in lines]
+    elif lines:
+        children = Patch()
+        children.extend([conversation_line(line) for line in lines])
+    else:
+        children = no_update
+    store = {"epoch": epoch, "count": count + len(lines), "status": status}
+    return (
+        children,
+        status if status != cursor.get("status") else no_update,
+        store,
+        POLL_FAST_MS if interval != POLL_FAST_MS else no_update,
+    )
+
+@app.callback(
+    Output("metrics-panel", "children"),
+    Output("metrics-version", "data"),
+    Input("interval", "n_intervals"),
+    State("metrics-version", "data"),
+)
+def update_metrics(n, version):
+    rows = metrics.stage_summary()
+    current = metrics_version(rows)
+    if current == version:
+        return no_update, no_update
+    return metrics_table(rows), current
 
 @app.callback(
     Output("interval", "disabled", allow_duplicate=True),
     Output("start-btn", "disabled", allow_duplicate=True),
     Output("stop-btn", "disabled", allow_duplicate=True),
     Input("stop-btn", "n_clicks"),
+    State("session-id", "data"),
     prevent_initial_call=True
 )
-def stop_conversation(n_clicks):
-    app_state.stop()
-    stop_event.set()
+def stop_conversation(n_clicks, session_id):
+    session = sessions.get(session_id)
+    if session is not None:
+        sessions.stop(session)
     return True, False, True
 
 if __name__ == "__main__":
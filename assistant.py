@@ -1,30 +1,157 @@
 from openai import OpenAI
+import httpx
 import sounddevice as sd
 import scipy.io.wavfile
 import uuid
+import io
+import math
 import os
+import re
 import time
 import csv
+import asyncio
 import threading
 import traceback
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from collections import deque
 from datetime import datetime
 from dotenv import load_dotenv
 from pydub import AudioSegment
-import simpleaudio as sa
-from queue import Queue, Empty
-from tenacity import retry, stop_after_attempt, wait_exponential
-from contextlib import contextmanager
-from dataclasses import dataclass, field
+from scipy.signal import resample_poly
+from queue import Queue, Empty, Full
+from tenacity import AsyncRetrying, Retrying, retry_if_not_exception_type, stop_after_attempt, stop_any, wait_random_exponential
+from dataclasses import dataclass, field, replace
 from functools import lru_cache
+from itertools import count, islice
+
+from cache import ResponseCache, TtsCache
+from context import ConversationContext
+from metrics import PipelineMetrics
+from tracing import RecordingTransport, bind_context, start_trace, stop_trace
+
+try:
+    import soundfile as sf
+except (ImportError, OSError):
+    sf = None
+
+try:
+    import h2  # noqa: F401  (abilita HTTP/2 in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
 
 load_dotenv()
 
+SAMPLE_RATE = 44100
+FIXED_RECORD_SECONDS = 5
+AUDIO_ARCHIVE_DIR = os.getenv("AUDIO_ARCHIVE_DIR")
+CAPTURE_BUFFER_SECONDS = 60       # capienza del ring buffer del microfono
+CAPTURE_BLOCK_DURATION = 0.01     # blocco della callback di acquisizione (s)
+CAPTURE_STALL_TIMEOUT = 2.0       # oltre questo tempo senza audio lo stream è considerato fermo (s)
+CAPTURE_POLL_INTERVAL = 0.05      # intervallo di controllo dello stop durante l'attesa dell'audio (s)
+STOP_TIMEOUT = 1.0                # tempo massimo per fermare il loop dopo lo Stop (s)
+TURN_BUDGET_SECONDS = 20.0        # tempo complessivo a disposizione di un turno, dalla fine del parlato (s)
+BUDGET_MIN_ATTEMPT = 0.5          # sotto questo margine non si avvia un nuovo tentativo (s)
+TRANSCRIBE_TIMEOUT = 10.0         # timeout HTTP massimo per singolo tentativo, per stadio (s)
+CHAT_TIMEOUT = 15.0
+TTS_TIMEOUT = 10.0
+RETRY_ATTEMPTS = 3
+CHUNK_SECONDS = 2.0               # trascrizione incrementale: durata dei blocchi inviati durante il parlato (s)
+CHUNK_OVERLAP = 0.5               # sovrapposizione tra blocchi consecutivi (s)
+CHUNK_MIN_TAIL = 0.15             # audio nuovo minimo perché valga la pena inviare il blocco finale (s)
+STITCH_MAX_WORDS = 8              # parole massime cercate nella sovrapposizione tra due trascrizioni
+HEDGE_MIN_SAMPLES = 20            # latenze osservate necessarie prima di stimare il p95
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
+HTTP_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "3.0"))
+HTTP_READ_TIMEOUT = float(os.getenv("OPENAI_READ_TIMEOUT", "20.0"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "10"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "6"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "90"))
+HTTP_WARMUP_CONNECTIONS = int(os.getenv("OPENAI_WARMUP_CONNECTIONS", "3"))
+SYSTEM_PROMPT = (
+    "Sei un assistente vocale. Rispondi in modo breve e colloquiale, con frasi adatte "
+    "a essere lette ad alta voce, senza elenchi né formattazione."
+)
+CONTEXT_MAX_TOKENS = 1500         # token della finestra dei turni recenti inviata a GPT
+SUMMARY_TIMEOUT = 30.0            # il riassunto gira in background: nessun budget di turno
+SUMMARY_PROMPT = (
+    "Aggiorna il riassunto di una conversazione tra un utente e un assistente vocale. "
+    "Conserva fatti, nomi, preferenze e richieste aperte dell'utente; massimo 120 parole."
+)
+BUDGET_EXHAUSTED_MESSAGE = "Scusa, la risposta sta richiedendo troppo tempo. Puoi ripetere la domanda?"
+UPLOAD_SAMPLE_RATE = 16000
+UPLOAD_TARGET_PEAK = 0.9
+UPLOAD_MAX_GAIN = 8.0
+SENTENCE_BOUNDARY = re.compile(r"[.!?…]+[\"'»)\]]*\s+")
+MIN_SENTENCE_CHARS = 20
+TTS_MODEL = "tts-1"
+TTS_SAMPLE_RATE = 24000           # formato "pcm" di OpenAI: 24 kHz, int16 mono little-endian
+TTS_CHUNK_BYTES = 4800            # 100 ms di PCM per chunk HTTP
+PLAYBACK_PREBUFFER = 0.2          # audio accumulato prima di avviare l'uscita (s)
+PLAYBACK_WRITE_DURATION = 0.02    # granularità delle scritture, limita la latenza di cancel() (s)
+PLAYBACK_LEVEL_HISTORY = 200      # livelli recenti del segnale riprodotto, riferimento per l'eco
+STREAMING_TTS_FORMATS = ("pcm",)
+TTS_PARALLEL = 3                  # pezzi della stessa risposta sintetizzati in anticipo
+TTS_MAX_IN_FLIGHT = int(os.getenv("TTS_MAX_IN_FLIGHT", "4"))   # richieste TTS simultanee nel processo
+TTS_MAX_CHUNK_CHARS = 250         # oltre questa lunghezza una frase viene spezzata alle pause
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "py-speak-with-ai", "tts"))
+TTS_CACHE_MEMORY_MB = int(os.getenv("TTS_CACHE_MEMORY_MB", "32"))
+TTS_CACHE_DISK_MB = int(os.getenv("TTS_CACHE_DISK_MB", "256"))
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", os.path.join(os.path.expanduser("~"), ".cache", "py-speak-with-ai", "responses.sqlite3"))
+RESPONSE_CACHE_TTL_HOURS = float(os.getenv("RESPONSE_CACHE_TTL_HOURS", "24"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+# Domande la cui risposta dipende dal momento: non vengono mai servite dalla cache.
+# Termini italiani e inglesi, confrontati con il testo normalizzato (minuscolo, senza punteggiatura)
+RESPONSE_CACHE_BYPASS = re.compile(
+    r"\b(ore|ora|orario|oggi|domani|ieri|adesso|stasera|stamattina|data|giorno|settimana|mese|anno|"
+    r"meteo|tempo fa|temperatura|notizie|news|ultim[aeio]|attual[ei]|prezz[io]|quotazion[ei]|risultat[io]|partita|"
+    r"time|today|tonight|tomorrow|yesterday|now|this morning|date|day|week|month|year|"
+    r"weather|forecast|temperature|latest|current|currently|prices?|stocks?|scores?|results?|match|game)\b"
+)
+ECHO_GATE_MODES = ("off", "mute", "duck", "suppress")
+LOG_HISTORY = 2000                # voci di log conservate per le letture a cursore
+TRACE_DIR = os.getenv("TRACE_DIR", "traces")   # destinazione delle tracce con settings["trace"] = True
+# Istogrammi per stadio, contatori ed endpoint /metrics; METRICS_ENABLED=0 disattiva tutto il livello
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() not in ("0", "false", "no", "off")
+
+@dataclass
+class VadConfig:
+    block_duration: float = 0.03      # durata di un blocco letto dallo stream (s)
+    frame_duration: float = 0.01      # finestra di analisi energia/ZCR (s)
+    energy_threshold: float = 0.015   # RMS minimo di un frame parlato
+    zcr_max: float = 0.25             # oltre questo tasso di zero-crossing il frame è rumore
+    speech_start: float = 0.09        # parlato continuo necessario per aprire l'enunciato (s)
+    trailing_silence: float = 0.8     # silenzio finale che chiude l'enunciato (s)
+    max_utterance: float = 15.0       # durata massima di un enunciato (s)
+    start_timeout: float = 10.0       # attesa massima dell'inizio del parlato (s)
+    preroll: float = 0.3              # audio conservato prima dell'inizio del parlato (s)
+
+@dataclass
+class SpeechGate:
+    min_rms: float = 0.004            # RMS minimo dell'intera registrazione
+    min_peak: float = 0.05            # picco minimo (ampiezza normalizzata)
+    min_voiced_ratio: float = 0.08    # frazione minima di frame parlati
+
+    def passes(self, stats):
+        return (
+            stats["rms"] >= self.min_rms
+            and stats["peak"] >= self.min_peak
+            and stats["voiced_ratio"] >= self.min_voiced_ratio
+        )
+
+# Epoche uniche nel processo: una sessione ricreata con lo stesso id non si confonde con la precedente
+_epochs = count()
+
 @dataclass
 class AppState:
     is_running: bool = False
     current_status: str = "Inattivo"
     conversation: list = field(default_factory=list)
     settings: dict = field(default_factory=dict)
+    # Epoca della conversazione (cambia a ogni reset) e ultima voce di log già applicata
+    epoch: int = field(default_factory=lambda: next(_epochs))
+    log_cursor: int = 0
     _lock: threading.Lock = field(default_factory=threading.Lock)
 
     # Aggiungi questo metodo
@@ -49,151 +176,1674 @@ class AppState:
         with self._lock:
             self.conversation.append(f"{user}\n{system}\n")
     
+    def sync(self, log, epoch=None, count=0):
+        # Applica una sola volta le voci di log nuove (stato e conversazione sono condivisi tra le schede)
+        # e restituisce le righe che il lettore fermo a (epoch, count) non ha ancora ricevuto
+        with self._lock:
+            entries, self.log_cursor = log.read_since(self.log_cursor)
+            for entry in entries:
+                if entry['user'] == "**[ASCOLTO]**":
+                    self.current_status = "🎤 Ascolto"
+                elif "PENSO" in entry['system']:
+                    self.current_status = "⏳ Elaborazione"
+                elif "[PARLO]" in entry['system']:
+                    self.current_status = "🔊 Riproduzione"
+                    self.conversation.append(f"{entry['user']}\n{entry['system'].replace('[PARLO]', '')}\n")
+                elif entry['system'] == "**[PRONTO]**":
+                    self.current_status = "✅ Pronto"
+            if epoch != self.epoch or count > len(self.conversation):
+                count = 0
+            return self.epoch, count, self.conversation[count:], self.current_status
+
+    def start(self, settings):
+        with self._lock:
+            self.is_running = True
+            self.settings = settings
+
     def stop(self):
         with self._lock:
             self.is_running = False
     
     def reset(self):
+        # Le schede aperte riconoscono la nuova epoca e ridisegnano la conversazione da capo
         with self._lock:
-            self.__init__()
+            self.__init__(log_cursor=self.log_cursor)
 
 class LogManager:
-    def __init__(self):
-        self.queue = Queue(maxsize=100)
-        self.history = []
+    # Log con numero di sequenza: ogni lettore (schede della GUI, replay) tiene il proprio cursore
+    # e legge solo le voci nuove, senza consumarle
+    def __init__(self, max_entries=LOG_HISTORY):
+        self.history = deque(maxlen=max_entries)
+        self.seq = 0
         self._lock = threading.Lock()
 
     def add_log(self, user_msg, system_msg):
         with self._lock:
-            entry = {
+            self.seq += 1
+            self.history.append({
+                "seq": self.seq,
                 "timestamp": datetime.now().isoformat(),
                 "user": user_msg,
                 "system": system_msg
-            }
+            })
+
+    def read_since(self, cursor):
+        # Voci successive a `cursor` e nuovo cursore; costo proporzionale alle sole voci nuove
+        with self._lock:
+            missing = min(self.seq - cursor, len(self.history))
+            if missing <= 0:
+                return [], self.seq
+            return list(islice(reversed(self.history), missing))[::-1], self.seq
+
+class Cancelled(Exception):
+    pass
+
+class CancelToken:
+    # Annullamento cooperativo di un turno: chi esegue operazioni bloccanti registra
+    # una callback (chiusura dello stream HTTP, stop della riproduzione)
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
             try:
-                self.queue.put_nowait(entry)
-                self.history.append(entry)
-            except:
+                callback()
+            except Exception:
                 pass
 
-    def get_logs(self):
-        logs = []
-        while True:
-            try:
-                logs.append(self.queue.get_nowait())
-            except Empty:
-                break
-        return logs
+    def on_cancel(self, callback):
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def check(self):
+        if self.cancelled:
+            raise Cancelled()
+
+    def wait(self, timeout):
+        return self._event.wait(timeout)
+
+_blocking_calls = ThreadPoolExecutor(max_workers=32, thread_name_prefix="blocking-call")
+# Pool dedicato alla sintesi: la sua dimensione è il tetto alle richieste TTS contemporanee
+_tts_workers = ThreadPoolExecutor(max_workers=TTS_MAX_IN_FLIGHT, thread_name_prefix="tts")
+_conversation_lock = threading.Lock()
+
+def _discard_result(future):
+    # Risultato di una chiamata abbandonata: chiude eventuali stream HTTP rimasti aperti
+    if future.cancelled() or future.exception() is not None:
+        return
+    result = future.result()
+    if hasattr(result, "close"):
+        result.close()
+
+def call_cancellable(fn, token, *args, hedge_after=None, **kwargs):
+    # Esegue una chiamata bloccante in un thread dedicato e la abbandona se il token viene annullato.
+    # Con hedge_after, se la prima richiesta supera quel tempo ne parte una seconda identica
+    # e vince la prima che termina con successo
+    if token is None and hedge_after is None:
+        return fn(*args, **kwargs)
+    if token is not None:
+        token.check()
+    finished = threading.Event()
+    futures = [_blocking_calls.submit(bind_context(fn), *args, **kwargs)]
+    futures[0].add_done_callback(lambda _: finished.set())
+    if token is not None:
+        token.on_cancel(finished.set)
+    if hedge_after is not None and not finished.wait(hedge_after) and not (token is not None and token.cancelled):
+        metrics.incr("hedged_requests")
+        futures.append(_blocking_calls.submit(bind_context(fn), *args, **kwargs))
+        futures[1].add_done_callback(lambda _: finished.set())
+    while True:
+        finished.wait(CAPTURE_POLL_INTERVAL)
+        finished.clear()
+        cancelled = token is not None and token.cancelled
+        winner = None if cancelled else next(
+            (future for future in futures if future.done() and future.exception() is None), None
+        )
+        if cancelled or winner is not None or all(future.done() for future in futures):
+            break
+    for future in futures:
+        if future is not winner:
+            future.add_done_callback(_discard_result)
+    if cancelled:
+        raise Cancelled()
+    if winner is None:
+        return futures[0].result()
+    if winner is not futures[0]:
+        metrics.incr("hedged_wins")
+    return winner.result()
+
+class BudgetExhausted(Exception):
+    pass
+
+class TurnBudget:
+    # Tempo a disposizione di un turno, condiviso da tutti gli stadi: fissa i timeout HTTP
+    # e decide se c'è ancora margine per un nuovo tentativo
+    def __init__(self, seconds=TURN_BUDGET_SECONDS, token=None):
+        self.seconds = seconds
+        self.deadline = time.monotonic() + seconds
+        self.token = token
+        self.speaking = False
+        self._backoff = wait_random_exponential(multiplier=0.5, max=4)
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        return max(0.0, self.deadline - time.monotonic())
+
+    def timeout(self, cap):
+        remaining = self.remaining()
+        if remaining < BUDGET_MIN_ATTEMPT:
+            raise BudgetExhausted()
+        seconds = min(cap, remaining)
+        return httpx.Timeout(seconds, connect=min(HTTP_CONNECT_TIMEOUT, seconds))
+
+    def speech_timeout(self, cap=TTS_TIMEOUT):
+        # Il budget copre solo la prima richiesta TTS: i pezzi successivi di una risposta lunga
+        # usano il timeout normale, altrimenti la risposta verrebbe interrotta a metà
+        with self._lock:
+            first, self.speaking = not self.speaking, True
+        if first:
+            return self.timeout(cap)
+        return httpx.Timeout(cap, connect=min(HTTP_CONNECT_TIMEOUT, cap))
+
+    def _exhausted(self, retry_state):
+        return self.remaining() < BUDGET_MIN_ATTEMPT
+
+    def _wait(self, retry_state):
+        # Backoff esponenziale con jitter, mai oltre il tempo residuo
+        return min(self._backoff(retry_state), max(0.0, self.remaining() - BUDGET_MIN_ATTEMPT))
+
+    def _give_up(self, retry_state):
+        # Tentativi finiti per mancanza di tempo: BudgetExhausted, altrimenti l'errore originale
+        if self._exhausted(retry_state):
+            raise BudgetExhausted() from retry_state.outcome.exception()
+        return retry_state.outcome.result()
+
+    @staticmethod
+    def _count_retry(stage):
+        # Ogni nuovo tentativo viene contato sullo stadio che lo ha richiesto
+        return (lambda retry_state: metrics.retried(stage)) if stage else None
+
+    def retrying(self, attempts=RETRY_ATTEMPTS, stage=None):
+        return Retrying(
+            stop=stop_any(stop_after_attempt(attempts), self._exhausted),
+            wait=self._wait,
+            retry=retry_if_not_exception_type((Cancelled, BudgetExhausted)),
+            sleep=self.token.wait if self.token is not None else time.sleep,
+            before_sleep=self._count_retry(stage),
+            retry_error_callback=self._give_up,
+        )
+
+    def async_retrying(self, attempts=RETRY_ATTEMPTS, stage=None):
+        # Variante asyncio: la cancellazione del task non deve essere trattata come un errore da ritentare
+        return AsyncRetrying(
+            stop=stop_any(stop_after_attempt(attempts), self._exhausted),
+            wait=self._wait,
+            retry=retry_if_not_exception_type((Cancelled, BudgetExhausted, asyncio.CancelledError)),
+            before_sleep=self._count_retry(stage),
+            retry_error_callback=self._give_up,
+        )
 
 log_manager = LogManager()
+metrics = PipelineMetrics(enabled=METRICS_ENABLED)
 stop_event = threading.Event()
 
+def http_client_options():
+    return {
+        "http2": HTTP2_AVAILABLE,
+        "limits": httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        "timeout": httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+    }
+
+@lru_cache(maxsize=1)
+def get_http_client():
+    # Pool condiviso da Whisper, chat e TTS: le tre chiamate del turno riusano connessioni già aperte.
+    # Il trasporto registra le richieste solo mentre una traccia è attiva
+    options = http_client_options()
+    transport = httpx.HTTPTransport(http2=options.pop("http2"), limits=options.pop("limits"))
+    return httpx.Client(transport=RecordingTransport(transport), **options)
+
 @lru_cache(maxsize=1)
 def get_openai_client():
-    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    # I tentativi sono gestiti da TurnBudget: niente retry interni del client
+    return OpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        base_url=OPENAI_BASE_URL,
+        http_client=get_http_client(),
+        max_retries=0
+    )
+
+def warm_up_client(connections=HTTP_WARMUP_CONNECTIONS, log=None):
+    # DNS, TLS e apertura delle connessioni prima del primo turno, con richieste leggere in parallelo
+    started = time.monotonic()
+    client = get_openai_client().with_options(timeout=httpx.Timeout(5.0, connect=HTTP_CONNECT_TIMEOUT))
+
+    def probe(_):
+        client.models.retrieve("whisper-1")
 
-@contextmanager
-def temp_audio_file():
-    filename = f"temp_{uuid.uuid4()}.wav"
     try:
-        yield filename
+        with ThreadPoolExecutor(max_workers=max(1, connections)) as pool:
+            list(pool.map(probe, range(max(1, connections))))
+        metrics.observe("http_warmup_seconds", time.monotonic() - started)
+        return True
+    except Exception as e:
+        metrics.incr("http_warmup_failures")
+        (log or log_manager).add_log("SYSTEM", f"Warm-up connessioni fallito: {str(e)}")
+        return False
+
+def wav_buffer(recording, samplerate=SAMPLE_RATE, name="audio.wav"):
+    buffer = io.BytesIO()
+    scipy.io.wavfile.write(buffer, samplerate, recording)
+    buffer.name = name
+    buffer.seek(0)
+    return buffer
+
+def normalize_gain(samples, target_peak=UPLOAD_TARGET_PEAK, max_gain=UPLOAD_MAX_GAIN):
+    peak = float(np.max(np.abs(samples))) if samples.size else 0.0
+    if peak == 0.0:
+        return samples
+    return samples * min(max_gain, target_peak / peak)
+
+def encode_upload(recording, samplerate=SAMPLE_RATE, audio_format="wav", target_rate=UPLOAD_SAMPLE_RATE):
+    start = time.perf_counter()
+    samples = np.asarray(recording, dtype=np.float32).reshape(-1)
+    if samplerate != target_rate:
+        divisor = math.gcd(samplerate, target_rate)
+        samples = resample_poly(samples, target_rate // divisor, samplerate // divisor)
+    samples = normalize_gain(samples)
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+
+    buffer = None
+    if audio_format in ("flac", "opus") and sf is not None:
+        try:
+            buffer = io.BytesIO()
+            if audio_format == "flac":
+                sf.write(buffer, pcm, target_rate, format="FLAC")
+                buffer.name = "audio.flac"
+            else:
+                sf.write(buffer, pcm, target_rate, format="OGG", subtype="OPUS")
+                buffer.name = "audio.ogg"
+            buffer.seek(0)
+        except (RuntimeError, ValueError, TypeError):
+            # libsndfile senza supporto al formato richiesto: ripiego su WAV
+            buffer = None
+    if buffer is None:
+        buffer = wav_buffer(pcm, target_rate)
+
+    stats = {
+        "upload_bytes": len(buffer.getbuffer()),
+        "encode_seconds": time.perf_counter() - start,
+    }
+    metrics.observe_stage("encode", stats["encode_seconds"])
+    return buffer, stats
+
+def archive_audio(directory, prefix, data, extension):
+    # Scrittura su disco solo se l'archiviazione è esplicitamente abilitata
+    if not directory:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{prefix}_{uuid.uuid4()}.{extension}")
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+def voiced_frames(samples, frame_len, vad):
+    samples = np.asarray(samples, dtype=np.float32).reshape(-1)
+    n_frames = len(samples) // frame_len
+    if n_frames == 0:
+        return np.zeros(0, dtype=bool)
+    frames = samples[:n_frames * frame_len].reshape(n_frames, frame_len)
+    rms = np.sqrt(np.mean(np.square(frames), axis=1))
+    zcr = np.mean(np.signbit(frames[:, 1:]) != np.signbit(frames[:, :-1]), axis=1)
+    return (rms >= vad.energy_threshold) & (zcr <= vad.zcr_max)
+
+def speech_stats(recording, vad=None):
+    vad = vad or VadConfig()
+    samples = np.asarray(recording, dtype=np.float32).reshape(-1)
+    if samples.size == 0:
+        return {"rms": 0.0, "peak": 0.0, "voiced_ratio": 0.0}
+    voiced = voiced_frames(samples, int(SAMPLE_RATE * vad.frame_duration), vad)
+    return {
+        "rms": float(np.sqrt(np.mean(np.square(samples)))),
+        "peak": float(np.max(np.abs(samples))),
+        "voiced_ratio": float(voiced.mean()) if voiced.size else 0.0,
+    }
+
+def _trailing_run(flags):
+    # Numero di frame consecutivi a True in coda all'array
+    breaks = np.flatnonzero(~flags)
+    return len(flags) if len(breaks) == 0 else int(len(flags) - breaks[-1] - 1)
+
+@dataclass
+class AudioSlice:
+    # Riferimento a un intervallo di campioni del ring buffer, copiato solo quando serve
+    engine: "CaptureEngine"
+    start: int
+    end: int
+    data: np.ndarray = None
+
+    @property
+    def duration(self):
+        return (self.end - self.start) / self.engine.samplerate
+
+    def detach(self):
+        # Copia propria dei campioni: un turno in coda può sopravvivere all'intervallo nel ring
+        # buffer, che in modalità sovrapposta viene sovrascritto mentre il turno è ancora in lavorazione
+        if self.data is not None:
+            return self
+        return replace(self, data=self.to_array())
+
+    def segments(self):
+        if self.data is not None:
+            return [self.data]
+        return self.engine.segments(self.start, self.end)
+
+    def samples(self):
+        # Vista senza copia se l'intervallo non attraversa la fine del buffer
+        parts = self.segments()
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def to_array(self):
+        return np.concatenate(self.segments()) if self.end > self.start else np.zeros(0, dtype=np.float32)
+
+class CaptureEngine:
+    # Un solo InputStream persistente che scrive in un ring buffer preallocato;
+    # gli indici dei campioni sono assoluti dall'avvio dello stream
+    def __init__(self, samplerate=SAMPLE_RATE, capacity_seconds=CAPTURE_BUFFER_SECONDS,
+                 block_duration=CAPTURE_BLOCK_DURATION, stream_factory=None, echo_gate=None):
+        self.samplerate = samplerate
+        self.echo_gate = echo_gate
+        self.capacity = int(samplerate * capacity_seconds)
+        self.block_len = int(samplerate * block_duration)
+        self.stream_factory = stream_factory or sd.InputStream
+        self.buffer = np.zeros(self.capacity, dtype=np.float32)
+        self.written = 0
+        self.last_write_time = 0.0
+        self.overflows = 0
+        self._cond = threading.Condition()
+        self._stream = None
+
+    @property
+    def oldest(self):
+        return max(0, self.written - self.capacity)
+
+    def start(self):
+        if self._stream is None:
+            self._stream = self.stream_factory(
+                samplerate=self.samplerate, channels=1, dtype="float32",
+                blocksize=self.block_len, callback=self._callback
+            )
+            self._stream.start()
+        return self
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.stop()
+            self._stream.close()
+            self._stream = None
+        with self._cond:
+            self._cond.notify_all()
+
+    def _callback(self, indata, frames, time_info, status):
+        if status:
+            self.overflows += 1
+        samples = indata[:, 0]
+        if self.echo_gate is not None:
+            samples = self.echo_gate.process(samples)
+        self.write(samples)
+
+    def write(self, samples):
+        count = len(samples)
+        if count > self.capacity:
+            samples = samples[-self.capacity:]
+            with self._cond:
+                self.written += count - self.capacity
+            count = self.capacity
+        offset = self.written % self.capacity
+        first = min(count, self.capacity - offset)
+        self.buffer[offset:offset + first] = samples[:first]
+        self.buffer[:count - first] = samples[first:]
+        with self._cond:
+            self.written += count
+            self.last_write_time = time.monotonic()
+            self._cond.notify_all()
+
+    def time_of(self, index):
+        # Istante (monotonic) approssimato in cui il campione `index` è stato acquisito
+        return self.last_write_time - (self.written - index) / self.samplerate
+
+    def wait_for(self, index, timeout=None):
+        with self._cond:
+            return self._cond.wait_for(lambda: self.written >= index, timeout)
+
+    def segments(self, start, end):
+        if start < self.oldest or end > self.written:
+            raise ValueError(f"Campioni {start}-{end} non disponibili nel buffer")
+        offset = start % self.capacity
+        count = end - start
+        if offset + count <= self.capacity:
+            return [self.buffer[offset:offset + count]]
+        return [self.buffer[offset:], self.buffer[:offset + count - self.capacity]]
+
+    def slice(self, start, end):
+        return AudioSlice(self, start, end)
+
+class EchoGate:
+    # Evita che il microfono trascriva la voce dell'assistente mentre è in riproduzione:
+    # "mute" azzera l'ingresso, "duck" lo attenua, "suppress" lo azzera solo se il livello
+    # è compatibile con l'eco del segnale TTS noto (il parlato più forte dell'eco passa)
+    def __init__(self, playback, mode="duck", duck_gain=0.2, hangover=0.3, coupling=0.6):
+        if mode not in ECHO_GATE_MODES:
+            raise ValueError(f"Modalità echo gate non valida: {mode}")
+        self.playback = playback
+        self.mode = mode
+        self.duck_gain = duck_gain
+        self.hangover = hangover
+        self.coupling = coupling
+        self.suppressed_frames = 0
+
+    def active(self):
+        # Il riverbero della stanza e la latenza del dispositivo coprono ancora `hangover` secondi
+        return self.playback.seconds_since_output() < self.hangover
+
+    def process(self, samples):
+        if self.mode == "off" or not self.active():
+            return samples
+        if self.mode == "duck":
+            gated = samples * self.duck_gain
+        else:
+            if self.mode == "suppress":
+                level = float(np.sqrt(np.mean(np.square(samples)))) if len(samples) else 0.0
+                if level >= self.coupling * self.playback.reference_level(self.hangover):
+                    return samples
+            gated = np.zeros_like(samples)
+        self.suppressed_frames += 1
+        metrics.incr("echo_suppressed_frames")
+        return gated
+
+def echo_gate_mode(settings, barge_in, log=None):
+    # Con il barge-in l'Endpointer deve sentire chi interrompe: l'ingresso attenuato ("duck") o
+    # azzerato ("mute") lo nasconde, quindi di default si scartano solo i frame compatibili con l'eco
+    mode = settings.get("echo_gate", "suppress" if barge_in else "duck")
+    if barge_in and mode in ("mute", "duck"):
+        (log or log_manager).add_log("SYSTEM", f"Barge-in con echo gate \"{mode}\": le interruzioni a voce bassa non verranno rilevate")
+    return mode
+
+class Endpointer:
+    # Segmenta l'audio del CaptureEngine in enunciati, leggendo in avanti da `cursor`
+    def __init__(self, engine, vad=None, on_speech_start=None, stop=None):
+        self.engine = engine
+        self.vad = vad or VadConfig()
+        self.on_speech_start = on_speech_start
+        self.stop = stop
+        self.cursor = engine.written
+
+    def reset(self):
+        self.cursor = self.engine.written
+
+    def _next_block(self, length):
+        if self.cursor < self.engine.oldest:
+            # Consumatore rimasto indietro oltre la capienza del buffer
+            metrics.incr("capture_overruns")
+            self.cursor = self.engine.oldest
+        if self.stop is not None and self.stop.is_set():
+            raise Cancelled()
+        written = self.engine.written
+        progressed_at = time.monotonic()
+        while not self.engine.wait_for(self.cursor + length, timeout=CAPTURE_POLL_INTERVAL):
+            if self.stop is not None and self.stop.is_set():
+                raise Cancelled()
+            if self.engine.written != written:
+                written = self.engine.written
+                progressed_at = time.monotonic()
+            elif time.monotonic() - progressed_at >= CAPTURE_STALL_TIMEOUT:
+                raise sd.PortAudioError("Nessun audio dal microfono")
+        start = self.cursor
+        self.cursor += length
+        return start, np.concatenate(self.engine.segments(start, self.cursor))
+
+    def fixed(self, seconds=FIXED_RECORD_SECONDS):
+        start, _ = self._next_block(int(self.engine.samplerate * seconds))
+        return self.engine.slice(start, self.cursor)
+
+    def next_utterance(self):
+        vad = self.vad
+        samplerate = self.engine.samplerate
+        block_len = int(samplerate * vad.block_duration)
+        frame_len = int(samplerate * vad.frame_duration)
+        frame_time = frame_len / samplerate
+        block_time = block_len / samplerate
+
+        onset = None
+        start = None
+        speech_run = 0.0
+        silence = 0.0
+        waited = 0.0
+
+        while True:
+            block_start, block = self._next_block(block_len)
+            voiced = voiced_frames(block, frame_len, vad)
+
+            if start is None:
+                trailing = _trailing_run(voiced)
+                if trailing == 0:
+                    onset = None
+                elif trailing < len(voiced) or onset is None:
+                    onset = block_start + (len(voiced) - trailing) * frame_len
+                speech_run = speech_run + trailing * frame_time if trailing == len(voiced) else trailing * frame_time
+                if speech_run >= vad.speech_start:
+                    # Guarda indietro di `preroll` per non tagliare le prime sillabe
+                    start = max(self.engine.oldest, onset - int(samplerate * vad.preroll))
+                    if self.on_speech_start:
+                        self.on_speech_start(onset)
+                    continue
+                waited += block_time
+                if waited >= vad.start_timeout:
+                    return None
+                continue
+
+            trailing_silence = _trailing_run(~voiced)
+            silence = silence + block_time if trailing_silence == len(voiced) else trailing_silence * frame_time
+            if silence >= vad.trailing_silence or (self.cursor - start) / samplerate >= vad.max_utterance:
+                return self.engine.slice(start, self.cursor)
+
+def record_utterance(vad=None, stream_factory=None):
+    engine = CaptureEngine(stream_factory=stream_factory).start()
+    try:
+        utterance = Endpointer(engine, vad).next_utterance()
+        return None if utterance is None else utterance.to_array()
     finally:
-        if os.path.exists(filename):
-            os.remove(filename)
+        engine.close()
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1))
-def record_audio(filename):
+def record_audio(vad=None, log=None):
+    # Nessun retry: ripetere la registrazione perderebbe ciò che l'utente ha già detto
     try:
-        recording = sd.rec(int(44100 * 5), samplerate=44100, channels=1)
-        sd.wait()
-        scipy.io.wavfile.write(filename, 44100, recording)
+        with metrics.span("record"):
+            if vad is None:
+                recording = sd.rec(int(SAMPLE_RATE * FIXED_RECORD_SECONDS), samplerate=SAMPLE_RATE, channels=1)
+                sd.wait()
+            else:
+                recording = record_utterance(vad)
+        return recording
     except sd.PortAudioError as e:
-        log_manager.add_log("SYSTEM", f"Errore registrazione: {str(e)}")
+        (log or log_manager).add_log("SYSTEM", f"Errore registrazione: {str(e)}")
         raise
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1))
-def transcribe_audio(filename, language):
-    try:
-        with open(filename, "rb") as audio_file:
-            transcript = get_openai_client().audio.transcriptions.create(
-                file=audio_file,
-                model="whisper-1",
-                language=language
-            )
-        return transcript.text
-    except Exception as e:
-        log_manager.add_log("SYSTEM", f"Errore trascrizione: {str(e)}")
-        raise
+def transcribe_audio(audio_file, language, token=None, budget=None, log=None):
+    budget = budget or TurnBudget(token=token)
+    # Il file viene passato come bytes: tentativi e richieste hedged non condividono la posizione di lettura
+    upload = (audio_file.name, audio_file.getvalue())
+    with metrics.span("transcribe") as span:
+        for attempt in budget.retrying(stage="transcribe"):
+            with attempt:
+                if token is not None:
+                    token.check()
+                timeout = budget.timeout(TRANSCRIBE_TIMEOUT)
+                span.uploaded(len(upload[1]))
+                try:
+                    transcript = get_openai_client().audio.transcriptions.create(
+                        file=upload,
+                        model="whisper-1",
+                        language=language,
+                        timeout=timeout
+                    )
+                except Exception as e:
+                    (log or log_manager).add_log("SYSTEM", f"Errore trascrizione: {str(e)}")
+                    raise
+        span.downloaded(len(transcript.text.encode("utf-8")))
+    return transcript.text
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1))
-def get_chatgpt_response(prompt, model):
-    try:
-        response = get_openai_client().chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        log_manager.add_log("SYSTEM", f"Errore GPT: {str(e)}")
-        raise
+def _word_key(word):
+    return re.sub(r"[^\w]", "", word.casefold())
 
-def synthesize_speech(text, voice):
-    try:
-        filename = f"response_{uuid.uuid4()}.mp3"
+def stitch_transcripts(parts, max_overlap=STITCH_MAX_WORDS):
+    # Unisce le trascrizioni di blocchi sovrapposti: la coda della precedente che coincide con
+    # l'inizio della successiva (ignorando maiuscole e punteggiatura) viene tenuta una volta sola
+    words = []
+    for part in parts:
+        incoming = part.split()
+        keys = [_word_key(word) for word in incoming]
+        tail = [_word_key(word) for word in words[-max_overlap:]]
+        for size in range(min(len(tail), len(keys)), 0, -1):
+            if tail[-size:] == keys[:size]:
+                incoming = incoming[size:]
+                break
+        words.extend(incoming)
+    return " ".join(words)
+
+class ChunkedUtterance:
+    # Un enunciato in corso: i blocchi vengono inviati a Whisper appena il ring buffer li contiene
+    def __init__(self, transcriber, start):
+        self.transcriber = transcriber
+        self.token = CancelToken()
+        self.budget = TurnBudget(transcriber.budget_seconds, self.token)
+        self.next_start = start
+        self.covered = start
+        self.end = None
+        self.chunks = []
+        self._finished = threading.Event()
+        self._thread = threading.Thread(target=bind_context(self._run), daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        engine = self.transcriber.engine
+        while True:
+            chunk_end = self.next_start + self.transcriber.chunk_len
+            while not engine.wait_for(chunk_end, timeout=CAPTURE_POLL_INTERVAL):
+                if self._finished.is_set() or self.token.cancelled:
+                    return
+            if self.token.cancelled or (self.end is not None and chunk_end > self.end):
+                return
+            self._submit(self.next_start, chunk_end)
+            self.next_start = chunk_end - self.transcriber.overlap_len
+
+    def _submit(self, start, end):
+        # Copia subito i campioni: il ring buffer verrà sovrascritto
+        samples = np.concatenate(self.transcriber.engine.segments(start, end))
+        self.chunks.append(_blocking_calls.submit(bind_context(self.transcriber.transcribe_chunk), samples, self.token, self.budget))
+        self.covered = end
+
+    def finish(self, end):
+        # Fine del parlato: resta da inviare solo l'audio successivo all'ultimo blocco
+        self.end = end
+        self._finished.set()
+        self._thread.join()
+        if end - self.covered >= self.transcriber.min_tail_len or not self.chunks:
+            self._submit(self.next_start, end)
+        metrics.incr("transcribe_chunks", len(self.chunks))
+        return self
+
+    def cancel(self):
+        self.token.cancel()
+        self._finished.set()
+
+    def result(self, token=None):
+        if token is not None:
+            token.on_cancel(self.token.cancel)
+        texts = []
+        for future in self.chunks:
+            while True:
+                try:
+                    texts.append(future.result(timeout=CAPTURE_POLL_INTERVAL))
+                    break
+                except FutureTimeout:
+                    if self.token.cancelled:
+                        raise Cancelled()
+        return stitch_transcripts(text for text in texts if text)
+
+class IncrementalTranscriber:
+    # Trascrizione durante il parlato: blocchi di chunk_seconds sovrapposti di overlap_seconds,
+    # così a fine enunciato resta da trascrivere solo l'ultimo pezzo
+    def __init__(self, engine, language, upload_format="wav", gate=None, vad=None,
+                 chunk_seconds=CHUNK_SECONDS, overlap_seconds=CHUNK_OVERLAP, budget_seconds=TURN_BUDGET_SECONDS, log=None):
+        self.engine = engine
+        self.language = language
+        self.upload_format = upload_format
+        self.gate = gate or SpeechGate()
+        self.vad = vad or VadConfig()
+        self.chunk_len = int(engine.samplerate * chunk_seconds)
+        self.overlap_len = int(engine.samplerate * overlap_seconds)
+        self.min_tail_len = int(engine.samplerate * CHUNK_MIN_TAIL)
+        self.budget_seconds = budget_seconds
+        self.log = log
+        self.current = None
+
+    def begin(self, onset):
+        # Chiamata dall'Endpointer all'inizio del parlato, con lo stesso pre-roll della registrazione
+        self.discard()
+        start = max(self.engine.oldest, onset - int(self.engine.samplerate * self.vad.preroll))
+        self.current = ChunkedUtterance(self, start)
+
+    def finish(self, recording):
+        utterance, self.current = self.current, None
+        if utterance is None or recording is None:
+            return None
+        return utterance.finish(recording.end)
+
+    def discard(self):
+        utterance, self.current = self.current, None
+        if utterance is not None:
+            utterance.cancel()
+
+    def transcribe_chunk(self, samples, token, budget):
+        if token.cancelled:
+            return ""
+        if not self.gate.passes(speech_stats(samples, self.vad)):
+            # Solo silenzio (es. la pausa finale): Whisper tende a inventare testo
+            return ""
+        audio_file, _ = encode_upload(samples, self.engine.samplerate, audio_format=self.upload_format)
+        return transcribe_audio(audio_file, self.language, token, budget, self.log)
+
+def get_chatgpt_response(prompt, model, token=None, budget=None, messages=None, log=None):
+    budget = budget or TurnBudget(token=token)
+    with metrics.span("chat") as span:
+        for attempt in budget.retrying(stage="chat"):
+            with attempt:
+                if token is not None:
+                    token.check()
+                timeout = budget.timeout(CHAT_TIMEOUT)
+                try:
+                    response = get_openai_client().chat.completions.create(
+                        model=model,
+                        messages=messages or [{"role": "user", "content": prompt}],
+                        timeout=timeout
+                    )
+                except Exception as e:
+                    (log or log_manager).add_log("SYSTEM", f"Errore GPT: {str(e)}")
+                    raise
+        span.downloaded(len((response.choices[0].message.content or "").encode("utf-8")))
+    return response.choices[0].message.content
+
+def open_chatgpt_stream(prompt, model, token=None, budget=None, messages=None, log=None):
+    # Il retry copre solo l'apertura dello stream: a token già ricevuti non si riparte
+    budget = budget or TurnBudget(token=token)
+    for attempt in budget.retrying(stage="chat"):
+        with attempt:
+            if token is not None:
+                token.check()
+            timeout = budget.timeout(CHAT_TIMEOUT)
+            try:
+                stream = get_openai_client().chat.completions.create(
+                    model=model,
+                    messages=messages or [{"role": "user", "content": prompt}],
+                    stream=True,
+                    timeout=timeout
+                )
+            except Exception as e:
+                (log or log_manager).add_log("SYSTEM", f"Errore GPT: {str(e)}")
+                raise
+    return stream
+
+def stream_chatgpt_response(prompt, model, token=None, budget=None, messages=None, log=None):
+    if token is not None and token.cancelled:
+        return
+    # Lo span copre apertura e lettura dello stream; il primo token è misurato a parte
+    with metrics.span("chat") as span:
+        started = time.monotonic()
+        stream = call_cancellable(open_chatgpt_stream, token, prompt, model, token, budget, messages, log)
+        if token is not None:
+            token.on_cancel(stream.close)
+        first = True
+        try:
+            for chunk in stream:
+                if token is not None and token.cancelled:
+                    return
+                if chunk.choices and chunk.choices[0].delta.content:
+                    delta = chunk.choices[0].delta.content
+                    if first:
+                        metrics.observe_stage("chat_first_token", time.monotonic() - started)
+                        first = False
+                    span.downloaded(len(delta.encode("utf-8")))
+                    yield delta
+        except Exception:
+            # Lo stream chiuso da un barge-in termina con un errore di lettura: non è un guasto
+            if token is not None and token.cancelled:
+                return
+            raise
+
+def summarize_conversation(summary, turns, model):
+    # Chiamata fuori dal percorso critico: aggiorna il riassunto con i turni usciti dalla finestra
+    dialogue = "\n".join(f"Utente: {user_text}\nAssistente: {reply}" for user_text, reply in turns)
+    response = get_openai_client().chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": f"Riassunto attuale: {summary or '(vuoto)'}\n\nNuovi turni:\n{dialogue}"},
+        ],
+        timeout=SUMMARY_TIMEOUT
+    )
+    return response.choices[0].message.content.strip()
+
+def create_context(settings):
+    if not settings.get("context", True):
+        return None
+    return ConversationContext(
+        settings.get("system_prompt", SYSTEM_PROMPT),
+        summarize=lambda summary, turns: summarize_conversation(summary, turns, settings["model"]),
+        max_tokens=settings.get("context_tokens", CONTEXT_MAX_TOKENS),
+        metrics=metrics,
+    )
+
+def trace_path(setting):
+    # settings["trace"]: percorso del file zip, oppure True per un nome con data e ora in TRACE_DIR
+    if setting is True:
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        return os.path.join(TRACE_DIR, f"trace-{datetime.now():%Y%m%d-%H%M%S}.zip")
+    return setting
+
+class SentenceSplitter:
+    # Accumula i frammenti di testo e restituisce le frasi man mano che si completano
+    def __init__(self, min_chars=MIN_SENTENCE_CHARS):
+        self.min_chars = min_chars
+        self.buffer = ""
+
+    def feed(self, delta):
+        self.buffer += delta
+        sentences = []
+        start = 0
+        for match in SENTENCE_BOUNDARY.finditer(self.buffer):
+            if match.end() - start >= self.min_chars:
+                sentences.append(self.buffer[start:match.end()].strip())
+                start = match.end()
+        self.buffer = self.buffer[start:]
+        return sentences
+
+    def flush(self):
+        rest, self.buffer = self.buffer.strip(), ""
+        return rest or None
+
+def split_sentences(deltas, min_chars=MIN_SENTENCE_CHARS):
+    splitter = SentenceSplitter(min_chars)
+    for delta in deltas:
+        yield from splitter.feed(delta)
+    rest = splitter.flush()
+    if rest:
+        yield rest
+
+def fetch_speech(text, voice, response_format="mp3", budget=None):
+    with metrics.span("tts") as span:
         response = get_openai_client().audio.speech.create(
-            model="tts-1",
+            model=TTS_MODEL,
             voice=voice,
-            input=text
+            input=text,
+            response_format=response_format,
+            timeout=(budget or TurnBudget()).speech_timeout()
         )
-        
-        with open(filename, "wb") as f:
-            f.write(response.read())
+        audio = response.read()
+        span.downloaded(len(audio))
+    return audio
+
+def stream_speech(text, voice, response_format="pcm", chunk_size=TTS_CHUNK_BYTES, token=None, budget=None):
+    if token is not None and token.cancelled:
+        return
+    request = get_openai_client().audio.speech.with_streaming_response.create(
+        model=TTS_MODEL,
+        voice=voice,
+        input=text,
+        response_format=response_format,
+        timeout=(budget or TurnBudget()).speech_timeout()
+    )
+    # La richiesta parte all'ingresso nel context manager: l'attesa degli header è annullabile
+    with metrics.span("tts") as span:
+        response = call_cancellable(request.__enter__, token)
+        try:
+            if token is not None:
+                token.on_cancel(response.close)
+            for chunk in response.iter_bytes(chunk_size):
+                if token is not None and token.cancelled:
+                    return
+                span.downloaded(len(chunk))
+                yield chunk
+        except Exception:
+            if token is not None and token.cancelled:
+                return
+            raise
+        finally:
+            request.__exit__(None, None, None)
+
+def cached_stream_speech(cache, text, voice, response_format="pcm", chunk_size=TTS_CHUNK_BYTES, token=None, budget=None):
+    # In caso di hit l'audio arriva subito dalla cache; altrimenti lo stream viene copiato
+    # in cache solo se completo
+    key = cache.key(TTS_MODEL, voice, response_format, text)
+    audio, flight = cache.acquire(key, cancelled=(lambda: token.cancelled) if token is not None else None)
+    if flight is None:
+        for start in range(0, len(audio or b""), chunk_size):
+            yield audio[start:start + chunk_size]
+        return
+    chunks = []
+    complete = False
+    try:
+        for chunk in stream_speech(text, voice, response_format, chunk_size, token, budget):
+            chunks.append(chunk)
+            yield chunk
+        complete = token is None or not token.cancelled
+    finally:
+        cache.finish(key, flight, b"".join(chunks) if complete else None)
+
+def decode_to_pcm(audio, audio_format="mp3", samplerate=TTS_SAMPLE_RATE):
+    # Ripiego per formati compressi: decodifica via pydub/ffmpeg
+    sound = AudioSegment.from_file(io.BytesIO(audio), format=audio_format)
+    return sound.set_frame_rate(samplerate).set_channels(1).set_sample_width(2).raw_data
+
+class PlaybackEngine:
+    # Un unico stream di uscita aperto per tutta la sessione e una coda ordinata di chunk PCM
+    def __init__(self, samplerate=TTS_SAMPLE_RATE, prebuffer=PLAYBACK_PREBUFFER,
+                 write_duration=PLAYBACK_WRITE_DURATION, stream_factory=None, log=None):
+        self.samplerate = samplerate
+        # Log della sessione che possiede l'uscita audio: gli errori di riproduzione restano nella sua scheda
+        self.log = log or log_manager
+        self.prebuffer_bytes = int(samplerate * prebuffer) * 2
+        self.write_bytes = int(samplerate * write_duration) * 2
+        self.stream_factory = stream_factory or sd.RawOutputStream
+        self.underruns = 0
+        self.cancelled = 0
+        self.played_bytes = 0
+        self.last_output = 0.0
+        self._levels = deque(maxlen=PLAYBACK_LEVEL_HISTORY)
+        self._queue = Queue()
+        self._lock = threading.Lock()
+        self._drained = threading.Condition(self._lock)
+        self._pending = 0
+        self._generation = 0
+        self._in_reply = False
+        self._stream = None
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    @property
+    def is_playing(self):
+        return self._in_reply or self._pending > 0
+
+    def begin_reply(self, on_start=None):
+        # Restituisce l'identificativo della risposta: i chunk accodati dopo un cancel() vengono scartati
+        return self._put("start", on_start)
+
+    def enqueue(self, chunk, reply=None):
+        self._put("pcm", chunk, reply)
+
+    def end_reply(self, on_done=None, reply=None):
+        self._put("end", on_done, reply)
 
-        def play_audio():
+    def cancel(self):
+        # Invalida tutto ciò che è in coda; la scrittura in corso si ferma entro write_duration
+        with self._lock:
+            self._generation += 1
+            self.cancelled += 1
+        while True:
             try:
-                sound = AudioSegment.from_file(filename, format="mp3")
-                play_obj = sa.play_buffer(
-                    sound.raw_data,
-                    num_channels=sound.channels,
-                    bytes_per_sample=sound.sample_width,
-                    sample_rate=sound.frame_rate
-                )
-                play_obj.wait_done()
-                os.remove(filename)
+                _, kind, payload = self._queue.get_nowait()
+            except Empty:
+                break
+            if kind == "end" and payload:
+                payload()
+            self._task_done()
+
+    def flush(self, timeout=None):
+        with self._lock:
+            return self._drained.wait_for(lambda: self._pending == 0, timeout)
+
+    def seconds_since_output(self):
+        return time.monotonic() - self.last_output
+
+    def reference_level(self, window):
+        # RMS massimo del segnale riprodotto negli ultimi `window` secondi
+        now = time.monotonic()
+        return max((level for at, level in list(self._levels) if now - at <= window), default=0.0)
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth,
+            "underruns": self.underruns,
+            "cancelled": self.cancelled,
+            "played_seconds": self.played_bytes / 2 / self.samplerate,
+        }
+
+    def close(self):
+        self.cancel()
+        self._closed.set()
+        self._thread.join(timeout=1)
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def _put(self, kind, payload, generation=None):
+        with self._lock:
+            self._pending += 1
+            if generation is None:
+                generation = self._generation
+        self._queue.put((generation, kind, payload))
+        return generation
+
+    def _task_done(self):
+        with self._lock:
+            self._pending -= 1
+            if self._pending == 0:
+                self._drained.notify_all()
+
+    def _ensure_stream(self):
+        if self._stream is None:
+            self._stream = self.stream_factory(samplerate=self.samplerate, channels=1, dtype="int16", latency="low")
+            self._stream.start()
+        return self._stream
+
+    def _write(self, data, generation):
+        # Scrittura a piccoli blocchi per poter interrompere la riproduzione rapidamente
+        stream = self._ensure_stream()
+        for offset in range(0, len(data), self.write_bytes):
+            if generation != self._generation:
+                return
+            piece = bytes(data[offset:offset + self.write_bytes])
+            if stream.write(piece) and self.played_bytes:
+                self.underruns += 1
+            self.played_bytes += len(piece)
+            self.last_output = time.monotonic()
+            samples = np.frombuffer(piece[:len(piece) - len(piece) % 2], dtype=np.int16) / 32768.0
+            self._levels.append((self.last_output, float(np.sqrt(np.mean(np.square(samples)))) if samples.size else 0.0))
+
+    def _run(self):
+        pending = bytearray()
+        started = False
+        starving = False
+        on_start = None
+        output_started = 0.0
+        while not self._closed.is_set():
+            try:
+                generation, kind, payload = self._queue.get(timeout=0.05)
+            except Empty:
+                # Coda vuota a metà risposta: il dispositivo resta senza dati
+                if self._in_reply and started and not starving:
+                    self.underruns += 1
+                    starving = True
+                continue
+            try:
+                if generation != self._generation:
+                    if kind == "end" and payload:
+                        payload()
+                    continue
+                if kind == "start":
+                    pending.clear()
+                    started = False
+                    on_start = payload
+                    self._in_reply = True
+                    continue
+                if kind == "pcm":
+                    pending.extend(payload)
+                if kind == "pcm" and not started and len(pending) < self.prebuffer_bytes:
+                    continue
+                if not started and pending:
+                    output_started = time.monotonic()
+                    if on_start:
+                        on_start()
+                started = started or bool(pending)
+                starving = False
+                usable = len(pending) - len(pending) % 2
+                self._write(pending[:usable], generation)
+                del pending[:usable]
+                if kind == "end":
+                    pending.clear()
+                    self._in_reply = False
+                    if started:
+                        # Dal primo campione in uscita all'ultimo scritto, attese della sintesi comprese
+                        metrics.observe_stage("playback", time.monotonic() - output_started)
+                    if payload:
+                        payload()
             except Exception as e:
-                log_manager.add_log("SYSTEM", f"Errore riproduzione: {str(e)}")
+                self.log.add_log("SYSTEM", f"Errore riproduzione: {str(e)}")
+                pending.clear()
+                self._in_reply = False
+                if self._stream is not None:
+                    self._stream.close()
+                    self._stream = None
+            finally:
+                if generation != self._generation:
+                    # Risposta annullata durante la scrittura
+                    pending.clear()
+                    self._in_reply = False
+                self._task_done()
+
+@lru_cache(maxsize=1)
+def get_playback_engine():
+    return PlaybackEngine()
+
+@lru_cache(maxsize=1)
+def get_response_cache():
+    return ResponseCache(
+        RESPONSE_CACHE_PATH, RESPONSE_CACHE_TTL_HOURS * 3600, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_BYPASS, metrics
+    )
+
+@lru_cache(maxsize=1)
+def get_tts_cache():
+    # TTS_CACHE_DIR vuota: solo cache in memoria
+    return TtsCache(TTS_CACHE_DIR or None, TTS_CACHE_MEMORY_MB * 1024 * 1024, TTS_CACHE_DISK_MB * 1024 * 1024, metrics)
 
-        threading.Thread(target=play_audio, daemon=True).start()
+def split_clauses(text, max_chars=TTS_MAX_CHUNK_CHARS):
+    # Le frasi troppo lunghe per una sola richiesta TTS vengono divise alle pause (virgole, punti e virgola)
+    if len(text) <= max_chars:
+        return [text]
+    parts = []
+    current = ""
+    for piece in re.split(r"(?<=[,;:])\s+", text):
+        if current and len(current) + 1 + len(piece) > max_chars:
+            parts.append(current)
+            current = piece
+        else:
+            current = f"{current} {piece}" if current else piece
+    if current:
+        parts.append(current)
+    return parts
 
+def speech_chunks(text, voice, response_format="pcm", archive_dir=None, token=None, budget=None, cache=None):
+    # PCM di un pezzo di risposta: in streaming per "pcm", altrimenti scaricato e decodificato
+    if response_format in STREAMING_TTS_FORMATS:
+        if cache is not None:
+            yield from cached_stream_speech(cache, text, voice, response_format, token=token, budget=budget)
+        else:
+            yield from stream_speech(text, voice, response_format, token=token, budget=budget)
+        return
+    if cache is not None:
+        audio = cache.fetch(
+            cache.key(TTS_MODEL, voice, response_format, text),
+            lambda: call_cancellable(fetch_speech, token, text, voice, response_format, budget),
+            cancelled=(lambda: token.cancelled) if token is not None else None
+        )
+        if audio is None:
+            return
+    else:
+        audio = call_cancellable(fetch_speech, token, text, voice, response_format, budget)
+    archive_audio(archive_dir, "response", audio, response_format)
+    yield decode_to_pcm(audio, response_format)
+
+class SpeechJob:
+    # Sintesi di un pezzo su un worker di _tts_workers; i chunk restano in coda
+    # finché non è il turno di questo pezzo in riproduzione
+    def __init__(self, chunks):
+        self.queue = Queue()
+        self.future = _tts_workers.submit(bind_context(self._run), chunks)
+
+    def _run(self, chunks):
+        metrics.incr("tts_requests")
+        try:
+            for chunk in chunks:
+                self.queue.put(chunk)
+        except Exception as e:
+            self.queue.put(e)
+        finally:
+            self.queue.put(None)
+
+    def __iter__(self):
+        for item in iter(self.queue.get, None):
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+def _feed_speech_jobs(sentences, jobs, make_job, slots, stopped, token=None):
+    # Avvia la sintesi dei pezzi successivi mentre il precedente è in riproduzione,
+    # con al massimo `slots` pezzi avviati e non ancora riprodotti
+    try:
+        for sentence in sentences:
+            for part in split_clauses(sentence):
+                while not slots.acquire(timeout=CAPTURE_POLL_INTERVAL):
+                    if stopped.is_set():
+                        return
+                if stopped.is_set() or (token is not None and token.cancelled):
+                    slots.release()
+                    return
+                jobs.put(make_job(part))
     except Exception as e:
-        log_manager.add_log("SYSTEM", f"Errore sintesi vocale: {str(e)}")
+        jobs.put(e)
+    finally:
+        jobs.put(None)
+
+def speak_sentences(sentences, voice, archive_dir=None, on_first_audio=None, response_format="pcm",
+                    engine=None, on_done=None, token=None, budget=None, cache=None, parallel=TTS_PARALLEL, log=None):
+    # I pezzi vengono sintetizzati in parallelo e accodati al PlaybackEngine nell'ordine della risposta:
+    # il PCM dei pezzi si concatena senza dissolvenze
+    engine = engine or get_playback_engine()
+    streaming = response_format in STREAMING_TTS_FORMATS
+    archived = []
+    reply = engine.begin_reply(on_first_audio)
+    if token is not None:
+        token.on_cancel(engine.cancel)
+    jobs = Queue()
+    slots = threading.Semaphore(max(1, parallel))
+    stopped = threading.Event()
+
+    def make_job(text):
+        return SpeechJob(speech_chunks(text, voice, response_format, archive_dir, token, budget, cache))
+
+    threading.Thread(
+        target=bind_context(_feed_speech_jobs), args=(sentences, jobs, make_job, slots, stopped, token), daemon=True
+    ).start()
+    try:
+        for job in iter(jobs.get, None):
+            if isinstance(job, Exception):
+                raise job
+            try:
+                for chunk in job:
+                    if token is not None and token.cancelled:
+                        break
+                    engine.enqueue(chunk, reply)
+                    if archive_dir and streaming:
+                        archived.append(chunk)
+            finally:
+                slots.release()
+            if token is not None and token.cancelled:
+                break
+    except Cancelled:
+        pass
+    except BudgetExhausted:
         raise
+    except Exception as e:
+        (log or log_manager).add_log("SYSTEM", f"Errore sintesi vocale: {str(e)}")
+        raise
+    finally:
+        stopped.set()
+        engine.end_reply(on_done, reply)
+        if archived:
+            data = b"".join(archived)
+            pcm = np.frombuffer(data[:len(data) - len(data) % 2], dtype=np.int16)
+            archive_audio(archive_dir, "response", wav_buffer(pcm, TTS_SAMPLE_RATE).getvalue(), "wav")
+
+def synthesize_speech(text, voice, archive_dir=None, on_first_audio=None, response_format="pcm", engine=None, token=None, budget=None, cache=None,
+                      parallel=TTS_PARALLEL):
+    speak_sentences(
+        split_sentences([text]), voice, archive_dir, on_first_audio, response_format, engine,
+        token=token, budget=budget, cache=cache, parallel=parallel
+    )
+
+def save_conversation(user_text, reply, session_id=""):
+    # Un solo lock per il processo: le righe di sessioni diverse non si mescolano nel file
+    with _conversation_lock:
+        with open("conversazioni.csv", "a", newline='', encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow([datetime.now().isoformat(), user_text, reply, session_id])
 
-def voice_loop(settings):
-    stop_event.clear()
-    while not stop_event.is_set():
+@dataclass
+class Turn:
+    id: int
+    recording: object = None
+    captured_at: float = 0.0
+    user_text: str = ""
+    reply: str = ""
+    sentences: Queue = field(default_factory=Queue)
+    done: threading.Event = field(default_factory=threading.Event)
+    token: CancelToken = field(default_factory=CancelToken)
+    budget: TurnBudget = None
+    replying: bool = False
+    chunks: object = None
+    marks: dict = field(default_factory=dict)   # istanti (monotonic) delle tappe del turno, per le tracce
+
+class Stage:
+    # Worker con coda limitata: put() blocca quando la coda è piena (backpressure),
+    # oppure scarta il turno se drop_when_full è attivo
+    def __init__(self, name, handler, maxsize=2, drop_when_full=False, log=None):
+        self.name = name
+        self.handler = handler
+        self.log = log or log_manager
+        self.queue = Queue(maxsize=maxsize)
+        self.drop_when_full = drop_when_full
+        self.next = None
+        self.processed = 0
+        self.dropped = 0
+        self.wait_seconds = 0.0
+        self.busy_seconds = 0.0
+
+    def put(self, turn, stop):
+        item = (time.monotonic(), turn)
+        if self.drop_when_full:
+            try:
+                self.queue.put_nowait(item)
+                return True
+            except Full:
+                self.dropped += 1
+                metrics.incr(f"{self.name}_dropped")
+                turn.done.set()
+                return False
+        while not stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        turn.done.set()
+        return False
+
+    def run(self, stop):
+        while not stop.is_set():
+            try:
+                queued_at, turn = self.queue.get(timeout=0.1)
+            except Empty:
+                continue
+            started = time.monotonic()
+            wait = started - queued_at
+            self.wait_seconds += wait
+            metrics.observe(f"{self.name}_wait_seconds", wait)
+            metrics.observe(f"{self.name}_queue_depth", self.queue.qsize())
+            emitted = []
+
+            def emit(result):
+                emitted.append(result)
+                self.next.put(result, stop)
+
+            try:
+                self.handler(turn, emit)
+                if not emitted and self.next is not None:
+                    turn.done.set()
+            except Cancelled:
+                turn.done.set()
+            except BudgetExhausted:
+                # Tempo del turno esaurito: messaggio all'utente, il loop prosegue
+                turn.done.set()
+                metrics.incr("budget_exhausted")
+                self.log.add_log("", f"🤖 {BUDGET_EXHAUSTED_MESSAGE} [PARLO]")
+            except Exception:
+                turn.done.set()
+                self.log.add_log("SYSTEM", f"Errore {self.name}: {traceback.format_exc()}")
+                stop.set()
+            finally:
+                self.processed += 1
+                self.busy_seconds += time.monotonic() - started
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "avg_wait_seconds": self.wait_seconds / self.processed if self.processed else 0.0,
+            "avg_busy_seconds": self.busy_seconds / self.processed if self.processed else 0.0,
+        }
+
+class VoicePipeline:
+    # Cattura -> trascrizione -> risposta -> sintesi/riproduzione, ciascuna con il proprio worker
+    def __init__(self, settings, stop=None, engine=None, capture_engine=None, log=None):
+        self.settings = settings
+        self.stop = stop or stop_event
+        self.log = log or log_manager
+        self.session_id = settings.get("session_id", "")
+        self.engine = engine
+        self.capture_engine = capture_engine
+        self.vad = VadConfig() if settings.get("capture_mode", "vad") == "vad" else None
+        self.gate = SpeechGate(**settings.get("speech_gate", {}))
+        self.archive_dir = settings.get("archive_dir", AUDIO_ARCHIVE_DIR)
+        self.upload_format = settings.get("upload_format", "wav")
+        self.streaming = settings.get("streaming", True)
+        self.tts_format = settings.get("tts_format", "pcm")
+        self.overlapped = settings.get("overlapped", False)
+        self.barge_in = settings.get("barge_in", False)
+        self.echo_mode = echo_gate_mode(settings, self.barge_in, self.log)
+        self.turn_budget = settings.get("turn_budget", TURN_BUDGET_SECONDS)
+        self.hedge = settings.get("hedge", False)
+        self.warm_up = settings.get("warm_up", True)
+        self.tts_cache = get_tts_cache() if settings.get("tts_cache", True) else None
+        self.response_cache = get_response_cache() if settings.get("response_cache", False) else None
+        self.context = create_context(settings)
+        self.incremental = settings.get("incremental_transcription", False)
+        self.chunker = None
+        self.tts_parallel = settings.get("tts_parallel", TTS_PARALLEL)
+        self.trace = None
+        self._in_flight = []
+        self._in_flight_lock = threading.Lock()
+        queue_size = settings.get("queue_size", 2)
+        self.stages = [
+            # La cattura non deve mai fermarsi: se la trascrizione è satura il turno viene scartato
+            Stage("transcribe", self.transcribe, queue_size, drop_when_full=True, log=self.log),
+            Stage("respond", self.respond, queue_size, log=self.log),
+            Stage("speak", self.speak, queue_size, log=self.log),
+        ]
+        for stage, following in zip(self.stages, self.stages[1:]):
+            stage.next = following
+
+    def stats(self):
+        return {stage.name: stage.stats() for stage in self.stages}
+
+    def run(self):
+        if self.settings.get("trace"):
+            self.trace = start_trace(trace_path(self.settings["trace"]), self.settings)
+        if self.warm_up:
+            threading.Thread(target=bind_context(warm_up_client), kwargs={"log": self.log}, daemon=True).start()
+        workers = [threading.Thread(target=bind_context(stage.run), args=(self.stop,), daemon=True) for stage in self.stages]
+        for worker in workers:
+            worker.start()
+        owns_capture = self.capture_engine is None
         try:
-            log_manager.add_log("**[ASCOLTO]**", "")
-            
-            with temp_audio_file() as filename:
-                record_audio(filename)
-                user_text = transcribe_audio(filename, settings["language"])
-                
-                if not user_text:
-                    continue
+            self.capture_engine = self.capture_engine or CaptureEngine()
+            self.capture_engine.echo_gate = EchoGate(self.engine or get_playback_engine(), self.echo_mode)
+            self.capture_engine.start()
+            self.capture()
+        except Cancelled:
+            pass
+        except Exception:
+            self.log.add_log("SYSTEM", f"Errore loop: {traceback.format_exc()}")
+            self.stop.set()
+        finally:
+            self.stop.set()
+            self.shutdown()
+            deadline = time.monotonic() + STOP_TIMEOUT
+            for worker in workers:
+                worker.join(timeout=max(0.0, deadline - time.monotonic()))
+            if owns_capture and self.capture_engine is not None:
+                self.capture_engine.close()
+                self.capture_engine = None
+            if self.context is not None:
+                self.context.close()
+            if self.trace is not None:
+                stop_trace(self.trace)
 
-                log_manager.add_log(f"👤 {user_text}", "**[PENSO...]**")
-                reply = get_chatgpt_response(user_text, settings["model"])
-                log_manager.add_log("", f"🤖 {reply} [PARLO]")
-                synthesize_speech(reply, settings["voice"])
-                
-                with threading.Lock():
-                    with open("conversazioni.csv", "a", newline='', encoding="utf-8") as f:
-                        writer = csv.writer(f)
-                        writer.writerow([datetime.now().isoformat(), user_text, reply])
-
-                time.sleep(settings["pause"])
-        
-        except Exception as e:
-            log_manager.add_log("SYSTEM", f"Errore loop: {traceback.format_exc()}")
-            stop_event.set()
\ No newline at end of file
+    def shutdown(self):
+        # Stop: annulla le chiamate in corso e zittisce subito la riproduzione
+        with self._in_flight_lock:
+            turns, self._in_flight = self._in_flight, []
+        for turn in turns:
+            turn.token.cancel()
+        (self.engine or get_playback_engine()).cancel()
+
+    def _track(self, turn):
+        # I turni conclusi escono subito dall'elenco: trattengono audio, code e callback degli stream HTTP
+        with self._in_flight_lock:
+            self._in_flight = [other for other in self._in_flight if not other.done.is_set()]
+            self._in_flight.append(turn)
+
+    def interrupt(self, onset=None):
+        # Barge-in: l'utente parla mentre una risposta è in elaborazione o in riproduzione
+        with self._in_flight_lock:
+            self._in_flight = [turn for turn in self._in_flight if not turn.done.is_set()]
+            targets = [turn for turn in self._in_flight if turn.replying and not turn.token.cancelled]
+        if not targets:
+            return False
+        onset_at = self.capture_engine.time_of(onset) if onset is not None else None
+        engine = self.engine or get_playback_engine()
+        for turn in targets:
+            turn.token.cancel()
+        engine.cancel()
+        metrics.incr("barge_ins")
+        # L'attesa del silenzio non blocca il thread di cattura, che deve registrare il nuovo enunciato
+        threading.Thread(target=self._observe_barge_in, args=(engine, onset_at), daemon=True).start()
+        return True
+
+    @staticmethod
+    def _observe_barge_in(engine, onset_at):
+        # Dall'inizio del parlato all'ultimo campione della risposta interrotta
+        engine.flush(timeout=0.5)
+        if onset_at is not None:
+            metrics.observe("barge_in_seconds", max(engine.last_output, onset_at) - onset_at)
+
+    def speech_started(self, onset):
+        if self.chunker is not None:
+            self.chunker.begin(onset)
+        if self.barge_in:
+            self.interrupt(onset)
+
+    def capture(self):
+        if self.incremental and self.vad:
+            self.chunker = IncrementalTranscriber(
+                self.capture_engine, self.settings["language"], self.upload_format, self.gate, self.vad,
+                self.settings.get("chunk_seconds", CHUNK_SECONDS), self.settings.get("chunk_overlap", CHUNK_OVERLAP),
+                self.turn_budget, self.log
+            )
+        endpointer = Endpointer(self.capture_engine, self.vad, self.speech_started, self.stop)
+        try:
+            self._capture_turns(endpointer)
+        finally:
+            if self.chunker is not None:
+                self.chunker.discard()
+
+    def _capture_turns(self, endpointer):
+        turn_id = 0
+        previous = None
+        while not self.stop.is_set():
+            # Con il barge-in attivo si resta in ascolto anche durante la risposta
+            if previous is not None and not self.overlapped and not self.barge_in:
+                # Modalità sequenziale: si torna ad ascoltare a turno concluso,
+                # scartando l'audio acquisito nel frattempo
+                while not previous.done.wait(0.1) and not self.stop.is_set():
+                    pass
+                self.stop.wait(self.settings["pause"])
+                endpointer.reset()
+                previous = None
+                if self.stop.is_set():
+                    break
+
+            self.log.add_log("**[ASCOLTO]**", "")
+            try:
+                # In modalità sovrapposta il cursore prosegue senza buchi tra un turno e l'altro
+                recording = endpointer.next_utterance() if self.vad else endpointer.fixed()
+            except sd.PortAudioError as e:
+                self.log.add_log("SYSTEM", f"Errore registrazione: {str(e)}")
+                raise
+            chunks = self.chunker.finish(recording) if self.chunker is not None else None
+            if recording is None:
+                continue
+            if not self.gate.passes(speech_stats(recording.samples(), self.vad)):
+                # Silenzio o rumore: nessuna chiamata a Whisper
+                metrics.incr("clips_skipped")
+                if chunks is not None:
+                    chunks.cancel()
+                continue
+            metrics.incr("clips_uploaded")
+            metrics.observe_stage("record", recording.duration)
+            turn_id += 1
+            previous = Turn(turn_id, recording.detach(), time.monotonic(), chunks=chunks)
+            previous.budget = TurnBudget(self.turn_budget, previous.token)
+            self._track(previous)
+            self.stages[0].put(previous, self.stop)
+            if self.trace is not None:
+                self.trace.add_turn(previous)
+
+    def transcribe(self, turn, emit):
+        if turn.chunks is not None:
+            # Gran parte dell'audio è già stata trascritta durante il parlato
+            if self.archive_dir:
+                audio = wav_buffer(turn.recording.samples(), turn.recording.engine.samplerate)
+                archive_audio(self.archive_dir, "input", audio.getvalue(), "wav")
+            started = time.monotonic()
+            turn.user_text = turn.chunks.result(turn.token)
+            metrics.observe("transcribe_seconds", time.monotonic() - started)
+            turn.marks["transcribed"] = time.monotonic()
+            if turn.user_text:
+                self.log.add_log(f"👤 {turn.user_text}", "**[PENSO...]**")
+                emit(turn)
+            return
+        audio_file, upload = encode_upload(
+            turn.recording.samples(), turn.recording.engine.samplerate, audio_format=self.upload_format
+        )
+        metrics.observe("upload_bytes", upload["upload_bytes"])
+        metrics.observe("encode_seconds", upload["encode_seconds"])
+        self.log.add_log("SYSTEM", f"Upload {upload['upload_bytes'] / 1024:.1f} KB, codifica {upload['encode_seconds'] * 1000:.1f} ms")
+        archive_audio(self.archive_dir, "input", audio_file.getvalue(), audio_file.name.rsplit(".", 1)[-1])
+        started = time.monotonic()
+        turn.user_text = call_cancellable(
+            transcribe_audio, turn.token, audio_file, self.settings["language"], turn.token, turn.budget, self.log,
+            hedge_after=self._hedge_after("transcribe_seconds")
+        )
+        metrics.observe("transcribe_seconds", time.monotonic() - started)
+        turn.marks["transcribed"] = time.monotonic()
+        if turn.user_text:
+            self.log.add_log(f"👤 {turn.user_text}", "**[PENSO...]**")
+            emit(turn)
+
+    def _hedge_after(self, name):
+        # Richiesta hedged solo quando la prima supera il p95 osservato
+        return metrics.percentile(name, 95, HEDGE_MIN_SAMPLES) if self.hedge else None
+
+    def respond(self, turn, emit):
+        if turn.token.cancelled:
+            return
+        turn.replying = True
+        # La sintesi parte alla prima frase, mentre il resto della risposta arriva
+        emit(turn)
+        sentences = []
+
+        def deliver(sentence):
+            turn.marks.setdefault("first_sentence", time.monotonic())
+            sentences.append(sentence)
+            turn.sentences.put(sentence)
+
+        messages = self.context.messages(turn.user_text) if self.context else None
+        history = messages[:-1] if messages else None
+        key = self.response_cache.key(self.settings["model"], turn.user_text, history) if self.response_cache else None
+        cached = self.response_cache.get(key) if key else None
+        started = time.monotonic()
+        try:
+            if cached is not None:
+                for sentence in split_sentences([cached]):
+                    deliver(sentence)
+            elif self.streaming:
+                deltas = stream_chatgpt_response(turn.user_text, self.settings["model"], turn.token, turn.budget, messages, self.log)
+                for sentence in split_sentences(deltas):
+                    deliver(sentence)
+            else:
+                reply = call_cancellable(
+                    get_chatgpt_response, turn.token, turn.user_text, self.settings["model"], turn.token, turn.budget, messages, self.log,
+                    hedge_after=self._hedge_after("chat_seconds")
+                )
+                metrics.observe("chat_seconds", time.monotonic() - started)
+                # Anche la risposta intera viene divisa in frasi, sintetizzate in parallelo
+                for sentence in split_sentences([reply]):
+                    deliver(sentence)
+        except Cancelled:
+            pass
+        finally:
+            turn.sentences.put(None)
+        turn.reply = " ".join(sentences)
+        if key and cached is None and turn.reply and not turn.token.cancelled:
+            self.response_cache.put(key, turn.reply, time.monotonic() - started)
+        if not turn.reply:
+            # Interrotta prima della prima frase: niente da registrare
+            return
+        if self.context:
+            # Anche una risposta interrotta entra nella memoria: è ciò che l'utente ha sentito
+            self.context.add_turn(turn.user_text, turn.reply)
+        interrupted = " (interrotta)" if turn.token.cancelled else ""
+        self.log.add_log("", f"🤖 {turn.reply}{interrupted} [PARLO]")
+        save_conversation(turn.user_text, turn.reply, self.session_id)
+
+    def speak(self, turn, emit):
+        def first_audio():
+            turn.marks["first_audio"] = time.monotonic()
+            metrics.observe("time_to_first_audio", time.monotonic() - turn.captured_at)
+            metrics.observe_stage("first_audio", time.monotonic() - turn.captured_at)
+
+        def done():
+            # Turno completo: dalla fine del parlato all'ultimo campione riprodotto
+            turn.marks["done"] = time.monotonic()
+            if not turn.token.cancelled:
+                metrics.observe_stage("turn", time.monotonic() - turn.captured_at)
+            turn.done.set()
+
+        speak_sentences(
+            iter(turn.sentences.get, None), self.settings["voice"], self.archive_dir,
+            first_audio, self.tts_format, self.engine, on_done=done, token=turn.token, budget=turn.budget,
+            cache=self.tts_cache, parallel=self.tts_parallel, log=self.log
+        )
+
+def voice_loop(settings, stop=None, log=None, engine=None, capture_engine=None):
+    # Senza argomenti usa stop_event, log_manager e l'uscita audio del modulo;
+    # SessionManager passa quelli della sessione del browser
+    stop = stop or stop_event
+    stop.clear()
+    if settings.get("engine", "threads") == "async":
+        from async_assistant import run_async_voice_loop
+        return run_async_voice_loop(settings, stop, log, engine, capture_engine)
+    VoicePipeline(settings, stop, engine, capture_engine, log).run()
@@ -0,0 +1,573 @@
+import asyncio
+import os
+import time
+import traceback
+import weakref
+from functools import partial
+
+import httpx
+import numpy as np
+from openai import AsyncOpenAI
+
+from assistant import (
+    BUDGET_EXHAUSTED_MESSAGE, CHAT_TIMEOUT, CHUNK_OVERLAP, CHUNK_SECONDS, HTTP_CONNECT_TIMEOUT, HTTP_WARMUP_CONNECTIONS, OPENAI_BASE_URL,
+    STOP_TIMEOUT, STREAMING_TTS_FORMATS, TRANSCRIBE_TIMEOUT, TTS_CHUNK_BYTES, TTS_MAX_IN_FLIGHT, TTS_MODEL, TTS_PARALLEL, TTS_SAMPLE_RATE,
+    TURN_BUDGET_SECONDS, AUDIO_ARCHIVE_DIR, BudgetExhausted, Cancelled, CaptureEngine, EchoGate, Endpointer, IncrementalTranscriber,
+    SentenceSplitter, SpeechGate, Turn, TurnBudget, VadConfig, archive_audio, create_context, decode_to_pcm, echo_gate_mode, encode_upload,
+    get_playback_engine, get_response_cache, get_tts_cache, http_client_options, log_manager, metrics, save_conversation, speech_stats, split_clauses, split_sentences,
+    stop_event, trace_path, wav_buffer,
+)
+from tracing import AsyncRecordingTransport, bind_context, start_trace, stop_trace
+
+STOP_POLL_INTERVAL = 0.05         # controllo dello stop (threading.Event) dal loop asyncio (s)
+
+_tts_slots = weakref.WeakKeyDictionary()
+
+def tts_slots():
+    # Un semaforo per event loop, condiviso da tutte le pipeline del loop (run_pipelines) come il
+    # pool _tts_workers lo è dai thread: TTS_MAX_IN_FLIGHT resta il limite complessivo
+    loop = asyncio.get_running_loop()
+    slots = _tts_slots.get(loop)
+    if slots is None:
+        slots = _tts_slots[loop] = asyncio.Semaphore(TTS_MAX_IN_FLIGHT)
+    return slots
+
+def create_async_client():
+    # Un client per event loop: le connessioni di httpx.AsyncClient sono legate al loop che le ha aperte
+    options = http_client_options()
+    transport = httpx.AsyncHTTPTransport(http2=options.pop("http2"), limits=options.pop("limits"))
+    return AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        base_url=OPENAI_BASE_URL,
+        http_client=httpx.AsyncClient(transport=AsyncRecordingTransport(transport), **options),
+        max_retries=0,
+    )
+
+async def warm_up_async_client(client, connections=HTTP_WARMUP_CONNECTIONS, log=None):
+    started = time.monotonic()
+    client = client.with_options(timeout=httpx.Timeout(5.0, connect=HTTP_CONNECT_TIMEOUT))
+    try:
+        await asyncio.gather(*(client.models.retrieve("whisper-1") for _ in range(max(1, connections))))
+        metrics.observe("http_warmup_seconds", time.monotonic() - started)
+        return True
+    except Exception as e:
+        metrics.incr("http_warmup_failures")
+        (log or log_manager).add_log("SYSTEM", f"Warm-up connessioni fallito: {str(e)}")
+        return False
+
+async def transcribe_audio_async(client, audio_file, language, budget, log=None):
+    upload = (audio_file.name, audio_file.getvalue())
+    with metrics.span("transcribe") as span:
+        async for attempt in budget.async_retrying(stage="transcribe"):
+            with attempt:
+                span.uploaded(len(upload[1]))
+                try:
+                    transcript = await client.audio.transcriptions.create(
+                        file=upload,
+                        model="whisper-1",
+                        language=language,
+                        timeout=budget.timeout(TRANSCRIBE_TIMEOUT)
+                    )
+                except Exception as e:
+                    (log or log_manager).add_log("SYSTEM", f"Errore trascrizione: {str(e)}")
+                    raise
+        span.downloaded(len(transcript.text.encode("utf-8")))
+    return transcript.text
+
+async def get_chatgpt_response_async(client, prompt, model, budget, messages=None, log=None):
+    with metrics.span("chat") as span:
+        async for attempt in budget.async_retrying(stage="chat"):
+            with attempt:
+                try:
+                    response = await client.chat.completions.create(
+                        model=model,
+                        messages=messages or [{"role": "user", "content": prompt}],
+                        timeout=budget.timeout(CHAT_TIMEOUT)
+                    )
+                except Exception as e:
+                    (log or log_manager).add_log("SYSTEM", f"Errore GPT: {str(e)}")
+                    raise
+        span.downloaded(len((response.choices[0].message.content or "").encode("utf-8")))
+    return response.choices[0].message.content
+
+async def stream_chatgpt_response_async(client, prompt, model, budget, messages=None, log=None):
+    # Il retry copre solo l'apertura dello stream, come nella versione a thread
+    with metrics.span("chat") as span:
+        started = time.monotonic()
+        async for attempt in budget.async_retrying(stage="chat"):
+            with attempt:
+                try:
+                    stream = await client.chat.completions.create(
+                        model=model,
+                        messages=messages or [{"role": "user", "content": prompt}],
+                        stream=True,
+                        timeout=budget.timeout(CHAT_TIMEOUT)
+                    )
+                except Exception as e:
+                    (log or log_manager).add_log("SYSTEM", f"Errore GPT: {str(e)}")
+                    raise
+        first = True
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    delta = chunk.choices[0].delta.content
+                    if first:
+                        metrics.observe_stage("chat_first_token", time.monotonic() - started)
+                        first = False
+                    span.downloaded(len(delta.encode("utf-8")))
+                    yield delta
+        finally:
+            # Alla cancellazione del task la connessione viene chiusa subito
+            await stream.close()
+
+async def stream_speech_async(client, text, voice, response_format="pcm", chunk_size=TTS_CHUNK_BYTES, budget=None):
+    with metrics.span("tts") as span:
+        async with client.audio.speech.with_streaming_response.create(
+            model=TTS_MODEL,
+            voice=voice,
+            input=text,
+            response_format=response_format,
+            timeout=(budget or TurnBudget()).speech_timeout()
+        ) as response:
+            async for chunk in response.iter_bytes(chunk_size):
+                span.downloaded(len(chunk))
+                yield chunk
+
+async def fetch_speech_async(client, text, voice, response_format="mp3", budget=None):
+    with metrics.span("tts") as span:
+        response = await client.audio.speech.create(
+            model=TTS_MODEL,
+            voice=voice,
+            input=text,
+            response_format=response_format,
+            timeout=(budget or TurnBudget()).speech_timeout()
+        )
+        span.downloaded(len(response.content))
+    return response.content
+
+class AsyncVoicePipeline:
+    # Stesso turno di VoicePipeline, ma un task asyncio per turno al posto dei worker:
+    # la rete non occupa thread, l'audio (cattura, codifica, riproduzione) passa per l'executor
+    def __init__(self, settings, stop=None, client=None, engine=None, capture_engine=None, log=None):
+        self.settings = settings
+        self.stop = stop or stop_event
+        self.log = log or log_manager
+        self.session_id = settings.get("session_id", "")
+        self.client = client
+        self.engine = engine
+        self.capture_engine = capture_engine
+        self.vad = VadConfig() if settings.get("capture_mode", "vad") == "vad" else None
+        self.gate = SpeechGate(**settings.get("speech_gate", {}))
+        self.archive_dir = settings.get("archive_dir", AUDIO_ARCHIVE_DIR)
+        self.upload_format = settings.get("upload_format", "wav")
+        self.streaming = settings.get("streaming", True)
+        self.tts_format = settings.get("tts_format", "pcm")
+        self.overlapped = settings.get("overlapped", False)
+        self.barge_in = settings.get("barge_in", False)
+        self.echo_mode = echo_gate_mode(settings, self.barge_in, self.log)
+        self.turn_budget = settings.get("turn_budget", TURN_BUDGET_SECONDS)
+        self.warm_up = settings.get("warm_up", True)
+        self.tts_cache = get_tts_cache() if settings.get("tts_cache", True) else None
+        self.response_cache = get_response_cache() if settings.get("response_cache", False) else None
+        self.context = create_context(settings)
+        self.incremental = settings.get("incremental_transcription", False)
+        self.chunker = None
+        self.tts_parallel = settings.get("tts_parallel", TTS_PARALLEL)
+        self.trace = None
+        self._tasks = set()
+        self._replying = set()
+        self._loop = None
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        if self.settings.get("trace"):
+            self.trace = start_trace(trace_path(self.settings["trace"]), self.settings)
+        owns_client = self.client is None
+        owns_capture = self.capture_engine is None
+        self.client = self.client or create_async_client()
+        self.engine = self.engine or get_playback_engine()
+        if self.warm_up:
+            self._spawn(warm_up_async_client(self.client, log=self.log))
+        watcher = asyncio.create_task(self._watch_stop(asyncio.current_task()))
+        try:
+            self.capture_engine = self.capture_engine or CaptureEngine()
+            self.capture_engine.echo_gate = EchoGate(self.engine, self.echo_mode)
+            self.capture_engine.start()
+            await self.capture()
+        except (Cancelled, asyncio.CancelledError):
+            pass
+        except Exception:
+            self.log.add_log("SYSTEM", f"Errore loop: {traceback.format_exc()}")
+        finally:
+            self.stop.set()
+            watcher.cancel()
+            await self.shutdown()
+            if owns_capture and self.capture_engine is not None:
+                self.capture_engine.close()
+                self.capture_engine = None
+            if owns_client:
+                await self.client.close()
+            if self.context is not None:
+                self.context.close()
+            if self.trace is not None:
+                stop_trace(self.trace)
+
+    async def _watch_stop(self, main):
+        # Lo Stop arriva da un altro thread (la UI): si annulla la cattura in attesa nell'executor
+        while not self.stop.is_set():
+            await asyncio.sleep(STOP_POLL_INTERVAL)
+        main.cancel()
+
+    async def _sleep(self, seconds):
+        deadline = time.monotonic() + seconds
+        while not self.stop.is_set() and time.monotonic() < deadline:
+            await asyncio.sleep(min(STOP_POLL_INTERVAL, deadline - time.monotonic()))
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def shutdown(self):
+        self.engine.cancel()
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks, timeout=STOP_TIMEOUT)
+
+    def interrupt(self, onset=None):
+        # Chiamata dal thread dell'endpointer: il barge-in viene eseguito nel loop
+        if self._replying:
+            self._loop.call_soon_threadsafe(self._barge_in, onset)
+
+    def _barge_in(self, onset):
+        targets = [task for task in self._replying if not task.done()]
+        if not targets:
+            return
+        onset_at = self.capture_engine.time_of(onset) if onset is not None else None
+        for task in targets:
+            task.cancel()
+        self.engine.cancel()
+        metrics.incr("barge_ins")
+        if onset_at is not None:
+            self._spawn(self._observe_barge_in(onset_at))
+
+    async def _observe_barge_in(self, onset_at):
+        # Dall'inizio del parlato all'ultimo campione della risposta interrotta
+        await self._loop.run_in_executor(None, self.engine.flush, 0.5)
+        metrics.observe("barge_in_seconds", max(self.engine.last_output, onset_at) - onset_at)
+
+    def speech_started(self, onset):
+        if self.chunker is not None:
+            self.chunker.begin(onset)
+        if self.barge_in:
+            self.interrupt(onset)
+
+    async def capture(self):
+        if self.incremental and self.vad:
+            # I blocchi parziali usano il client sincrono sui thread di call_cancellable
+            self.chunker = IncrementalTranscriber(
+                self.capture_engine, self.settings["language"], self.upload_format, self.gate, self.vad,
+                self.settings.get("chunk_seconds", CHUNK_SECONDS), self.settings.get("chunk_overlap", CHUNK_OVERLAP),
+                self.turn_budget, self.log
+            )
+        endpointer = Endpointer(self.capture_engine, self.vad, self.speech_started, self.stop)
+        try:
+            await self._capture_turns(endpointer)
+        finally:
+            if self.chunker is not None:
+                self.chunker.discard()
+
+    async def _capture_turns(self, endpointer):
+        turn_id = 0
+        while not self.stop.is_set():
+            self.log.add_log("**[ASCOLTO]**", "")
+            # Le attese sul microfono sono bloccanti: vanno nell'executor per non fermare il loop,
+            # nel contesto della pipeline perché i blocchi parziali inviati da lì restino nella sua traccia
+            next_clip = endpointer.next_utterance if self.vad else endpointer.fixed
+            recording = await self._loop.run_in_executor(None, bind_context(next_clip))
+            chunks = None
+            if self.chunker is not None:
+                chunks = await self._loop.run_in_executor(None, bind_context(self.chunker.finish), recording)
+            if recording is None:
+                continue
+            if not self.gate.passes(speech_stats(recording.samples(), self.vad)):
+                metrics.incr("clips_skipped")
+                if chunks is not None:
+                    chunks.cancel()
+                continue
+            metrics.incr("clips_uploaded")
+            metrics.observe_stage("record", recording.duration)
+            turn_id += 1
+            turn = Turn(turn_id, recording.detach(), time.monotonic(), chunks=chunks)
+            turn.budget = TurnBudget(self.turn_budget, turn.token)
+            task = self._spawn(self.process(turn))
+            if self.trace is not None:
+                await self._loop.run_in_executor(None, self.trace.add_turn, turn)
+            if not self.overlapped and not self.barge_in:
+                await asyncio.wait({task})
+                await self._sleep(self.settings["pause"])
+                endpointer.reset()
+
+    async def process(self, turn):
+        task = asyncio.current_task()
+        try:
+            turn.user_text = await self.transcribe(turn)
+            turn.marks["transcribed"] = time.monotonic()
+            if not turn.user_text:
+                return
+            self.log.add_log(f"👤 {turn.user_text}", "**[PENSO...]**")
+            turn.replying = True
+            self._replying.add(task)
+            await self.respond(turn)
+        except asyncio.CancelledError:
+            turn.token.cancel()
+        except BudgetExhausted:
+            metrics.incr("budget_exhausted")
+            self.log.add_log("", f"🤖 {BUDGET_EXHAUSTED_MESSAGE} [PARLO]")
+        except Exception:
+            self.log.add_log("SYSTEM", f"Errore turno: {traceback.format_exc()}")
+            self.stop.set()
+        finally:
+            self._replying.discard(task)
+            turn.done.set()
+
+    async def transcribe(self, turn):
+        if turn.chunks is not None:
+            started = time.monotonic()
+            text = await self._loop.run_in_executor(None, turn.chunks.result, turn.token)
+            metrics.observe("transcribe_seconds", time.monotonic() - started)
+            return text
+        audio_file, upload = await self._loop.run_in_executor(None, partial(
+            encode_upload, turn.recording.samples(), turn.recording.engine.samplerate, audio_format=self.upload_format
+        ))
+        metrics.observe("upload_bytes", upload["upload_bytes"])
+        metrics.observe("encode_seconds", upload["encode_seconds"])
+        self.log.add_log("SYSTEM", f"Upload {upload['upload_bytes'] / 1024:.1f} KB, codifica {upload['encode_seconds'] * 1000:.1f} ms")
+        if self.archive_dir:
+            await self._loop.run_in_executor(
+                None, archive_audio, self.archive_dir, "input", audio_file.getvalue(), audio_file.name.rsplit(".", 1)[-1]
+            )
+        started = time.monotonic()
+        text = await transcribe_audio_async(self.client, audio_file, self.settings["language"], turn.budget, self.log)
+        metrics.observe("transcribe_seconds", time.monotonic() - started)
+        return text
+
+    async def sentences(self, turn):
+        model = self.settings["model"]
+        messages = self.context.messages(turn.user_text) if self.context else None
+        history = messages[:-1] if messages else None
+        key = self.response_cache.key(model, turn.user_text, history) if self.response_cache else None
+        if key:
+            cached = await self._loop.run_in_executor(None, self.response_cache.get, key)
+            if cached is not None:
+                for sentence in split_sentences([cached]):
+                    yield sentence
+                return
+        started = time.monotonic()
+        parts = []
+        if self.streaming:
+            splitter = SentenceSplitter()
+            deltas = stream_chatgpt_response_async(self.client, turn.user_text, model, turn.budget, messages, self.log)
+            async for delta in deltas:
+                for sentence in splitter.feed(delta):
+                    parts.append(sentence)
+                    yield sentence
+            rest = splitter.flush()
+            if rest:
+                parts.append(rest)
+                yield rest
+        else:
+            reply = await get_chatgpt_response_async(self.client, turn.user_text, model, turn.budget, messages, self.log)
+            metrics.observe("chat_seconds", time.monotonic() - started)
+            for sentence in split_sentences([reply]):
+                parts.append(sentence)
+                yield sentence
+        if key and parts:
+            # Solo le risposte complete: un turno interrotto non arriva fin qui
+            await self._loop.run_in_executor(None, self.response_cache.put, key, " ".join(parts), time.monotonic() - started)
+
+    async def respond(self, turn):
+        # La sintesi parte alla prima frase, mentre il resto della risposta arriva
+        queue = asyncio.Queue()
+        speaker = asyncio.create_task(self.speak(turn, queue))
+        parts = []
+        try:
+            async for sentence in self.sentences(turn):
+                turn.marks.setdefault("first_sentence", time.monotonic())
+                parts.append(sentence)
+                queue.put_nowait(sentence)
+            queue.put_nowait(None)
+            await speaker
+        except BaseException:
+            speaker.cancel()
+            turn.reply = " ".join(parts)
+            if turn.reply:
+                self.log.add_log("", f"🤖 {turn.reply} (interrotta) [PARLO]")
+                if self.context is not None:
+                    self.context.add_turn(turn.user_text, turn.reply)
+                await asyncio.shield(self._loop.run_in_executor(None, save_conversation, turn.user_text, turn.reply, self.session_id))
+            raise
+        turn.reply = " ".join(parts)
+        self.log.add_log("", f"🤖 {turn.reply} [PARLO]")
+        if self.context is not None and turn.reply:
+            self.context.add_turn(turn.user_text, turn.reply)
+        await self._loop.run_in_executor(None, save_conversation, turn.user_text, turn.reply, self.session_id)
+
+    async def _cache_acquire(self, turn, key):
+        # La cache è sincrona (disco, attesa delle richieste in corso): si interroga nell'executor
+        future = self._loop.run_in_executor(None, self.tts_cache.acquire, key, lambda: turn.token.cancelled)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Se nel frattempo il turno è diventato il riferimento per la chiave, la libera
+            def release(done):
+                if done.cancelled() or done.exception() is not None:
+                    return
+                _, flight = done.result()
+                if flight is not None:
+                    self.tts_cache.finish(key, flight)
+
+            future.add_done_callback(release)
+            raise
+
+    async def cached_speech(self, turn, sentence):
+        key = self.tts_cache.key(TTS_MODEL, self.settings["voice"], self.tts_format, sentence)
+        audio, flight = await self._cache_acquire(turn, key)
+        if flight is None:
+            for start in range(0, len(audio or b""), TTS_CHUNK_BYTES):
+                yield audio[start:start + TTS_CHUNK_BYTES]
+            return
+        chunks = []
+        complete = False
+        try:
+            async for chunk in stream_speech_async(
+                self.client, sentence, self.settings["voice"], self.tts_format, budget=turn.budget
+            ):
+                chunks.append(chunk)
+                yield chunk
+            complete = True
+        finally:
+            self.tts_cache.finish(key, flight, b"".join(chunks) if complete else None)
+
+    async def fetch_speech(self, turn, sentence):
+        if self.tts_cache is None:
+            return await fetch_speech_async(self.client, sentence, self.settings["voice"], self.tts_format, turn.budget)
+        key = self.tts_cache.key(TTS_MODEL, self.settings["voice"], self.tts_format, sentence)
+        audio, flight = await self._cache_acquire(turn, key)
+        if flight is None:
+            return audio
+        try:
+            audio = await fetch_speech_async(self.client, sentence, self.settings["voice"], self.tts_format, turn.budget)
+        except BaseException:
+            self.tts_cache.finish(key, flight)
+            raise
+        self.tts_cache.finish(key, flight, audio)
+        return audio
+
+    async def speech_pcm(self, turn, text):
+        if self.tts_format in STREAMING_TTS_FORMATS:
+            if self.tts_cache is not None:
+                chunks = self.cached_speech(turn, text)
+            else:
+                chunks = stream_speech_async(self.client, text, self.settings["voice"], self.tts_format, budget=turn.budget)
+            async for chunk in chunks:
+                yield chunk
+            return
+        audio = await self.fetch_speech(turn, text)
+        if audio is None:
+            return
+        archive_audio(self.archive_dir, "response", audio, self.tts_format)
+        yield await self._loop.run_in_executor(None, decode_to_pcm, audio, self.tts_format)
+
+    async def _speech_job(self, turn, text, chunks):
+        # Il semaforo limita le richieste TTS contemporanee di tutte le pipeline del loop
+        try:
+            async with tts_slots():
+                metrics.incr("tts_requests")
+                async for chunk in self.speech_pcm(turn, text):
+                    chunks.put_nowait(chunk)
+        except Exception as e:
+            chunks.put_nowait(e)
+        finally:
+            chunks.put_nowait(None)
+
+    async def speak(self, turn, queue):
+        # Pezzi sintetizzati in parallelo (al più tts_parallel avviati e non ancora riprodotti),
+        # accodati al PlaybackEngine nell'ordine della risposta
+        def first_audio():
+            turn.marks["first_audio"] = time.monotonic()
+            metrics.observe("time_to_first_audio", time.monotonic() - turn.captured_at)
+            metrics.observe_stage("first_audio", time.monotonic() - turn.captured_at)
+
+        def drained():
+            turn.marks["done"] = time.monotonic()
+            if not turn.token.cancelled:
+                metrics.observe_stage("turn", time.monotonic() - turn.captured_at)
+            self._loop.call_soon_threadsafe(lambda: finished.done() or finished.set_result(None))
+
+        async def feed():
+            try:
+                while (sentence := await queue.get()) is not None:
+                    for part in split_clauses(sentence):
+                        await slots.acquire()
+                        chunks = asyncio.Queue()
+                        workers.append(asyncio.create_task(self._speech_job(turn, part, chunks)))
+                        jobs.put_nowait(chunks)
+            finally:
+                jobs.put_nowait(None)
+
+        streaming = self.tts_format in STREAMING_TTS_FORMATS
+        archived = []
+        finished = self._loop.create_future()
+        slots = asyncio.Semaphore(max(1, self.tts_parallel))
+        jobs = asyncio.Queue()
+        workers = []
+        feeder = asyncio.create_task(feed())
+        reply = self.engine.begin_reply(first_audio)
+        try:
+            while (chunks := await jobs.get()) is not None:
+                try:
+                    while (chunk := await chunks.get()) is not None:
+                        if isinstance(chunk, Exception):
+                            raise chunk
+                        self.engine.enqueue(chunk, reply)
+                        if self.archive_dir and streaming:
+                            archived.append(chunk)
+                finally:
+                    slots.release()
+        except asyncio.CancelledError:
+            self.engine.cancel()
+            raise
+        except BudgetExhausted:
+            raise
+        except Exception as e:
+            self.log.add_log("SYSTEM", f"Errore sintesi vocale: {str(e)}")
+            raise
+        finally:
+            feeder.cancel()
+            for worker in workers:
+                worker.cancel()
+            self.engine.end_reply(drained, reply)
+            if archived:
+                data = b"".join(archived)
+                pcm = np.frombuffer(data[:len(data) - len(data) % 2], dtype=np.int16)
+                archive_audio(self.archive_dir, "response", wav_buffer(pcm, TTS_SAMPLE_RATE).getvalue(), "wav")
+        # Il turno termina quando l'audio è stato riprodotto, come nel motore a thread
+        await finished
+
+async def run_pipelines(pipelines):
+    # Più conversazioni nello stesso event loop, con un unico pool di connessioni
+    client = create_async_client()
+    for pipeline in pipelines:
+        pipeline.client = pipeline.client or client
+    try:
+        await asyncio.gather(*(pipeline.run() for pipeline in pipelines))
+    finally:
+        await client.close()
+
+def run_async_voice_loop(settings, stop=None, log=None, engine=None, capture_engine=None):
+    # Punto d'ingresso sincrono, usato da voice_loop quando settings["engine"] == "async"
+    asyncio.run(AsyncVoicePipeline(settings, stop, engine=engine, capture_engine=capture_engine, log=log).run())
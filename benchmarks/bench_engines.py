@@ -0,0 +1,131 @@
+"""Confronto tra il motore a thread (VoicePipeline) e quello asyncio (AsyncVoicePipeline).
+
+Ogni configurazione gira in un processo separato con N conversazioni simulate:
+microfoni sintetici, uscita audio nulla e un server locale che imita le API OpenAI.
+Uso: python benchmarks/bench_engines.py --sessions 1 10 50 --duration 20
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SETTINGS = {
+    "language": "it",
+    "model": "gpt-4o-mini",
+    "voice": "alloy",
+    "pause": 0,
+    "barge_in": False,
+    "echo_gate": "off",
+    "warm_up": False,
+    "tts_cache": False,
+}
+
+def run_child(engine, sessions, duration, base_url):
+    # Le variabili d'ambiente vanno impostate prima di importare l'assistente
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ["OPENAI_MAX_CONNECTIONS"] = str(max(10, sessions * 2))
+    os.environ["OPENAI_MAX_KEEPALIVE"] = str(max(6, sessions * 2))
+    sys.path.insert(0, os.path.dirname(HERE))
+    os.chdir(tempfile.mkdtemp(prefix="bench_"))
+    import assistant
+    from async_assistant import AsyncVoicePipeline, run_pipelines
+    from fake_audio import NullOutputStream, SyntheticInputStream
+
+    stops = [threading.Event() for _ in range(sessions)]
+    devices = [
+        dict(
+            engine=assistant.PlaybackEngine(stream_factory=NullOutputStream),
+            capture_engine=assistant.CaptureEngine(stream_factory=SyntheticInputStream),
+        )
+        for _ in range(sessions)
+    ]
+    if engine == "threads":
+        runners = [
+            threading.Thread(target=assistant.VoicePipeline(dict(SETTINGS), stop, **device).run, daemon=True)
+            for stop, device in zip(stops, devices)
+        ]
+    else:
+        pipelines = [AsyncVoicePipeline(dict(SETTINGS), stop, **device) for stop, device in zip(stops, devices)]
+        runners = [threading.Thread(target=lambda: __import__("asyncio").run(run_pipelines(pipelines)), daemon=True)]
+
+    cpu_started = time.process_time()
+    started = time.monotonic()
+    for runner in runners:
+        runner.start()
+    peak_threads = 0
+    while time.monotonic() - started < duration:
+        peak_threads = max(peak_threads, threading.active_count())
+        time.sleep(0.2)
+    for stop in stops:
+        stop.set()
+    for runner in runners:
+        runner.join(timeout=5)
+    elapsed = time.monotonic() - started
+
+    counters = assistant.metrics.snapshot()
+    turns = counters.get("time_to_first_audio_count", 0)
+    return {
+        "engine": engine,
+        "sessions": sessions,
+        "seconds": round(elapsed, 2),
+        "turns": turns,
+        "turns_per_session_minute": round(turns / sessions / elapsed * 60, 2),
+        "ttfa_p50": assistant.metrics.percentile("time_to_first_audio", 50),
+        "ttfa_p95": assistant.metrics.percentile("time_to_first_audio", 95),
+        "cpu_seconds": round(time.process_time() - cpu_started, 2),
+        "peak_threads": peak_threads,
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--engines", nargs="+", default=["threads", "async"], choices=["threads", "async"])
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--base-url", help="server già avviato; altrimenti viene avviato benchmarks/stub_server.py")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.engines[0], args.sessions[0], args.duration, args.base_url)))
+        return
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        server = subprocess.Popen(
+            [sys.executable, os.path.join(HERE, "stub_server.py"), "--port", "0"],
+            stdout=subprocess.PIPE, text=True
+        )
+        base_url = server.stdout.readline().rsplit(" ", 1)[-1].strip()
+    try:
+        results = []
+        for sessions in args.sessions:
+            for engine in args.engines:
+                output = subprocess.run(
+                    [sys.executable, __file__, "--child", "--engines", engine, "--sessions", str(sessions),
+                     "--duration", str(args.duration), "--base-url", base_url],
+                    capture_output=True, text=True, check=True
+                ).stdout
+                results.append(json.loads(output.strip().splitlines()[-1]))
+                print(json.dumps(results[-1]), flush=True)
+    finally:
+        if server is not None:
+            server.terminate()
+
+    print(f"\n{'motore':8} {'sessioni':>8} {'turni/min':>10} {'TTFA p50':>9} {'TTFA p95':>9} {'CPU s':>7} {'thread':>7} {'RSS MB':>7}")
+    for r in results:
+        p50 = f"{r['ttfa_p50']:.2f}" if r["ttfa_p50"] is not None else "-"
+        p95 = f"{r['ttfa_p95']:.2f}" if r["ttfa_p95"] is not None else "-"
+        print(f"{r['engine']:8} {r['sessions']:>8} {r['turns_per_session_minute']:>10} {p50:>9} {p95:>9} "
+              f"{r['cpu_seconds']:>7} {r['peak_threads']:>7} {r['max_rss_mb']:>7}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""Benchmark end-to-end di voice_loop: scenari ripetibili con risultati in JSON.
+
+Ogni scenario gira in un processo separato, con un proprio server che imita le API OpenAI
+(latenze e lunghezza della risposta configurabili) e con sounddevice sostituito da un microfono
+che riproduce fixture WAV e da un'uscita audio nulla. Per ogni scenario si misurano tempo al primo
+audio, durata completa del turno, CPU e memoria per turno e latenze dei singoli stadi.
+Uso: python benchmarks/bench_pipeline.py --turns 5 --output risultati.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+SETTINGS = {
+    "language": "it",
+    "model": "gpt-4o-mini",
+    "voice": "alloy",
+    "pause": 0,
+    "barge_in": False,
+    "echo_gate": "off",
+    "tts_cache": False,
+}
+# Impostazioni della pipeline e opzioni del server di prova (vedi stub_server.py --help) per scenario
+SCENARIOS = {
+    "streaming": {"settings": {}, "server": {}},
+    "non_streaming": {"settings": {"streaming": False}, "server": {}},
+    "async": {"settings": {"engine": "async"}, "server": {}},
+    "incremental": {"settings": {"incremental_transcription": True}, "server": {}},
+    "tts_cache": {"settings": {"tts_cache": True}, "server": {}},
+    "slow_api": {"settings": {}, "server": {"transcribe_latency": 0.8, "chat_latency": 1.0, "tts_latency": 0.6}},
+    "long_reply": {"settings": {}, "server": {"reply_chars": 400}},
+}
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        # Senza /proc (macOS): solo il picco
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def stage_rows(metrics):
+    return {row["stage"]: row for row in metrics.stage_summary()}
+
+def rounded(value, digits=3):
+    return round(value, digits) if value is not None else None
+
+def run_child(scenario, turns, timeout, base_url, fixtures, playback_speed):
+    # Le variabili d'ambiente vanno impostate prima di importare l'assistente
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ["METRICS_ENABLED"] = "1"
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    os.environ["TTS_CACHE_DIR"] = os.path.join(workdir, "tts")
+    sys.path.insert(0, ROOT)
+    os.chdir(workdir)
+    import httpx
+    import assistant
+    from fake_audio import fixture_signal, install_fake_sounddevice
+
+    install_fake_sounddevice(fixture_signal(fixtures, assistant.SAMPLE_RATE), playback_speed=playback_speed)
+    settings = {**SETTINGS, **SCENARIOS[scenario]["settings"]}
+    metrics = assistant.metrics
+
+    def completed():
+        return stage_rows(metrics).get("turn", {}).get("count", 0)
+
+    cpu_started = time.process_time()
+    started = time.monotonic()
+    runner = threading.Thread(target=assistant.voice_loop, args=(settings,), daemon=True)
+    runner.start()
+    # La memoria per turno si misura dal primo turno concluso: import e connessioni non contano
+    baseline = None
+    while completed() < turns and time.monotonic() - started < timeout and runner.is_alive():
+        if baseline is None and completed():
+            baseline = (completed(), current_rss_mb())
+        time.sleep(0.1)
+    done = completed()
+    rss = current_rss_mb()
+    assistant.stop_event.set()
+    runner.join(timeout=5)
+    elapsed = time.monotonic() - started
+    cpu = time.process_time() - cpu_started
+
+    stages = stage_rows(metrics)
+    turn = stages.get("turn", {})
+    counters = metrics.snapshot()
+    ttfa_count = counters.get("time_to_first_audio_count", 0)
+    growth = None
+    if baseline is not None and done > baseline[0]:
+        growth = (rss - baseline[1]) * 1024 / (done - baseline[0])
+    try:
+        server = httpx.get(base_url.rsplit("/v1", 1)[0] + "/stats", timeout=5).json()
+    except httpx.HTTPError:
+        server = None
+    return {
+        "scenario": scenario,
+        "settings": SCENARIOS[scenario]["settings"],
+        "server_options": SCENARIOS[scenario]["server"],
+        "turns": done,
+        "seconds": round(elapsed, 2),
+        "ttfa_p50": rounded(metrics.percentile("time_to_first_audio", 50)),
+        "ttfa_p95": rounded(metrics.percentile("time_to_first_audio", 95)),
+        "ttfa_mean": rounded(counters["time_to_first_audio_sum"] / ttfa_count) if ttfa_count else None,
+        "turn_p50": rounded(turn.get("p50")),
+        "turn_p95": rounded(turn.get("p95")),
+        "turn_mean": rounded(turn.get("mean")),
+        "cpu_seconds": round(cpu, 3),
+        "cpu_per_turn": round(cpu / done, 3) if done else None,
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "rss_growth_kb_per_turn": rounded(growth, 1),
+        "stages": {
+            name: {key: rounded(row.get(key)) for key in ("count", "p50", "p95", "mean")}
+            for name, row in stages.items()
+        },
+        "server": server,
+    }
+
+def start_server(options):
+    command = [sys.executable, os.path.join(HERE, "stub_server.py"), "--port", "0"]
+    for name, value in options.items():
+        command += [f"--{name.replace('_', '-')}", str(value)]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    return server, server.stdout.readline().rsplit(" ", 1)[-1].strip()
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=120.0, help="tempo massimo per scenario (s)")
+    parser.add_argument("--wav", nargs="+", help="fixture WAV riprodotte dal microfono; predefinite: corpus a toni")
+    parser.add_argument("--playback-speed", type=float, default=1.0, help="velocità dell'uscita audio simulata")
+    parser.add_argument("--output", help="file JSON con metadati e risultati di tutti gli scenari")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = run_child(args.child, args.turns, args.timeout, args.base_url, args.wav, args.playback_speed)
+        print(json.dumps(result))
+        return
+
+    if not args.wav:
+        from fake_audio import write_tone_fixtures
+        args.wav = write_tone_fixtures(tempfile.mkdtemp(prefix="bench_fixtures_"))
+    report = {
+        "benchmark": "pipeline",
+        "started": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": {"turns": args.turns, "playback_speed": args.playback_speed, "fixtures": [os.path.basename(p) for p in args.wav]},
+        "results": [],
+    }
+    for scenario in args.scenarios:
+        server, base_url = start_server(SCENARIOS[scenario]["server"])
+        try:
+            output = subprocess.run(
+                [sys.executable, __file__, "--child", scenario, "--turns", str(args.turns), "--timeout", str(args.timeout),
+                 "--base-url", base_url, "--playback-speed", str(args.playback_speed), "--wav", *args.wav],
+                capture_output=True, text=True, check=True
+            ).stdout
+        finally:
+            server.terminate()
+        report["results"].append(json.loads(output.strip().splitlines()[-1]))
+        print(json.dumps(report["results"][-1]), flush=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    def show(value):
+        return f"{value:.2f}" if value is not None else "-"
+
+    print(f"\n{'scenario':14} {'turni':>5} {'TTFA p50':>9} {'TTFA p95':>9} {'turno p50':>10} {'CPU/turno':>10} {'KB/turno':>9}")
+    for r in report["results"]:
+        print(f"{r['scenario']:14} {r['turns']:>5} {show(r['ttfa_p50']):>9} {show(r['ttfa_p95']):>9} "
+              f"{show(r['turn_p50']):>10} {show(r['cpu_per_turn']):>10} {show(r['rss_growth_kb_per_turn']):>9}")
+
+if __name__ == "__main__":
+    main()
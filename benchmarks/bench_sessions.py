@@ -0,0 +1,157 @@
+"""Prova di carico del SessionManager: N conversazioni in parallelo nello stesso processo.
+
+Ogni sessione ha un microfono simulato che ripete una frase propria del corpus a toni, che il
+server di prova trascrive davvero; alla fine il log di ogni sessione deve contenere solo
+la sua frase (o un suo pezzo, se il microfono in loop viene ascoltato a frase iniziata). A metà prova la prima sessione viene fermata: le altre devono
+proseguire. Si verificano anche il limite di sessioni e la rimozione di quelle inattive.
+Uso: python benchmarks/bench_sessions.py --sessions 8 --duration 20 --output sessioni.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from functools import partial
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+SETTINGS = {
+    "language": "it",
+    "model": "gpt-4o-mini",
+    "voice": "alloy",
+    "pause": 0,
+    "barge_in": False,
+    "echo_gate": "off",
+    "warm_up": False,
+    "tts_cache": False,
+}
+SILENCE_SECONDS = 1.5             # pausa dopo la frase: chiude il turno
+
+def session_words(index, words):
+    # Tre parole ricavate dalle cifre dell'indice in base len(words): frasi tutte diverse
+    base = len(words)
+    digits = (index % base, index // base % base, index // base ** 2 % base)
+    return [words[digits[0]], words[(digits[0] + digits[1] + 5) % base], words[(digits[0] + digits[2] + 11) % base]]
+
+def own_text(text, phrase):
+    return f" {text} " in f" {phrase} "
+
+def user_texts(log):
+    entries, _ = log.read_since(0)
+    return [entry["user"][2:] for entry in entries if entry["user"].startswith("👤 ")]
+
+def run(sessions, duration, base_url, speed, engine):
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.chdir(tempfile.mkdtemp(prefix="bench_sessions_"))
+    import assistant
+    from fake_audio import TONE_WORDS, NullOutputStream, SyntheticInputStream, tone_utterance
+    from sessions import SessionLimit, SessionManager
+
+    words = list(TONE_WORDS)
+    phrases = {f"sessione-{index}": " ".join(session_words(index, words)) for index in range(sessions)}
+
+    def devices(session_id, log):
+        silence = np.zeros(int(assistant.SAMPLE_RATE * SILENCE_SECONDS), dtype=np.float32)
+        signal = np.concatenate([tone_utterance(phrases[session_id].split(), assistant.SAMPLE_RATE), silence])
+        return {
+            "engine": assistant.PlaybackEngine(stream_factory=partial(NullOutputStream, speed=speed), log=log),
+            "capture_engine": assistant.CaptureEngine(stream_factory=partial(SyntheticInputStream, signal=signal, speed=speed)),
+        }
+
+    manager = SessionManager(max_sessions=sessions, idle_seconds=duration * 2, devices=devices, reap_interval=None)
+    opened = [manager.open(session_id) for session_id in phrases]
+    try:
+        manager.open("una-di-troppo")
+        limit_enforced = False
+    except SessionLimit:
+        limit_enforced = True
+
+    started = time.monotonic()
+    cpu_started = time.process_time()
+    for session in opened:
+        manager.start(session, {**SETTINGS, "engine": engine})
+    time.sleep(duration / 2)
+    first = opened[0]
+    manager.stop(first)
+    time.sleep(1.0)
+    stopped_turns = len(user_texts(first.log))
+    others_at_stop = {session.id: len(user_texts(session.log)) for session in opened[1:]}
+    time.sleep(duration / 2)
+    for session in opened:
+        # Come le schede aperte: applicano il proprio log al proprio stato
+        session.state.sync(session.log)
+    elapsed = time.monotonic() - started
+    cpu = time.process_time() - cpu_started
+
+    results = []
+    for session in opened:
+        texts = user_texts(session.log)
+        conversation = session.state.get_conversation()
+        foreign = [text for text in texts if not own_text(text, phrases[session.id])]
+        results.append({
+            "session": session.id,
+            "phrase": phrases[session.id],
+            "turns": len(texts),
+            "conversation": len(conversation),
+            "foreign": len(foreign),
+        })
+
+    threads = [session.thread for session in opened if session.thread is not None]
+    reaped = manager.reap(now=time.monotonic() + duration * 2 + 1)
+    for thread in threads:
+        thread.join(timeout=5)
+    return {
+        "sessions": sessions,
+        "engine": engine,
+        "seconds": round(elapsed, 2),
+        "cpu_seconds": round(cpu, 2),
+        "turns": sum(row["turns"] for row in results),
+        "cross_talk": sum(row["foreign"] for row in results),
+        "idle_sessions": sum(1 for row in results if row["turns"] == 0),
+        "limit_enforced": limit_enforced,
+        "stop_isolated": len(user_texts(first.log)) == stopped_turns and all(
+            len(user_texts(session.log)) > others_at_stop[session.id] for session in opened[1:]
+        ),
+        "reaped": len(reaped),
+        "open_after_reap": len(manager),
+        "per_session": results,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20.0, help="durata della prova (s)")
+    parser.add_argument("--speed", type=float, default=1.0, help="velocità di microfono e uscita audio simulati")
+    parser.add_argument("--engine", default="threads", choices=["threads", "async"])
+    parser.add_argument("--output", help="file JSON con i risultati")
+    args = parser.parse_args()
+
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, "stub_server.py"), "--port", "0", "--transcribe-tones"],
+        stdout=subprocess.PIPE, text=True
+    )
+    try:
+        base_url = server.stdout.readline().rsplit(" ", 1)[-1].strip()
+        result = run(args.sessions, args.duration, base_url, args.speed, args.engine)
+    finally:
+        server.terminate()
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+    print(f"{'sessione':14} {'frase':28} {'turni':>6} {'righe':>6} {'estranee':>9}")
+    for row in result["per_session"]:
+        print(f"{row['session']:14} {row['phrase']:28} {row['turns']:>6} {row['conversation']:>6} {row['foreign']:>9}")
+    print(f"\n{result['sessions']} sessioni, {result['turns']} turni in {result['seconds']} s (CPU {result['cpu_seconds']} s); "
+          f"righe estranee {result['cross_talk']}, sessioni senza turni {result['idle_sessions']}")
+    print(f"limite rispettato: {result['limit_enforced']}, stop isolato: {result['stop_isolated']}, "
+          f"rimosse per inattività: {result['reaped']} (aperte dopo: {result['open_after_reap']})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Trascrizione incrementale (blocchi sovrapposti durante il parlato) contro trascrizione unica.
+
+Gli enunciati del corpus a toni vengono riprodotti in tempo reale da un microfono simulato;
+l'Endpointer li segmenta come nell'app e il server di prova li "trascrive" davvero.
+Si misura il tempo dalla fine del parlato (endpoint) al testo completo e l'accuratezza.
+Uso: python benchmarks/bench_transcription.py --utterances 8
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from functools import partial
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from fake_audio import TONE_WORDS, SyntheticInputStream, tone_utterance
+from stub_server import serve
+
+def word_errors(reference, hypothesis):
+    # Distanza di Levenshtein sulle parole
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref in enumerate(reference, 1):
+        current = [i]
+        for j, hyp in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref != hyp)))
+        previous = current
+    return previous[-1]
+
+def make_corpus(count, seed=0):
+    rng = random.Random(seed)
+    vocabulary = list(TONE_WORDS)
+    return [[rng.choice(vocabulary) for _ in range(rng.randint(6, 16))] for _ in range(count)]
+
+def run_utterance(assistant, words, incremental, chunk_seconds, overlap):
+    samplerate = assistant.SAMPLE_RATE
+    silence = np.zeros(int(samplerate * 0.5), dtype=np.float32)
+    signal = np.concatenate([silence, tone_utterance(words, samplerate), silence, silence, silence])
+    engine = assistant.CaptureEngine(stream_factory=partial(SyntheticInputStream, signal=signal)).start()
+    vad = assistant.VadConfig()
+    chunker = None
+    if incremental:
+        chunker = assistant.IncrementalTranscriber(
+            engine, "it", vad=vad, chunk_seconds=chunk_seconds, overlap_seconds=overlap
+        )
+    calls_before = assistant.metrics.snapshot().get("transcribe_chunks", 0)
+    try:
+        endpointer = assistant.Endpointer(engine, vad, chunker.begin if chunker else None)
+        recording = endpointer.next_utterance()
+        endpoint = time.monotonic()
+        if chunker:
+            text = chunker.finish(recording).result()
+            calls = assistant.metrics.snapshot().get("transcribe_chunks", 0) - calls_before
+        else:
+            audio_file, _ = assistant.encode_upload(recording.samples(), samplerate)
+            text = assistant.transcribe_audio(audio_file, "it")
+            calls = 1
+        latency = time.monotonic() - endpoint
+    finally:
+        engine.close()
+    hypothesis = text.split()
+    return {
+        "seconds": round(recording.duration, 2),
+        "latency": latency,
+        "calls": calls,
+        "errors": word_errors(words, hypothesis),
+        "words": len(words),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--utterances", type=int, default=8)
+    parser.add_argument("--chunk-seconds", type=float, default=2.0)
+    parser.add_argument("--overlap", type=float, default=0.5)
+    parser.add_argument("--latency", type=float, default=0.3, help="latenza fissa di Whisper simulata (s)")
+    parser.add_argument("--per-second", type=float, default=0.1, help="latenza per secondo di audio (s)")
+    args = parser.parse_args()
+
+    server, base_url = serve(
+        0, transcribe_tones=True, transcribe_latency=args.latency, transcribe_per_second=args.per_second
+    )
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    import assistant
+
+    results = {"single": [], "incremental": []}
+    for words in make_corpus(args.utterances):
+        for mode in results:
+            result = run_utterance(assistant, words, mode == "incremental", args.chunk_seconds, args.overlap)
+            results[mode].append(result)
+            print(json.dumps({"mode": mode, **result}), flush=True)
+    server.shutdown()
+
+    print(f"\n{'modalità':12} {'p50 s':>7} {'p95 s':>7} {'chiamate':>9} {'WER':>6}")
+    for mode, rows in results.items():
+        latencies = [row["latency"] for row in rows]
+        wer = sum(row["errors"] for row in rows) / sum(row["words"] for row in rows)
+        calls = sum(row["calls"] for row in rows) / len(rows)
+        print(f"{mode:12} {np.percentile(latencies, 50):>7.2f} {np.percentile(latencies, 95):>7.2f} "
+              f"{calls:>9.1f} {wer:>6.1%}")
+
+if __name__ == "__main__":
+    main()
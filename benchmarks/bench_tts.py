@@ -0,0 +1,93 @@
+"""Sintesi di una risposta lunga: una sola richiesta TTS contro pezzi sintetizzati in parallelo.
+
+Misura il tempo fino al primo audio (TTFA) e il tempo totale di sintesi di una risposta
+di circa 1000 caratteri contro il server di prova, con latenza che cresce con il testo.
+Uso: python benchmarks/bench_tts.py --runs 5 --parallel 1 2 4
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from stub_server import serve
+
+REPLY = (
+    "Roma è una città con una storia lunghissima, e visitarla in pochi giorni richiede un po' di organizzazione. "
+    "Il primo giorno puoi dedicarlo al centro storico, partendo dal Colosseo e proseguendo verso i Fori Imperiali. "
+    "Nel pomeriggio vale la pena salire al Campidoglio, da cui si gode una vista splendida sulla città antica. "
+    "Il secondo giorno puoi visitare i Musei Vaticani e la Basilica di San Pietro, prenotando i biglietti in anticipo. "
+    "La sera, una passeggiata tra Piazza Navona, il Pantheon e Fontana di Trevi è quasi obbligatoria. "
+    "Il terzo giorno puoi scegliere un quartiere meno turistico, come Trastevere o il Testaccio, per mangiare bene. "
+    "Ricorda di portare scarpe comode, una borraccia e di controllare gli orari dei musei, che cambiano spesso. "
+    "Se hai ancora tempo, la Galleria Borghese merita una visita, ma anche lì serve la prenotazione. "
+    "Se ti serve, posso anche suggerirti qualche ristorante tipico in ogni zona, dai più economici ai più raffinati. "
+    "Buon viaggio!"
+)
+
+class TimingEngine:
+    # Al posto del PlaybackEngine: registra quando arriva ogni chunk
+    def __init__(self):
+        self.first = None
+        self.last = None
+        self.bytes = 0
+
+    def begin_reply(self, on_start=None):
+        return 0
+
+    def enqueue(self, chunk, reply=None):
+        now = time.monotonic()
+        self.first = self.first or now
+        self.last = now
+        self.bytes += len(chunk)
+
+    def end_reply(self, on_done=None, reply=None):
+        if on_done:
+            on_done()
+
+    def cancel(self):
+        pass
+
+def run_single(assistant):
+    engine = TimingEngine()
+    started = time.monotonic()
+    for chunk in assistant.stream_speech(REPLY, "alloy"):
+        engine.enqueue(chunk)
+    return engine.first - started, engine.last - started, engine.bytes
+
+def run_parallel(assistant, parallel):
+    engine = TimingEngine()
+    started = time.monotonic()
+    assistant.synthesize_speech(REPLY, "alloy", engine=engine, parallel=parallel)
+    return engine.first - started, engine.last - started, engine.bytes
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--parallel", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--latency", type=float, default=0.2, help="latenza fissa del TTS (s)")
+    parser.add_argument("--per-char", type=float, default=0.002, help="latenza per carattere prima del primo byte (s)")
+    parser.add_argument("--realtime", type=float, default=8.0, help="velocità di generazione rispetto al tempo reale")
+    args = parser.parse_args()
+
+    server, base_url = serve(0, tts_latency=args.latency, tts_per_char=args.per_char, tts_realtime=args.realtime)
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ["TTS_MAX_IN_FLIGHT"] = str(max(args.parallel))
+    import assistant
+
+    print(f"Risposta di {len(REPLY)} caratteri, {len(list(assistant.split_sentences([REPLY])))} frasi\n")
+    modes = [("singola", run_single, None)] + [(f"parallela x{p}", run_parallel, p) for p in args.parallel]
+    print(f"{'modalità':14} {'TTFA p50':>9} {'totale p50':>11} {'audio s':>8}")
+    for name, run, parallel in modes:
+        results = [run(assistant) if parallel is None else run(assistant, parallel) for _ in range(args.runs)]
+        ttfa, total, size = zip(*results)
+        print(f"{name:14} {np.median(ttfa):>9.2f} {np.median(total):>11.2f} {size[0] / 2 / assistant.TTS_SAMPLE_RATE:>8.1f}")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Costo degli aggiornamenti della pagina Dash lungo una sessione lunga.
+
+Le voci di log di N turni simulati vengono scritte nel log di una sessione; dopo ogni turno più schede
+interrogano il callback di aggiornamento attraverso il server Flask di prova, ognuna con il proprio
+store (epoca e righe ricevute), come farebbe il browser. Per alcuni punti della sessione si misurano
+byte e CPU del server per aggiornamento, con e senza novità, accanto ai byte che costava
+ritrasmettere l'intera conversazione a ogni intervallo.
+Uso: python benchmarks/bench_ui.py --turns 2000 --clients 5 --output ui.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+REPLY = "Certo, ecco la risposta alla tua domanda. Spero che ti sia utile. Chiedimi pure altro se vuoi."
+
+class Tab:
+    # Una scheda del browser: stato dei componenti aggiornati dal callback e righe mostrate
+    def __init__(self, client, app, session_id):
+        self.client = client
+        self.app = app
+        self.session_id = session_id
+        self.n = 0
+        self.store = None
+        self.interval = app.POLL_FAST_MS
+        self.lines = 0
+
+    def payload(self):
+        return {
+            "output": "..conversation-log.children...status-text.children...conversation-store.data...interval.interval..",
+            "outputs": [
+                {"id": "conversation-log", "property": "children"},
+                {"id": "status-text", "property": "children"},
+                {"id": "conversation-store", "property": "data"},
+                {"id": "interval", "property": "interval"},
+            ],
+            "inputs": [{"id": "interval", "property": "n_intervals", "value": self.n}],
+            "state": [
+                {"id": "session-id", "property": "data", "value": self.session_id},
+                {"id": "conversation-store", "property": "data", "value": self.store},
+                {"id": "interval", "property": "interval", "value": self.interval},
+            ],
+            "changedPropIds": ["interval.n_intervals"],
+        }
+
+    def poll(self):
+        # Byte della risposta e CPU del server per una richiesta
+        self.n += 1
+        body = json.dumps(self.payload())
+        cpu = time.process_time()
+        response = self.client.post("/_dash-update-component", data=body, content_type="application/json")
+        cpu = time.process_time() - cpu
+        if response.status_code == 204:
+            return 0, cpu
+        data = response.get_json()["response"]
+        if "conversation-store" in data:
+            self.store = data["conversation-store"]["data"]
+        if "interval" in data:
+            self.interval = data["interval"]["interval"]
+        children = data.get("conversation-log", {}).get("children")
+        if isinstance(children, list):
+            self.lines = len(children)
+        elif isinstance(children, dict):
+            for operation in children["operations"]:
+                self.lines += len(operation["params"]["value"])
+        return len(response.data), cpu
+
+def legacy_bytes(conversation, status):
+    # Risposta del vecchio callback: conversazione intera come testo a ogni intervallo
+    return len(json.dumps({"multi": True, "response": {
+        "conversation-log": {"children": "\n".join(conversation)},
+        "status-text": {"children": status},
+    }}).encode("utf-8"))
+
+def add_turn(log_manager, turn):
+    log_manager.add_log("**[ASCOLTO]**", "")
+    log_manager.add_log(f"Domanda numero {turn}", "**[PENSO]**")
+    log_manager.add_log(f"Domanda numero {turn}", f"[PARLO] {REPLY}")
+    log_manager.add_log("", "**[PRONTO]**")
+
+def mean(values):
+    return sum(values) / len(values) if values else 0.0
+
+def run(turns, clients, checkpoints, idle_polls):
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.chdir(tempfile.mkdtemp(prefix="bench_ui_"))
+    import app
+
+    session = app.sessions.open("bench-ui")
+    flask_client = app.server.test_client()
+    tabs = [Tab(flask_client, app, session.id) for _ in range(clients)]
+    for tab in tabs:
+        tab.poll()
+    rows = []
+    active_bytes, active_cpu = [], []
+    for turn in range(1, turns + 1):
+        add_turn(session.log, turn)
+        for tab in tabs:
+            size, cpu = tab.poll()
+            active_bytes.append(size)
+            active_cpu.append(cpu)
+        if turn not in checkpoints:
+            continue
+        idle_bytes, idle_cpu = [], []
+        for _ in range(idle_polls):
+            for tab in tabs:
+                size, cpu = tab.poll()
+                idle_bytes.append(size)
+                idle_cpu.append(cpu)
+        # Una scheda aperta adesso riceve la conversazione intera una sola volta
+        late = Tab(flask_client, app, session.id)
+        join_bytes, _ = late.poll()
+        conversation = session.state.get_conversation()
+        rows.append({
+            "turns": turn,
+            "update_bytes": round(mean(active_bytes), 1),
+            "update_cpu_ms": round(mean(active_cpu) * 1000, 3),
+            "idle_bytes": round(mean(idle_bytes), 1),
+            "idle_cpu_ms": round(mean(idle_cpu) * 1000, 3),
+            "idle_interval_ms": tabs[0].interval,
+            "new_tab_bytes": join_bytes,
+            "legacy_update_bytes": legacy_bytes(conversation, session.state.current_status),
+            "lines_in_sync": all(tab.lines == len(conversation) for tab in tabs + [late]),
+        })
+        active_bytes, active_cpu = [], []
+        print(json.dumps(rows[-1]), flush=True)
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=5, help="schede che mostrano la stessa sessione")
+    parser.add_argument("--checkpoints", type=int, nargs="+", default=[10, 100, 500, 1000, 2000])
+    parser.add_argument("--idle-polls", type=int, default=5, help="interrogazioni senza novità per punto di misura")
+    parser.add_argument("--output", help="file JSON con i risultati")
+    args = parser.parse_args()
+
+    rows = run(args.turns, args.clients, set(args.checkpoints), args.idle_polls)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"benchmark": "ui", "clients": args.clients, "results": rows}, f, indent=2)
+
+    print(f"\n{'turni':>6} {'B/agg.':>8} {'CPU ms':>7} {'B idle':>7} {'CPU idle':>9} {'ms poll':>8} {'B nuova':>9} {'B prima':>9}")
+    for r in rows:
+        print(f"{r['turns']:>6} {r['update_bytes']:>8.0f} {r['update_cpu_ms']:>7.2f} {r['idle_bytes']:>7.0f} "
+              f"{r['idle_cpu_ms']:>9.2f} {r['idle_interval_ms']:>8} {r['new_tab_bytes']:>9} {r['legacy_update_bytes']:>9}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Dispositivi audio simulati per i benchmark: stessa interfaccia di sd.InputStream e sd.RawOutputStream."""
+import math
+import os
+import random
+import threading
+import time
+from collections import deque
+from functools import partial
+
+import numpy as np
+import scipy.io.wavfile
+from scipy.signal import resample_poly
+
+def speech_pattern(samplerate, speech_seconds=0.8, silence_seconds=1.5, frequency=220.0, amplitude=0.2):
+    # Un ciclo "enunciato + pausa": tono con leggero rumore, sopra le soglie di VAD e SpeechGate
+    t = np.arange(int(samplerate * speech_seconds)) / samplerate
+    rng = np.random.default_rng(0)
+    speech = amplitude * np.sin(2 * np.pi * frequency * t) + 0.005 * rng.standard_normal(t.size)
+    return np.concatenate([speech, np.zeros(int(samplerate * silence_seconds))]).astype(np.float32)
+
+# Corpus sintetico "a toni": ogni parola è un tono di frequenza propria, così il server
+# di prova può trascrivere davvero l'audio ricevuto (vedi stub_server.decode_tone_words)
+TONE_WORDS = {
+    word: 300.0 + 100.0 * index
+    for index, word in enumerate((
+        "ciao", "come", "stai", "oggi", "vorrei", "sapere", "quanto", "costa", "un", "biglietto",
+        "per", "roma", "domani", "mattina", "grazie", "mille",
+    ))
+}
+TONE_WORD_SECONDS = 0.3
+TONE_GAP_SECONDS = 0.12
+
+def tone_utterance(words, samplerate, amplitude=0.2):
+    parts = []
+    for word in words:
+        t = np.arange(int(samplerate * TONE_WORD_SECONDS)) / samplerate
+        # Rampa di 10 ms agli estremi per evitare click (e falsi zero-crossing)
+        envelope = np.minimum(1.0, np.minimum(t, t[::-1]) / 0.01)
+        parts.append(amplitude * envelope * np.sin(2 * np.pi * TONE_WORDS[word] * t))
+        parts.append(np.zeros(int(samplerate * TONE_GAP_SECONDS)))
+    return np.concatenate(parts).astype(np.float32)
+
+def load_wav(path, samplerate):
+    # WAV di qualunque formato intero o float -> float32 mono alla frequenza richiesta
+    rate, samples = scipy.io.wavfile.read(path)
+    if samples.dtype.kind in "iu":
+        info = np.iinfo(samples.dtype)
+        samples = (samples.astype(np.float32) - (info.max + info.min + 1) / 2) / ((info.max - info.min + 1) / 2)
+    samples = samples.astype(np.float32)
+    if samples.ndim > 1:
+        samples = samples.mean(axis=1)
+    if rate != samplerate:
+        divisor = math.gcd(rate, samplerate)
+        samples = resample_poly(samples, samplerate // divisor, rate // divisor).astype(np.float32)
+    return samples
+
+def fixture_signal(paths, samplerate, gap_seconds=1.5):
+    # Enunciati delle fixture in sequenza, ciascuno seguito da una pausa che chiude il turno
+    gap = np.zeros(int(samplerate * gap_seconds), dtype=np.float32)
+    return np.concatenate([part for path in paths for part in (load_wav(path, samplerate), gap)])
+
+def write_tone_fixtures(directory, count=4, samplerate=16000, seed=0):
+    # Fixture WAV del corpus a toni (int16, come un microfono), utili quando non se ne hanno di proprie
+    rng = random.Random(seed)
+    paths = []
+    for index in range(count):
+        words = [rng.choice(list(TONE_WORDS)) for _ in range(rng.randint(4, 8))]
+        pcm = (tone_utterance(words, samplerate) * 32767).astype(np.int16)
+        path = os.path.join(directory, f"utterance_{index}.wav")
+        scipy.io.wavfile.write(path, samplerate, pcm)
+        paths.append(path)
+    return paths
+
+class SyntheticInputStream:
+    # Chiama la callback in tempo reale con il segnale ripetuto all'infinito,
+    # oppure con i blocchi restituiti da source(frames)
+    def __init__(self, samplerate, blocksize, callback, signal=None, speed=1.0, source=None, **kwargs):
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.callback = callback
+        self.signal = speech_pattern(samplerate) if signal is None and source is None else signal
+        self.speed = speed
+        self.source = source
+        self._running = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._running.set()
+        self._thread = threading.Thread(target=self._feed, daemon=True)
+        self._thread.start()
+
+    def _feed(self):
+        position = 0
+        started = time.monotonic()
+        block_seconds = self.blocksize / self.samplerate / self.speed
+        blocks = 0
+        while self._running.is_set():
+            if self.source is not None:
+                block = self.source(self.blocksize)
+            else:
+                offset = position % len(self.signal)
+                block = self.signal[offset:offset + self.blocksize]
+            position += len(block)
+            self.callback(block.reshape(-1, 1), len(block), None, None)
+            blocks += 1
+            # Ritmo agganciato all'orologio: la deriva non si accumula
+            delay = started + blocks * block_seconds - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def stop(self):
+        self._running.clear()
+
+    def close(self):
+        self._running.clear()
+
+class ScriptedMicrophone:
+    # Microfono pilotato dal benchmark: silenzio finché non viene accodato un enunciato con play()
+    def __init__(self, speed=1.0):
+        self.speed = speed
+        self._pending = deque()
+        self._lock = threading.Lock()
+
+    def play(self, signal):
+        with self._lock:
+            self._pending.append(np.asarray(signal, dtype=np.float32))
+
+    def idle(self):
+        with self._lock:
+            return not self._pending
+
+    def read(self, frames):
+        block = np.zeros(frames, dtype=np.float32)
+        filled = 0
+        with self._lock:
+            while filled < frames and self._pending:
+                head = self._pending[0]
+                take = min(frames - filled, len(head))
+                block[filled:filled + take] = head[:take]
+                filled += take
+                if take == len(head):
+                    self._pending.popleft()
+                else:
+                    self._pending[0] = head[take:]
+        return block
+
+    def stream(self, samplerate, blocksize, callback, **kwargs):
+        return SyntheticInputStream(samplerate, blocksize, callback, speed=self.speed, source=self.read)
+
+class NullOutputStream:
+    # Scarta l'audio rispettando i tempi di una vera scheda audio (int16 mono)
+    def __init__(self, samplerate, speed=1.0, **kwargs):
+        self.samplerate = samplerate
+        self.speed = speed
+        self.written_bytes = 0
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def close(self):
+        pass
+
+    def write(self, data):
+        self.written_bytes += len(data)
+        time.sleep(len(data) / 2 / self.samplerate / self.speed)
+        return False
+
+def install_fake_sounddevice(signal=None, speed=1.0, playback_speed=1.0, microphone=None):
+    # Sostituisce i flussi di sounddevice: voice_loop usa microfono e altoparlante simulati senza modifiche
+    import sounddevice as sd
+    sd.InputStream = microphone.stream if microphone is not None else partial(SyntheticInputStream, signal=signal, speed=speed)
+    sd.RawOutputStream = partial(NullOutputStream, speed=playback_speed)
+    return sd
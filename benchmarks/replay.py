@@ -0,0 +1,235 @@
+"""Replay di una traccia registrata con settings["trace"]: rieseguire offline un turno lento.
+
+Il server di prova risponde con le risposte registrate, ricostruendo i tempi originali
+(attesa degli header e arrivo dei singoli chunk) oppure senza attese con --speed 0; il microfono
+simulato ripete l'audio di ogni turno appena la pipeline torna in ascolto. Alla fine i tempi
+dei turni (prima frase, primo audio, fine) vengono confrontati con quelli della traccia.
+Uso: python benchmarks/replay.py traces/trace-20250101-120000.zip --speed 1 --output replay.json
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from fake_audio import ScriptedMicrophone, install_fake_sounddevice, load_wav
+from stub_server import StubConfig, StubHandler, StubServer
+from tracing import Trace, endpoint, request_key
+
+LISTENING = "**[ASCOLTO]**"
+LEAD_SILENCE = 0.3                # silenzio prima di ogni enunciato, come un microfono già aperto (s)
+TURN_TIMEOUT = 120.0              # attesa massima perché la pipeline torni in ascolto (s)
+MAX_SPEED_AUDIO = 4.0             # con --speed 0: velocità del microfono simulato
+MAX_SPEED_PLAYBACK = 100.0        # con --speed 0: velocità dell'uscita audio simulata
+MARKS = ("transcribed", "first_sentence", "first_audio", "done")
+
+class RequestIndex:
+    # Abbina le richieste del replay a quelle registrate: prima per contenuto (richieste JSON
+    # identiche), altrimenti nell'ordine di registrazione dello stesso endpoint
+    def __init__(self, requests):
+        self.by_key = defaultdict(deque)
+        self.by_endpoint = defaultdict(deque)
+        self.used = set()
+        self.matched = 0
+        self.missed = 0
+        self._lock = threading.Lock()
+        for event in requests:
+            route = (event["method"], endpoint(event["path"]))
+            self.by_endpoint[route].append(event)
+            if "key" in event:
+                self.by_key[(route, event["key"])].append(event)
+
+    def _first_unused(self, candidates):
+        while candidates and candidates[0]["id"] in self.used:
+            candidates.popleft()
+        return candidates[0] if candidates else None
+
+    def match(self, method, path, body):
+        route = (method, endpoint(path))
+        with self._lock:
+            event = self._first_unused(self.by_key.get((route, request_key(body)), deque()))
+            if event is None:
+                event = self._first_unused(self.by_endpoint.get(route, deque()))
+            if event is None:
+                self.missed += 1
+                return None
+            self.used.add(event["id"])
+            self.matched += 1
+            return event
+
+class ReplayHandler(StubHandler):
+    # Richieste non presenti nella traccia: risposta generica del server di prova
+    trace = None
+    index = None
+    speed = 1.0
+
+    def _wait_until(self, started, offset):
+        if self.speed > 0:
+            delay = started + offset / self.speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def do_GET(self):
+        event = self.index.match("GET", self.path, b"")
+        if event is None:
+            return super().do_GET()
+        self.server.record(self.path, requests=1)
+        try:
+            self.replay(event)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def route(self, body):
+        event = self.index.match("POST", self.path, body)
+        if event is None:
+            return super().route(body)
+        self.replay(event)
+
+    def replay(self, event):
+        started = time.monotonic()
+        self._wait_until(started, event["headers"])
+        if not event["status"]:
+            # Errore di rete nella sessione originale: connessione chiusa senza risposta
+            self.close_connection = True
+            return
+        body = self.trace.read(event["body"])
+        self.send_response(event["status"])
+        self.send_header("Content-Type", event["content_type"] or "application/octet-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        position = 0
+        for offset, size in event["chunks"]:
+            self._wait_until(started, offset)
+            self._chunk(body[position:position + size])
+            position += size
+        if position < len(body):
+            self._chunk(body[position:])
+        self._chunk(b"")
+
+def serve_trace(trace, speed):
+    index = RequestIndex(trace.requests)
+    handler = type("Handler", (ReplayHandler,), {"config": StubConfig, "trace": trace, "index": index, "speed": speed})
+    server = StubServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, index, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+def wait_listening(log_manager, cursor, runner, timeout=TURN_TIMEOUT):
+    # Attende un nuovo "[ASCOLTO]" dopo la voce di log `cursor` e restituisce la sua posizione
+    deadline = time.monotonic() + timeout
+    while runner.is_alive() and time.monotonic() < deadline:
+        entries, _ = log_manager.read_since(cursor)
+        listening = [entry["seq"] for entry in entries if entry["user"] == LISTENING]
+        if listening:
+            return listening[-1]
+        if entries:
+            cursor = entries[-1]["seq"]
+        time.sleep(0.02)
+    return cursor
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)), 3) if values else None
+
+def compare(original, replayed):
+    rows = []
+    for before, after in zip(original, replayed):
+        row = {"turn": before["turn"], "user_text": before["user_text"], "replay_text": after["user_text"]}
+        for mark in MARKS:
+            row[mark] = {"original": before["marks"].get(mark), "replay": after["marks"].get(mark)}
+        rows.append(row)
+    summary = {}
+    for mark in MARKS:
+        for side in ("original", "replay"):
+            values = [row[mark][side] for row in rows if row[mark][side] is not None]
+            summary[f"{mark}_{side}_p50"] = percentile(values, 50)
+            summary[f"{mark}_{side}_p95"] = percentile(values, 95)
+    return rows, summary
+
+def run_replay(path, speed, output_trace):
+    trace = Trace(path)
+    server, index, base_url = serve_trace(trace, speed)
+    workdir = tempfile.mkdtemp(prefix="replay_")
+    # Le variabili d'ambiente vanno impostate prima di importare l'assistente; cache vuote come in una sessione nuova
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "replay")
+    os.environ["TTS_CACHE_DIR"] = os.path.join(workdir, "tts")
+    os.environ["RESPONSE_CACHE_PATH"] = os.path.join(workdir, "responses.sqlite3")
+    os.chdir(workdir)
+    import assistant
+
+    microphone = ScriptedMicrophone(speed=speed if speed > 0 else MAX_SPEED_AUDIO)
+    install_fake_sounddevice(microphone=microphone, playback_speed=speed if speed > 0 else MAX_SPEED_PLAYBACK)
+    # I turni vengono riprodotti uno alla volta: senza barge-in né ascolto sovrapposto il confronto è deterministico
+    settings = {**trace.meta["settings"], "barge_in": False, "overlapped": False, "pause": 0, "trace": output_trace}
+    lead = np.zeros(int(assistant.SAMPLE_RATE * LEAD_SILENCE), dtype=np.float32)
+
+    started = time.monotonic()
+    runner = threading.Thread(target=assistant.voice_loop, args=(settings,), daemon=True)
+    runner.start()
+    cursor = 0
+    for turn in trace.turns:
+        cursor = wait_listening(assistant.log_manager, cursor, runner)
+        if not runner.is_alive():
+            break
+        samples = load_wav(io.BytesIO(trace.read(turn["audio"])), assistant.SAMPLE_RATE)
+        microphone.play(np.concatenate([lead, samples]))
+        print(f"turno {turn['turn']}: {turn['user_text']}", flush=True)
+    wait_listening(assistant.log_manager, cursor, runner)
+    assistant.stop_event.set()
+    runner.join(timeout=5)
+    elapsed = time.monotonic() - started
+    server.shutdown()
+
+    replayed = Trace(output_trace)
+    rows, summary = compare(trace.turns, replayed.turns)
+    return {
+        "trace": os.path.abspath(path),
+        "speed": speed,
+        "seconds": round(elapsed, 2),
+        "turns": len(trace.turns),
+        "replayed_turns": len(replayed.turns),
+        "requests": {"recorded": len(trace.requests), "matched": index.matched, "missed": index.missed},
+        "summary": summary,
+        "turn_details": rows,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("trace", help="file zip registrato con settings['trace']")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = tempi originali, 0 = massima velocità")
+    parser.add_argument("--output", help="file JSON con il confronto turno per turno")
+    parser.add_argument("--replay-trace", help="dove salvare la traccia del replay (predefinito: cartella temporanea)")
+    args = parser.parse_args()
+
+    trace_path = os.path.abspath(args.trace)
+    output = os.path.abspath(args.output) if args.output else None
+    replay_trace = os.path.abspath(args.replay_trace) if args.replay_trace else os.path.join(tempfile.mkdtemp(prefix="replay_trace_"), "replay.zip")
+    result = run_replay(trace_path, args.speed, replay_trace)
+    result["replay_trace"] = replay_trace
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+    summary = result["summary"]
+
+    def show(value):
+        return f"{value:.2f}" if value is not None else "-"
+
+    print(f"\n{'tappa':16} {'orig p50':>9} {'replay p50':>11} {'orig p95':>9} {'replay p95':>11}")
+    for mark in MARKS:
+        print(f"{mark:16} {show(summary[f'{mark}_original_p50']):>9} {show(summary[f'{mark}_replay_p50']):>11} "
+              f"{show(summary[f'{mark}_original_p95']):>9} {show(summary[f'{mark}_replay_p95']):>11}")
+    requests = result["requests"]
+    print(f"\nturni {result['replayed_turns']}/{result['turns']}, richieste abbinate {requests['matched']}/{requests['recorded']}"
+          f" (non registrate: {requests['missed']}), {result['seconds']} s")
+
+if __name__ == "__main__":
+    main()
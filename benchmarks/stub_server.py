@@ -0,0 +1,227 @@
+"""Server HTTP locale che imita le API OpenAI usate dall'assistente (Whisper, chat, TTS).
+
+Latenze e dimensioni delle risposte sono configurabili, così i benchmark misurano il
+comportamento della pipeline senza rete né costi. Avvio: python benchmarks/stub_server.py --port 8765
+e poi OPENAI_BASE_URL=http://127.0.0.1:8765/v1; GET /stats restituisce richieste e byte per endpoint.
+"""
+import argparse
+import io
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import scipy.io.wavfile
+
+from fake_audio import TONE_WORDS
+
+TTS_SAMPLE_RATE = 24000
+DEFAULT_REPLY = "Certo, ecco la risposta alla tua domanda. Spero che ti sia utile. Chiedimi pure altro se vuoi."
+
+class StubConfig:
+    transcribe_latency = 0.3      # tempo di risposta di Whisper (s)
+    transcribe_per_second = 0.0   # latenza aggiuntiva per secondo di audio ricevuto (s)
+    transcribe_tones = False      # trascrive l'audio del corpus a toni invece di restituire `transcript`
+    chat_latency = 0.3            # tempo fino al primo token (s)
+    token_delay = 0.02            # intervallo tra i token in streaming (s)
+    tts_latency = 0.2             # tempo fino al primo byte audio (s)
+    tts_per_char = 0.0            # attesa aggiuntiva per carattere di testo prima del primo byte (s)
+    tts_realtime = 4.0            # fattore di velocità della sintesi rispetto al tempo reale
+    seconds_per_char = 0.06       # durata dell'audio sintetizzato per carattere
+    transcript = "Che tempo fa oggi a Roma?"
+    reply = DEFAULT_REPLY
+    reply_chars = 0               # se > 0, la risposta viene allungata (o accorciata) a circa tanti caratteri
+
+def sized_reply(reply, chars):
+    # Ripete la risposta fino alla lunghezza richiesta, tagliando all'ultima parola intera
+    if chars <= 0:
+        return reply
+    text = " ".join([reply] * (chars // len(reply) + 1))[:chars]
+    return text.rsplit(" ", 1)[0] if " " in text else text
+
+def tone(seconds, frequency=180.0):
+    t = np.arange(int(TTS_SAMPLE_RATE * seconds)) / TTS_SAMPLE_RATE
+    return (0.3 * np.sin(2 * np.pi * frequency * t) * 32767).astype(np.int16).tobytes()
+
+def decode_tone_words(wav_bytes, min_word_seconds=0.08):
+    # "Trascrizione" del corpus a toni: segmenti sopra soglia -> frequenza dominante -> parola
+    samplerate, samples = scipy.io.wavfile.read(io.BytesIO(wav_bytes))
+    samples = samples.astype(np.float32) / 32768.0
+    frame = samplerate // 100
+    frames = len(samples) // frame
+    if frames == 0:
+        return [], 0.0
+    rms = np.sqrt(np.mean(samples[:frames * frame].reshape(frames, frame) ** 2, axis=1))
+    voiced = np.concatenate([[False], rms > 0.02, [False]])
+    edges = np.flatnonzero(np.diff(voiced.astype(np.int8)))
+    frequencies = np.array(list(TONE_WORDS.values()))
+    names = list(TONE_WORDS)
+    words = []
+    for begin, end in zip(edges[::2], edges[1::2]):
+        if (end - begin) * frame < min_word_seconds * samplerate:
+            continue
+        segment = samples[begin * frame:end * frame]
+        spectrum = np.abs(np.fft.rfft(segment * np.hanning(len(segment))))
+        peak = np.argmax(spectrum) * samplerate / len(segment)
+        nearest = int(np.argmin(np.abs(frequencies - peak)))
+        if abs(frequencies[nearest] - peak) < 40:
+            words.append(names[nearest])
+    return words, len(samples) / samplerate
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = StubConfig
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length else b""
+
+    def _count(self, bytes_in=0, bytes_out=0):
+        self.server.record(self.path, bytes_in, bytes_out)
+
+    def _json(self, payload, status=200):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        self._count(bytes_out=len(data))
+
+    def _start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+        self._count(bytes_out=len(data))
+
+    def do_GET(self):
+        self.server.record(self.path, requests=1)
+        if self.path == "/stats":
+            return self._json(self.server.snapshot())
+        if self.path.startswith("/v1/models/"):
+            name = self.path.rsplit("/", 1)[-1]
+            return self._json({"id": name, "object": "model", "created": 0, "owned_by": "stub"})
+        self._json({"error": {"message": "not found"}}, 404)
+
+    def do_POST(self):
+        try:
+            body = self._body()
+            self.server.record(self.path, len(body), requests=1)
+            self.route(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # Il client ha chiuso la richiesta (barge-in, Stop): non è un errore
+            self.close_connection = True
+
+    def route(self, body):
+        if self.path == "/v1/audio/transcriptions":
+            return self.transcription(body)
+        if self.path == "/v1/chat/completions":
+            return self.chat(json.loads(body))
+        if self.path == "/v1/audio/speech":
+            return self.speech(json.loads(body))
+        self._json({"error": {"message": "not found"}}, 404)
+
+    def transcription(self, body):
+        # Il corpo è multipart: il WAV caricato inizia con l'intestazione RIFF
+        start = body.find(b"RIFF")
+        text = self.config.transcript
+        seconds = 0.0
+        if start >= 0:
+            size = int.from_bytes(body[start + 4:start + 8], "little") + 8
+            words, seconds = decode_tone_words(body[start:start + size])
+            if self.config.transcribe_tones:
+                text = " ".join(words)
+        time.sleep(self.config.transcribe_latency + self.config.transcribe_per_second * seconds)
+        return self._json({"text": text})
+
+    def chat(self, request):
+        time.sleep(self.config.chat_latency)
+        reply = sized_reply(self.config.reply, self.config.reply_chars)
+        if not request.get("stream"):
+            return self._json({
+                "id": "stub", "object": "chat.completion", "created": 0, "model": request["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+            })
+        self._start_chunked("text/event-stream")
+        for word in reply.split(" "):
+            chunk = {
+                "id": "stub", "object": "chat.completion.chunk", "created": 0, "model": request["model"],
+                "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+            }
+            self._chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+            time.sleep(self.config.token_delay)
+        self._chunk(b"data: [DONE]\n\n")
+        self._chunk(b"")
+
+    def speech(self, request):
+        time.sleep(self.config.tts_latency + self.config.tts_per_char * len(request["input"]))
+        audio = tone(len(request["input"]) * self.config.seconds_per_char)
+        self._start_chunked("application/octet-stream")
+        step = TTS_SAMPLE_RATE // 10 * 2
+        for start in range(0, len(audio), step):
+            self._chunk(audio[start:start + step])
+            time.sleep(0.1 / self.config.tts_realtime)
+        self._chunk(b"")
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+
+    def record(self, path, bytes_in=0, bytes_out=0, requests=0):
+        with self._stats_lock:
+            entry = self.stats.setdefault(path, {"requests": 0, "bytes_in": 0, "bytes_out": 0})
+            entry["requests"] += requests
+            entry["bytes_in"] += bytes_in
+            entry["bytes_out"] += bytes_out
+
+    def snapshot(self):
+        with self._stats_lock:
+            return {path: dict(entry) for path, entry in self.stats.items() if path != "/stats"}
+
+    def handle_error(self, request, client_address):
+        # Connessioni keep-alive chiuse dal client: normali a fine sessione
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+def serve(port=0, **overrides):
+    # Avvia il server in un thread e restituisce (server, base_url)
+    config = type("Config", (StubConfig,), overrides)
+    handler = type("Handler", (StubHandler,), {"config": config})
+    server = StubServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    for name in ("transcribe_latency", "transcribe_per_second", "chat_latency", "token_delay", "tts_latency", "tts_per_char", "tts_realtime"):
+        parser.add_argument(f"--{name.replace('_', '-')}", type=float, default=getattr(StubConfig, name))
+    parser.add_argument("--seconds-per-char", type=float, default=StubConfig.seconds_per_char)
+    parser.add_argument("--reply-chars", type=int, default=0, help="lunghezza approssimativa della risposta GPT")
+    parser.add_argument("--transcript", default=StubConfig.transcript)
+    parser.add_argument("--transcribe-tones", action="store_true")
+    args = vars(parser.parse_args())
+    port = args.pop("port")
+    server, url = serve(port, **args)
+    print(f"Stub OpenAI in ascolto su {url}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+CACHE_WAIT_INTERVAL = 0.05        # controllo della cancellazione durante l'attesa di una richiesta in corso (s)
+
+def normalize_text(text):
+    # Testi che differiscono solo per spazi o composizione Unicode producono lo stesso audio
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+def normalize_prompt(text):
+    # Per le domande contano solo le parole: "Chi sei?" e "chi  sei" sono la stessa richiesta
+    text = unicodedata.normalize("NFC", text).casefold()
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s]", " ", text)).strip()
+
+class _Flight:
+    # Richiesta upstream in corso per una chiave: chi arriva dopo attende il risultato
+    def __init__(self):
+        self.done = threading.Event()
+        self.data = None
+
+class TtsCache:
+    # Due livelli: LRU in memoria limitata in byte e archivio su disco con tetto di dimensione;
+    # le richieste concorrenti per la stessa chiave producono una sola chiamata upstream
+    def __init__(self, directory=None, memory_bytes=32 * 1024 * 1024, disk_bytes=256 * 1024 * 1024, metrics=None):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.metrics = metrics
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.bytes_saved = 0
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk = OrderedDict()
+        self._disk_size = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._load_index()
+
+    @staticmethod
+    def key(model, voice, response_format, text):
+        payload = "\x1f".join((model, voice, response_format, normalize_text(text)))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.bin")
+
+    def _load_index(self):
+        # Ordine LRU ricostruito dalla data di modifica, aggiornata a ogni lettura
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp"):
+                # Scrittura interrotta da un processo terminato: il file non è mai diventato una voce
+                self._discard(os.path.join(self.directory, name))
+            elif name.endswith(".bin"):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+        self._evict_disk()
+
+    def _remember(self, key, data):
+        if len(data) > self.memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key))
+        self._memory[key] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    @staticmethod
+    def _discard(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _evict_disk(self):
+        while self._disk_size > self.disk_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            self._discard(self._path(key))
+
+    def _read(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return data
+            on_disk = self.directory and key in self._disk
+            if on_disk:
+                self._disk.move_to_end(key)
+        if not on_disk:
+            return None
+        try:
+            path = self._path(key)
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self._disk_size -= self._disk.pop(key, 0)
+            return None
+        with self._lock:
+            self._remember(key, data)
+        return data
+
+    def _write(self, key, data):
+        with self._lock:
+            self._remember(key, data)
+        if not self.directory or len(data) > self.disk_bytes:
+            return
+        path = self._path(key)
+        try:
+            # Scrittura atomica: un file troncato non deve mai essere servito
+            with open(f"{path}.tmp", "wb") as f:
+                f.write(data)
+            os.replace(f"{path}.tmp", path)
+        except OSError:
+            # Disco pieno o in sola lettura: l'audio resta in memoria, il file parziale va rimosso
+            self._discard(f"{path}.tmp")
+            return
+        with self._lock:
+            self._disk_size += len(data) - self._disk.pop(key, 0)
+            self._disk[key] = len(data)
+            self._evict_disk()
+
+    def _record(self, hit, size=0, coalesced=False):
+        with self._lock:
+            if hit:
+                self.hits += 1
+                self.bytes_saved += size
+                self.coalesced += coalesced
+            else:
+                self.misses += 1
+            ratio = self.hits / (self.hits + self.misses)
+        if self.metrics is not None:
+            if hit:
+                self.metrics.incr("tts_cache_hits")
+                self.metrics.incr("tts_cache_bytes_saved", size)
+                if coalesced:
+                    self.metrics.incr("tts_cache_coalesced")
+            else:
+                self.metrics.incr("tts_cache_misses")
+            self.metrics.observe("tts_cache_hit_ratio", ratio)
+
+    def acquire(self, key, cancelled=None):
+        # Restituisce (audio, None) se l'audio è in cache o è stato appena scaricato da un'altra
+        # richiesta; altrimenti (None, flight) e il chiamante deve chiamare finish(key, flight, audio)
+        while True:
+            data = self._read(key)
+            if data is not None:
+                self._record(True, len(data))
+                return data, None
+            with self._lock:
+                flight = self._flights.get(key)
+                if flight is None:
+                    flight = self._flights[key] = _Flight()
+                    leader = True
+                else:
+                    leader = False
+            if leader:
+                self._record(False)
+                return None, flight
+            while not flight.done.wait(CACHE_WAIT_INTERVAL):
+                if cancelled is not None and cancelled():
+                    return None, None
+            if flight.data is not None:
+                self._record(True, len(flight.data), coalesced=True)
+                return flight.data, None
+            # La richiesta di riferimento è fallita o è stata annullata: si riprova in proprio
+
+    def finish(self, key, flight, data=None):
+        # data=None segnala un download incompleto: non viene memorizzato
+        if data:
+            self._write(key, data)
+        with self._lock:
+            self._flights.pop(key, None)
+        flight.data = data or None
+        flight.done.set()
+
+    def fetch(self, key, producer, cancelled=None):
+        data, flight = self.acquire(key, cancelled)
+        if flight is None:
+            return data
+        try:
+            data = producer()
+        except BaseException:
+            self.finish(key, flight)
+            raise
+        self.finish(key, flight, data)
+        return data
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "bytes_saved": self.bytes_saved,
+                "memory_bytes": self._memory_size,
+                "disk_bytes": self._disk_size,
+            }
+
+class ResponseCache:
+    # Risposte GPT su SQLite, condivisibili tra processi: scadenza dopo ttl secondi
+    # ed espulsione delle voci usate meno di recente oltre max_entries
+    def __init__(self, path, ttl=24 * 3600, max_entries=1000, bypass=None, metrics=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.bypass = bypass
+        self.metrics = metrics
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, reply TEXT NOT NULL, created REAL NOT NULL, "
+                "last_used REAL NOT NULL, latency REAL NOT NULL DEFAULT 0)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+    def _connection(self):
+        # Una connessione per thread; WAL permette letture concorrenti da altri processi
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=5.0)
+            db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def _incr(self, name, amount=1):
+        if self.metrics is not None:
+            self.metrics.incr(name, amount)
+
+    def key(self, model, prompt, context=None):
+        # None per le richieste che dipendono dal momento (ora, meteo, notizie...): vanno sempre a GPT
+        normalized = normalize_prompt(prompt)
+        if not normalized or (self.bypass is not None and self.bypass.search(normalized)):
+            self._incr("response_cache_bypassed")
+            return None
+        digest = hashlib.sha256(repr(context).encode("utf-8")).hexdigest() if context else ""
+        payload = "\x1f".join((model, digest, normalized))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        try:
+            with self._connection() as db:
+                row = db.execute(
+                    "SELECT reply, latency FROM responses WHERE key = ? AND created > ?", (key, now - self.ttl)
+                ).fetchone()
+                if row is not None:
+                    db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+        except sqlite3.Error:
+            row = None
+        if row is None:
+            self._incr("response_cache_misses")
+            return None
+        self._incr("response_cache_hits")
+        self._incr("response_cache_latency_saved", row[1])
+        return row[0]
+
+    def put(self, key, reply, latency=0.0):
+        now = time.time()
+        try:
+            with self._connection() as db:
+                db.execute(
+                    "INSERT OR REPLACE INTO responses (key, reply, created, last_used, latency) VALUES (?, ?, ?, ?, ?)",
+                    (key, reply, now, now, latency)
+                )
+                db.execute("DELETE FROM responses WHERE created <= ?", (now - self.ttl,))
+                db.execute(
+                    "DELETE FROM responses WHERE key NOT IN "
+                    "(SELECT key FROM responses ORDER BY last_used DESC LIMIT ?)", (self.max_entries,)
+                )
+        except sqlite3.Error:
+            # Un database occupato o in sola lettura non deve interrompere il turno
+            self._incr("response_cache_errors")
+
+    def stats(self):
+        with self._connection() as db:
+            entries, = db.execute("SELECT COUNT(*) FROM responses").fetchone()
+        return {"entries": entries}
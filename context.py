@@ -0,0 +1,115 @@
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+MESSAGE_OVERHEAD_TOKENS = 4       # ruolo e separatori di ogni messaggio nel formato chat
+
+@lru_cache(maxsize=1)
+def _encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        # Tabelle non scaricabili (offline): si ripiega sulla stima
+        return None
+
+def count_tokens(text):
+    encoding = _encoding()
+    if encoding is None:
+        # Stima: circa 4 caratteri per token
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+def count_message_tokens(messages):
+    return sum(count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+class ConversationContext:
+    # Memoria della conversazione: prefisso di sistema fisso, riassunto dei turni più vecchi
+    # e finestra degli ultimi turni entro max_tokens. Il riassunto viene aggiornato in background
+    # da summarize(riassunto_precedente, turni) e non rallenta il turno in corso
+    def __init__(self, system_prompt, summarize=None, max_tokens=1500, fold_ratio=0.6, metrics=None):
+        self.system_prompt = system_prompt
+        self.summarize = summarize
+        self.max_tokens = max_tokens
+        self.fold_ratio = fold_ratio
+        self.metrics = metrics
+        self.summary = ""
+        self.turns = []            # (utente, risposta, token) in ordine cronologico
+        self._folding = 0          # turni in testa alla finestra in corso di riassunto
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="context-summary")
+
+    def _window_tokens(self):
+        return sum(tokens for _, _, tokens in self.turns)
+
+    def messages(self, prompt):
+        # Il prefisso di sistema resta identico tra i turni, così il prompt resta riusabile dalla cache
+        # lato API; seguono riassunto, turni recenti e domanda corrente
+        with self._lock:
+            summary = self.summary
+            turns = list(self.turns)
+        messages = [{"role": "system", "content": self.system_prompt}]
+        if summary:
+            messages.append({"role": "system", "content": f"Riassunto della conversazione precedente: {summary}"})
+        for user_text, reply, _ in turns:
+            messages.append({"role": "user", "content": user_text})
+            messages.append({"role": "assistant", "content": reply})
+        messages.append({"role": "user", "content": prompt})
+        if self.metrics is not None:
+            self.metrics.observe("prompt_tokens", count_message_tokens(messages))
+            self.metrics.observe("context_turns", len(turns))
+        return messages
+
+    def add_turn(self, user_text, reply):
+        tokens = count_tokens(user_text) + count_tokens(reply) + 2 * MESSAGE_OVERHEAD_TOKENS
+        with self._lock:
+            self.turns.append((user_text, reply, tokens))
+            if self._folding or self._window_tokens() <= self.max_tokens:
+                return
+            # Si riassumono i turni più vecchi finché la finestra scende sotto fold_ratio * max_tokens,
+            # così una chiamata di riassunto copre più turni
+            target = self.max_tokens * self.fold_ratio
+            remaining = self._window_tokens()
+            count = 0
+            while count < len(self.turns) - 1 and remaining > target:
+                remaining -= self.turns[count][2]
+                count += 1
+            self._folding = count
+            folded = [(user, answer) for user, answer, _ in self.turns[:count]]
+            summary = self.summary
+        if self.summarize is None:
+            self._apply(summary, count)
+        else:
+            # Nel contesto del turno: la richiesta di riassunto resta nella traccia della sua pipeline
+            self._executor.submit(contextvars.copy_context().run, self._fold, summary, folded, count)
+
+    def _fold(self, summary, folded, count):
+        try:
+            summary = self.summarize(summary, folded)
+        except Exception:
+            # Riassunto non disponibile: i turni restano nella finestra e si riprova al prossimo turno
+            if self.metrics is not None:
+                self.metrics.incr("context_summary_failures")
+            with self._lock:
+                self._folding = 0
+            return
+        self._apply(summary, count)
+
+    def _apply(self, summary, count):
+        with self._lock:
+            self.summary = summary
+            del self.turns[:count]
+            self._folding = 0
+        if self.metrics is not None:
+            self.metrics.incr("context_summaries")
+            self.metrics.observe("summary_tokens", count_tokens(summary))
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
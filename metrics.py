@@ -0,0 +1,253 @@
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from dataclasses import dataclass, field
+
+import numpy as np
+
+# Limiti superiori dei bucket in secondi: progressione geometrica (fattore √2) da 1 ms a circa 3 minuti
+HISTOGRAM_BUCKETS = tuple(0.001 * 2 ** (i / 2) for i in range(36))
+# Ordine degli stadi nel pannello e nell'esportazione: quelli non elencati seguono in ordine alfabetico
+STAGE_ORDER = ("record", "encode", "transcribe", "chat_first_token", "chat", "tts", "playback", "first_audio", "turn")
+METRIC_PREFIX = "speak_"
+
+class Histogram:
+    # Conteggi per bucket senza lock sul percorso caldo: ogni thread incrementa il proprio shard,
+    # la lettura (rara) somma tutti gli shard. Gli shard dei thread terminati confluiscono in un
+    # totale comune, così il numero di shard resta pari ai thread vivi
+    def __init__(self, buckets=HISTOGRAM_BUCKETS):
+        self.buckets = buckets
+        self._local = threading.local()
+        self._shards = []
+        # Ultima cella: somma dei valori osservati
+        self._retired = [0] * (len(buckets) + 1) + [0.0]
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = [0] * (len(self.buckets) + 1) + [0.0]
+            with self._lock:
+                self._fold_dead()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _fold_dead(self):
+        # Da chiamare con il lock: un thread terminato non scriverà più nel proprio shard
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                for index, value in enumerate(shard):
+                    self._retired[index] += value
+        self._shards = alive
+
+    def observe(self, value):
+        shard = self._shard()
+        shard[bisect_left(self.buckets, value)] += 1
+        shard[-1] += value
+
+    def counts(self):
+        # Conteggi per bucket (l'ultimo è +Inf) e somma dei valori
+        with self._lock:
+            self._fold_dead()
+            shards = [list(self._retired)] + [shard for _, shard in self._shards]
+        counts = [0] * (len(self.buckets) + 1)
+        total = 0.0
+        for shard in shards:
+            for index in range(len(counts)):
+                counts[index] += shard[index]
+            total += shard[-1]
+        return counts, total
+
+    def quantile(self, q, counts=None):
+        # Stima per interpolazione lineare dentro il bucket che contiene il quantile
+        counts = counts or self.counts()[0]
+        count = sum(counts)
+        if not count:
+            return None
+        rank = q * count
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+class Span:
+    # Durata di uno stadio misurata con l'orologio monotono, più i byte scambiati con l'API
+    __slots__ = ("metrics", "stage", "started", "upload_bytes", "download_bytes")
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+        self.upload_bytes = 0
+        self.download_bytes = 0
+
+    def uploaded(self, size):
+        self.upload_bytes += size
+
+    def downloaded(self, size):
+        self.download_bytes += size
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe_stage(self.stage, time.monotonic() - self.started)
+        if self.upload_bytes:
+            self.metrics.add_stage("upload_bytes", self.stage, self.upload_bytes)
+        if self.download_bytes:
+            self.metrics.add_stage("download_bytes", self.stage, self.download_bytes)
+        return False
+
+class _NullSpan:
+    # Misure disattivate: stessa interfaccia di Span, nessun costo
+    def uploaded(self, size):
+        pass
+
+    def downloaded(self, size):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NULL_SPAN = _NullSpan()
+
+def _metric_name(name):
+    return METRIC_PREFIX + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+@dataclass
+class PipelineMetrics:
+    counters: dict = field(default_factory=dict)
+    gauges: dict = field(default_factory=dict)
+    recent: dict = field(default_factory=dict)
+    # Istogrammi di latenza per stadio e contatori per (grandezza, stadio): byte e ritentativi
+    stages: dict = field(default_factory=dict)
+    stage_counters: dict = field(default_factory=dict)
+    enabled: bool = True
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def incr(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, value):
+        # Ultimo valore per turno più somma e conteggio cumulativi
+        if not self.enabled:
+            return
+        with self._lock:
+            self.gauges[name] = value
+            self.counters[f"{name}_sum"] = self.counters.get(f"{name}_sum", 0) + value
+            self.counters[f"{name}_count"] = self.counters.get(f"{name}_count", 0) + 1
+            self.recent.setdefault(name, deque(maxlen=200)).append(value)
+
+    def percentile(self, name, q, min_samples=1):
+        with self._lock:
+            values = list(self.recent.get(name, ()))
+        if len(values) < min_samples:
+            return None
+        return float(np.percentile(values, q))
+
+    def snapshot(self):
+        with self._lock:
+            return {**self.counters, **self.gauges}
+
+    def span(self, stage):
+        return Span(self, stage) if self.enabled else NULL_SPAN
+
+    def observe_stage(self, stage, seconds):
+        if not self.enabled:
+            return
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self.stages.setdefault(stage, Histogram())
+        histogram.observe(seconds)
+
+    def add_stage(self, name, stage, amount=1):
+        if not self.enabled:
+            return
+        key = (name, stage)
+        with self._lock:
+            self.stage_counters[key] = self.stage_counters.get(key, 0) + amount
+
+    def retried(self, stage):
+        self.add_stage("retries", stage)
+
+    def _stage_names(self):
+        with self._lock:
+            names = set(self.stages) | {stage for _, stage in self.stage_counters}
+        ranked = {stage: index for index, stage in enumerate(STAGE_ORDER)}
+        return sorted(names, key=lambda stage: (ranked.get(stage, len(STAGE_ORDER)), stage))
+
+    def stage_summary(self, quantiles=(0.5, 0.95, 0.99)):
+        # Per il pannello e i benchmark: campioni, quantili e media (s), byte e ritentativi di ogni stadio
+        with self._lock:
+            stage_counters = dict(self.stage_counters)
+        summary = []
+        for stage in self._stage_names():
+            row = {"stage": stage, "count": 0}
+            histogram = self.stages.get(stage)
+            if histogram is not None:
+                counts, total = histogram.counts()
+                row["count"] = sum(counts)
+                row["mean"] = total / row["count"] if row["count"] else None
+                for q in quantiles:
+                    row[f"p{round(q * 100)}"] = histogram.quantile(q, counts)
+            for name in ("upload_bytes", "download_bytes", "retries"):
+                row[name] = stage_counters.get((name, stage), 0)
+            summary.append(row)
+        return summary
+
+    def render_prometheus(self):
+        # Formato di esposizione testuale di Prometheus (versione 0.0.4)
+        with self._lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            stage_counters = dict(self.stage_counters)
+        lines = []
+        for name, value in sorted(counters.items()):
+            metric = _metric_name(name) + "_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {_format_value(value)}"]
+        for name, value in sorted(gauges.items()):
+            metric = _metric_name(name)
+            lines += [f"# TYPE {metric} gauge", f"{metric} {_format_value(value)}"]
+        stages = self._stage_names()
+        metric = _metric_name("stage_seconds")
+        lines += [f"# HELP {metric} Durata degli stadi della pipeline.", f"# TYPE {metric} histogram"]
+        for stage in stages:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                continue
+            counts, total = histogram.counts()
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{stage="{stage}",le="{bound:.6g}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{metric}_bucket{{stage="{stage}",le="+Inf"}} {cumulative}')
+            lines.append(f'{metric}_sum{{stage="{stage}"}} {total!r}')
+            lines.append(f'{metric}_count{{stage="{stage}"}} {cumulative}')
+        for name in ("upload_bytes", "download_bytes", "retries"):
+            metric = _metric_name(f"stage_{name}") + "_total"
+            lines.append(f"# TYPE {metric} counter")
+            for stage in stages:
+                if (name, stage) in stage_counters:
+                    lines.append(f'{metric}{{stage="{stage}"}} {stage_counters[(name, stage)]}')
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+
+from assistant import STOP_TIMEOUT, AppState, LogManager, PlaybackEngine, voice_loop
+
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "4"))
+SESSION_IDLE_SECONDS = float(os.getenv("SESSION_IDLE_SECONDS", "300"))
+SESSION_REAP_INTERVAL = 10.0      # ogni quanto si cercano sessioni inattive (s)
+
+class SessionLimit(Exception):
+    pass
+
+def default_devices(session_id, log):
+    # Uscita audio propria: lo Stop di una sessione non zittisce le altre e i suoi errori finiscono nel
+    # log della sessione. Il microfono (CaptureEngine) lo apre la pipeline a ogni avvio
+    return {"engine": PlaybackEngine(log=log)}
+
+@dataclass
+class Session:
+    # Conversazione di una scheda del browser: stato della GUI, log, stop e dispositivi audio propri
+    id: str
+    state: AppState = field(default_factory=AppState)
+    log: LogManager = field(default_factory=LogManager)
+    stop: threading.Event = field(default_factory=threading.Event)
+    devices: dict = field(default_factory=dict)
+    thread: threading.Thread = None
+    last_seen: float = field(default_factory=time.monotonic)
+    closed: bool = False
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+
+    def close_devices(self):
+        with self._lock:
+            devices, self.devices = self.devices, {}
+        for device in devices.values():
+            device.close()
+
+class SessionManager:
+    # Sessioni indicizzate dall'id della scheda (dcc.Store di sessione): al più max_sessions insieme,
+    # quelle senza richieste da idle_seconds vengono fermate e rimosse
+    def __init__(self, max_sessions=MAX_SESSIONS, idle_seconds=SESSION_IDLE_SECONDS,
+                 devices=default_devices, reap_interval=SESSION_REAP_INTERVAL):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.devices = devices
+        self.reaped = 0
+        self._sessions = {}
+        self._lock = threading.Lock()
+        if reap_interval:
+            threading.Thread(target=self._reap_forever, args=(reap_interval,), daemon=True).start()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def get(self, session_id):
+        # Sessione esistente (None se non c'è): ogni richiesta della scheda la tiene in vita
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is not None:
+            session.touch()
+        return session
+
+    def open(self, session_id):
+        self.reap()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                if len(self._sessions) >= self.max_sessions:
+                    raise SessionLimit(f"Raggiunto il limite di {self.max_sessions} sessioni")
+                session = self._sessions[session_id] = Session(session_id)
+        session.touch()
+        return session
+
+    def start(self, session, settings):
+        # Avvia il loop vocale della sessione; False se è già in corso (o non ancora fermato)
+        with session._lock:
+            if session.running or session.closed:
+                return False
+            if not session.devices:
+                session.devices = self.devices(session.id, session.log)
+            session.state.reset()
+            session.state.start(settings)
+            # L'id della sessione accompagna le righe di conversazioni.csv
+            settings = {**settings, "session_id": session.id}
+            session.thread = threading.Thread(target=self._run, args=(session, settings), daemon=True)
+            session.thread.start()
+        return True
+
+    def _run(self, session, settings):
+        try:
+            voice_loop(settings, session.stop, session.log, **session.devices)
+        except Exception as e:
+            session.log.add_log("SYSTEM", f"Errore thread: {str(e)}")
+        finally:
+            session.state.stop()
+            with session._lock:
+                session.thread = None
+                closed = session.closed
+            if closed:
+                session.close_devices()
+
+    def stop(self, session):
+        session.state.stop()
+        session.stop.set()
+
+    def close(self, session_id):
+        # Rimuove la sessione; i dispositivi si chiudono appena il loop è terminato
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is None:
+            return
+        with session._lock:
+            session.closed = True
+            running = session.running
+        self.stop(session)
+        if not running:
+            session.close_devices()
+
+    def reap(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            idle = [session_id for session_id, session in self._sessions.items() if now - session.last_seen > self.idle_seconds]
+        for session_id in idle:
+            self.close(session_id)
+        self.reaped += len(idle)
+        return idle
+
+    def _reap_forever(self, interval):
+        while True:
+            time.sleep(interval)
+            self.reap()
+
+    def shutdown(self, timeout=STOP_TIMEOUT * 2):
+        with self._lock:
+            sessions = list(self._sessions.values())
+        threads = [session.thread for session in sessions if session.thread is not None]
+        for session in sessions:
+            self.close(session.id)
+        for thread in threads:
+            thread.join(timeout=timeout)
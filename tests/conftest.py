@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Moduli dell'assistente e utilità dei benchmark (server di prova, audio sintetico)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import assistant
+import async_assistant
+from stub_server import serve
+
+@pytest.fixture
+def stub_backend(monkeypatch, tmp_path):
+    # Avvia il server di prova con le latenze richieste e vi punta i client OpenAI dell'assistente
+    servers = []
+
+    def start(**overrides):
+        server, url = serve(**overrides)
+        servers.append(server)
+        monkeypatch.setattr(assistant, "OPENAI_BASE_URL", url)
+        monkeypatch.setattr(async_assistant, "OPENAI_BASE_URL", url)
+        assistant.get_openai_client.cache_clear()
+        assistant.get_http_client.cache_clear()
+        return server
+
+    monkeypatch.chdir(tmp_path)
+    yield start
+    assistant.get_openai_client.cache_clear()
+    assistant.get_http_client.cache_clear()
+    for server in servers:
+        server.shutdown()
@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+import app
+import sessions
+
+def click_start(client, session_id):
+    # Le uscite con allow_duplicate hanno un suffisso generato da Dash: la chiave si cerca nella mappa
+    output = next(key for key in app.app.callback_map if key.startswith("..interval.disabled...start-btn.disabled..."))
+    payload = {
+        "output": output,
+        "outputs": [
+            {"id": "interval", "property": "disabled"},
+            {"id": "start-btn", "property": "disabled"},
+            {"id": "stop-btn", "property": "disabled"},
+            {"id": "interval", "property": "interval"},
+            {"id": "status-text", "property": "children"},
+        ],
+        "inputs": [{"id": "start-btn", "property": "n_clicks", "value": 1}],
+        "state": [
+            {"id": "session-id", "property": "data", "value": session_id},
+            {"id": "lang-dropdown", "property": "value", "value": "it"},
+            {"id": "model-dropdown", "property": "value", "value": "gpt-4o-mini"},
+            {"id": "voice-dropdown", "property": "value", "value": "alloy"},
+            {"id": "pause-input", "property": "value", "value": 1.0},
+        ],
+        "changedPropIds": ["start-btn.n_clicks"],
+    }
+    response = client.post("/_dash-update-component", data=json.dumps(payload), content_type="application/json")
+    assert response.status_code == 200
+    return response.get_json()["response"]
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(sessions, "voice_loop", lambda settings, stop, log, **devices: stop.wait(5))
+    monkeypatch.setattr(app.sessions, "devices", lambda session_id, log: {})
+    yield app.server.test_client()
+    app.sessions.shutdown()
+
+def test_start_runs_the_session(client):
+    response = click_start(client, "scheda-avvio")
+    assert response["interval"]["disabled"] is False
+    assert response["start-btn"]["disabled"] is True
+    assert app.sessions.get("scheda-avvio").running
+
+def test_start_while_previous_loop_is_closing_keeps_stopped_state(client, monkeypatch):
+    monkeypatch.setattr(app.sessions, "start", lambda session, settings: False)
+    response = click_start(client, "scheda-chiusura")
+    assert response["interval"]["disabled"] is True
+    assert response["start-btn"]["disabled"] is False
+    assert response["stop-btn"]["disabled"] is True
+    assert "chiudendo" in response["status-text"]["children"]
@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import assistant
+from assistant import CaptureEngine, EchoGate, Endpointer, LogManager, PlaybackEngine, VadConfig, VoicePipeline
+from async_assistant import AsyncVoicePipeline
+from fake_audio import NullOutputStream, ScriptedMicrophone, speech_pattern, tone_utterance
+from test_capture import FakeInputStream, SAMPLE_RATE, silence, tone
+from test_echo_gate import FakePlayback
+
+SETTINGS = {"language": "it", "model": "gpt-4o-mini", "voice": "alloy", "pause": 0.5, "tts_cache": False}
+
+def speech_onsets(mode, signal):
+    # Onset visti dall'Endpointer mentre l'assistente riproduce audio a 0.1 RMS
+    playback = FakePlayback()
+    playback.play(0.1)
+    engine = CaptureEngine(samplerate=SAMPLE_RATE, block_duration=0.01, echo_gate=EchoGate(playback, mode),
+                           stream_factory=lambda **kw: FakeInputStream(signal=signal, **kw))
+    onsets = []
+    endpointer = Endpointer(engine, VadConfig(start_timeout=2.0), on_speech_start=onsets.append)
+    engine.start()
+    try:
+        endpointer.next_utterance()
+    finally:
+        engine.close()
+    return onsets
+
+def test_barge_in_defaults_to_suppress():
+    for pipeline in (VoicePipeline, AsyncVoicePipeline):
+        log = LogManager()
+        assert pipeline({**SETTINGS, "barge_in": True}, log=log).echo_mode == "suppress"
+        assert pipeline({**SETTINGS, "barge_in": True, "echo_gate": "off"}, log=log).echo_mode == "off"
+        entries, _ = log.read_since(0)
+        assert not entries
+
+def test_barge_in_with_duck_is_reported():
+    log = LogManager()
+    pipeline = VoicePipeline({**SETTINGS, "barge_in": True, "echo_gate": "duck"}, log=log)
+    entries, _ = log.read_since(0)
+    assert pipeline.echo_mode == "duck"
+    assert any("Barge-in" in entry["system"] for entry in entries)
+
+def test_suppress_hears_interruption_but_not_echo():
+    # Eco a 0.04 RMS (sotto 0.6 x 0.1), poi l'utente interrompe a voce normale (0.07 RMS)
+    echo = tone(1.0, 0.057, frequency=180.0)
+    speech = tone(1.0, 0.1)
+    signal = np.concatenate([echo, speech, silence(1.0)])
+
+    onsets = speech_onsets("suppress", signal)
+    assert len(onsets) == 1
+    assert abs(onsets[0] - len(echo)) <= SAMPLE_RATE * 0.01
+    # Con "duck" la stessa interruzione scende sotto la soglia del VAD; senza gate l'eco stessa farebbe da onset
+    assert speech_onsets("duck", signal) == []
+    assert speech_onsets("off", signal) == [0]
+
+def test_sequential_capture_is_the_default():
+    # La GUI imposta solo lingua, modello, voce e pausa: la pausa tra i turni deve valere
+    for pipeline in (VoicePipeline, AsyncVoicePipeline):
+        default = pipeline(SETTINGS, log=LogManager())
+        assert not default.barge_in and not default.overlapped
+        assert default.echo_mode == "duck"
+
+BARGE_IN_BOUND = 0.15             # dall'inizio del parlato al silenzio (s)
+
+@pytest.mark.parametrize("pipeline_class", [VoicePipeline, AsyncVoicePipeline])
+def test_barge_in_cancels_chat_tts_and_playback_within_bound(stub_backend, tmp_path, pipeline_class):
+    # Risposta lunga in streaming e TTS in tempo reale: all'interruzione GPT, sintesi e riproduzione sono tutte in corso
+    stub_backend(transcribe_latency=0.05, chat_latency=0.05, token_delay=0.03, reply_chars=1500, tts_latency=0.05, tts_realtime=1.0)
+    microphone = ScriptedMicrophone()
+    engine = PlaybackEngine(stream_factory=NullOutputStream)
+    capture_engine = CaptureEngine(stream_factory=microphone.stream)
+    settings = {**SETTINGS, "barge_in": True, "echo_gate": "off", "warm_up": False, "context": False,
+                "trace": str(tmp_path / "barge_in.zip")}
+    stop = threading.Event()
+    pipeline = pipeline_class(settings, stop, engine=engine, capture_engine=capture_engine, log=LogManager())
+    onsets = []
+    speech_started = pipeline.speech_started
+
+    def record_onset(onset):
+        onsets.append(capture_engine.time_of(onset))
+        speech_started(onset)
+
+    pipeline.speech_started = record_onset
+    run = pipeline.run if pipeline_class is VoicePipeline else (lambda: asyncio.run(pipeline.run()))
+    loop = threading.Thread(target=run, daemon=True)
+    loop.start()
+    try:
+        microphone.play(np.concatenate([
+            tone_utterance(["ciao", "come", "stai"], assistant.SAMPLE_RATE), np.zeros(assistant.SAMPLE_RATE, dtype=np.float32)
+        ]))
+        deadline = time.monotonic() + 10
+        while engine.played_bytes == 0 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert engine.played_bytes, "la risposta non è mai stata riprodotta"
+        time.sleep(1.0)
+        # L'interruzione dura più della prova: nessun nuovo turno riempie di nuovo l'uscita audio
+        microphone.play(speech_pattern(assistant.SAMPLE_RATE, speech_seconds=3.0, silence_seconds=0.0))
+        time.sleep(1.0)
+    finally:
+        stop.set()
+        loop.join(timeout=5)
+        capture_engine.close()
+        engine.close()
+
+    assert len(onsets) == 2
+    onset_at = onsets[1]
+    assert engine.last_output - onset_at < BARGE_IN_BOUND
+    recorder = pipeline.trace
+    interrupted = [
+        event for event in recorder.requests
+        if recorder.started + event["start"] < onset_at and not event["complete"]
+    ]
+    paths = {event["path"].rsplit("/", 1)[-1] for event in interrupted}
+    assert {"completions", "speech"} <= paths
+    for event in interrupted:
+        closed_at = recorder.started + event["start"] + event["duration"]
+        assert closed_at - onset_at < BARGE_IN_BOUND, event["path"]
@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+import pytest
+
+from assistant import BUDGET_MIN_ATTEMPT, TTS_TIMEOUT, BudgetExhausted, TurnBudget, fetch_speech, stream_speech
+from async_assistant import create_async_client, fetch_speech_async, stream_speech_async
+
+def exhaust(budget):
+    time.sleep(max(0.0, budget.remaining() - BUDGET_MIN_ATTEMPT + 0.05))
+
+def test_only_first_speech_request_is_budgeted():
+    budget = TurnBudget(seconds=0.8)
+    assert budget.speech_timeout().read <= 0.8
+    exhaust(budget)
+    with pytest.raises(BudgetExhausted):
+        budget.timeout(TTS_TIMEOUT)
+    assert budget.speech_timeout().read == TTS_TIMEOUT
+
+def test_first_speech_request_still_needs_budget():
+    budget = TurnBudget(seconds=0.8)
+    exhaust(budget)
+    with pytest.raises(BudgetExhausted):
+        budget.speech_timeout()
+
+def test_later_speech_chunks_outlive_the_budget(stub_backend):
+    stub_backend(tts_latency=0.05)
+    budget = TurnBudget(seconds=0.8)
+    assert b"".join(stream_speech("Prima frase.", "alloy", budget=budget))
+    exhaust(budget)
+    assert b"".join(stream_speech("Seconda frase della risposta.", "alloy", budget=budget))
+    assert fetch_speech("Terza frase.", "alloy", "pcm", budget=budget)
+
+def test_later_speech_chunks_outlive_the_budget_async(stub_backend):
+    stub_backend(tts_latency=0.05)
+
+    async def speak():
+        client = create_async_client()
+        budget = TurnBudget(seconds=0.8)
+        first = [chunk async for chunk in stream_speech_async(client, "Prima frase.", "alloy", budget=budget)]
+        exhaust(budget)
+        second = [chunk async for chunk in stream_speech_async(client, "Seconda frase della risposta.", "alloy", budget=budget)]
+        third = await fetch_speech_async(client, "Terza frase.", "alloy", "pcm", budget=budget)
+        await client.close()
+        return first, second, third
+
+    first, second, third = asyncio.run(speak())
+    assert first and second and third
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+from assistant import CaptureEngine, Endpointer, VadConfig
+
+SAMPLE_RATE = 16000
+BLOCK = 0.01
+
+class FakeInputStream:
+    # InputStream che all'avvio consegna tutto il segnale alla callback, un blocco alla volta
+    def __init__(self, samplerate, blocksize, callback, signal, **kwargs):
+        self.blocksize = blocksize
+        self.callback = callback
+        self.signal = signal
+
+    def start(self):
+        for start in range(0, len(self.signal) - self.blocksize + 1, self.blocksize):
+            block = self.signal[start:start + self.blocksize].reshape(-1, 1)
+            self.callback(block, self.blocksize, None, None)
+
+    def stop(self):
+        pass
+
+    def close(self):
+        pass
+
+def tone(seconds, amplitude=0.3, frequency=220.0):
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+def silence(seconds):
+    return np.zeros(int(SAMPLE_RATE * seconds), dtype=np.float32)
+
+def utterance_of(signal, vad=None):
+    # L'Endpointer parte dal campione 0: lo stream viene avviato dopo averlo creato
+    engine = CaptureEngine(samplerate=SAMPLE_RATE, block_duration=BLOCK,
+                           stream_factory=lambda **kw: FakeInputStream(signal=signal, **kw))
+    onsets = []
+    endpointer = Endpointer(engine, vad or VadConfig(), on_speech_start=onsets.append)
+    engine.start()
+    try:
+        return endpointer.next_utterance(), onsets
+    finally:
+        engine.close()
+
+def test_onset_and_trailing_silence_endpoint():
+    vad = VadConfig()
+    signal = np.concatenate([silence(1.0), tone(1.0), silence(2.0)])
+    utterance, onsets = utterance_of(signal, vad)
+
+    assert onsets == [pytest.approx(SAMPLE_RATE * 1.0, abs=SAMPLE_RATE * vad.frame_duration)]
+    tone_end = SAMPLE_RATE * 2.0
+    # Chiude dopo `trailing_silence` di silenzio, con la granularità di un blocco di analisi
+    assert tone_end + SAMPLE_RATE * vad.trailing_silence <= utterance.end
+    assert utterance.end <= tone_end + SAMPLE_RATE * (vad.trailing_silence + vad.block_duration)
+    assert np.abs(utterance.to_array()).max() == pytest.approx(0.3, abs=0.01)
+
+def test_preroll_keeps_audio_before_onset():
+    vad = VadConfig(preroll=0.3)
+    signal = np.concatenate([silence(1.0), tone(0.5), silence(1.5)])
+    utterance, onsets = utterance_of(signal, vad)
+
+    assert utterance.start == onsets[0] - int(SAMPLE_RATE * vad.preroll)
+    samples = utterance.to_array()
+    preroll = int(SAMPLE_RATE * vad.preroll)
+    assert not samples[:preroll - int(SAMPLE_RATE * vad.frame_duration)].any()
+    assert samples[preroll:preroll + 100].any()
+
+def test_preroll_clipped_at_stream_start():
+    vad = VadConfig(preroll=0.3)
+    signal = np.concatenate([silence(0.1), tone(0.5), silence(1.5)])
+    utterance, _ = utterance_of(signal, vad)
+
+    assert utterance.start == 0
+
+def test_max_utterance_caps_continuous_speech():
+    vad = VadConfig(max_utterance=1.0)
+    signal = np.concatenate([silence(0.5), tone(3.0), silence(1.0)])
+    utterance, _ = utterance_of(signal, vad)
+
+    assert vad.max_utterance <= utterance.duration <= vad.max_utterance + vad.block_duration
+    # Il parlato è ancora in corso: l'enunciato non arriva fino alla fine del tono
+    assert utterance.end < SAMPLE_RATE * 3.5
+
+def test_start_timeout_without_speech():
+    vad = VadConfig(start_timeout=0.5)
+    utterance, onsets = utterance_of(silence(1.0), vad)
+
+    assert utterance is None
+    assert onsets == []
+
+def test_detached_slice_survives_ring_buffer_wraparound():
+    engine = CaptureEngine(samplerate=SAMPLE_RATE, capacity_seconds=1.0)
+    engine.write(tone(0.5))
+    view, copy = engine.slice(0, engine.written), engine.slice(0, engine.written).detach()
+    expected = view.to_array()
+    # Il parlato successivo riempie il buffer e sovrascrive l'intervallo del turno
+    engine.write(silence(1.0))
+
+    with pytest.raises(ValueError):
+        view.samples()
+    assert np.array_equal(copy.samples(), expected)
+    assert copy.duration == pytest.approx(0.5)
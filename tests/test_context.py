@@ -0,0 +1,79 @@
+import threading
+
+from context import ConversationContext, count_message_tokens
+from metrics import PipelineMetrics
+
+def drain(context):
+    # Il riassunto gira su un solo worker: un compito vuoto attende quelli già accodati
+    context._executor.submit(lambda: None).result()
+
+def turn_text(index):
+    return f"Domanda numero {index} sul viaggio a Roma", f"Risposta numero {index}: il treno parte alle nove dal binario tre."
+
+def test_window_stays_within_max_tokens():
+    calls = []
+
+    def summarize(summary, turns):
+        calls.append(len(turns))
+        return f"{summary} {len(turns)} turni".strip()
+
+    context = ConversationContext("Sei un assistente.", summarize=summarize, max_tokens=120)
+    for index in range(60):
+        context.add_turn(*turn_text(index))
+        drain(context)
+        assert context._window_tokens() <= context.max_tokens
+        assert context.turns[-1][:2] == turn_text(index)
+    # Ogni riassunto copre più turni, non uno per chiamata
+    assert len(calls) < 60 / 2
+    assert sum(calls) + len(context.turns) == 60
+    messages = context.messages("E il ritorno?")
+    assert messages[1]["content"].startswith("Riassunto della conversazione precedente:")
+    assert count_message_tokens(messages[2:-1]) <= context.max_tokens
+    context.close()
+
+def test_turns_added_while_folding_are_kept():
+    release = threading.Event()
+    context = ConversationContext("Sei un assistente.", summarize=lambda summary, turns: release.wait() and "riassunto", max_tokens=120)
+    index = 0
+    while not context._folding:
+        context.add_turn(*turn_text(index))
+        index += 1
+    folding = context._folding
+    context.add_turn("Ultima domanda", "Ultima risposta")
+    release.set()
+    drain(context)
+
+    assert context.summary == "riassunto"
+    assert context._folding == 0
+    assert len(context.turns) == index + 1 - folding
+    assert context.turns[-1][:2] == ("Ultima domanda", "Ultima risposta")
+    context.close()
+
+def test_failed_summary_keeps_turns_and_retries():
+    attempts = []
+
+    def summarize(summary, turns):
+        attempts.append(len(turns))
+        if len(attempts) == 1:
+            raise RuntimeError("riassunto non disponibile")
+        return "riassunto"
+
+    metrics = PipelineMetrics()
+    context = ConversationContext("Sei un assistente.", summarize=summarize, max_tokens=120, metrics=metrics)
+    index = 0
+    while not attempts:
+        context.add_turn(*turn_text(index))
+        drain(context)
+        index += 1
+
+    assert context._folding == 0
+    assert context.summary == ""
+    assert [turn[:2] for turn in context.turns] == [turn_text(i) for i in range(index)]
+    assert metrics.snapshot()["context_summary_failures"] == 1
+    # Il turno successivo riprova il riassunto
+    context.add_turn(*turn_text(index))
+    drain(context)
+    assert len(attempts) == 2
+    assert context.summary == "riassunto"
+    assert context._window_tokens() <= context.max_tokens
+    context.close()
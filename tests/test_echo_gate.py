@@ -0,0 +1,99 @@
+import time
+
+import numpy as np
+import pytest
+
+from assistant import CaptureEngine, EchoGate, metrics
+from test_capture import FakeInputStream, SAMPLE_RATE, silence, tone
+
+class FakePlayback:
+    # Storico dei livelli come il PlaybackEngine: (istante dell'uscita, RMS del blocco riprodotto)
+    def __init__(self):
+        self.last_output = 0.0
+        self._levels = []
+
+    def play(self, level, ago=0.0):
+        self.last_output = time.monotonic() - ago
+        self._levels.append((self.last_output, level))
+
+    def seconds_since_output(self):
+        return time.monotonic() - self.last_output
+
+    def reference_level(self, window):
+        now = time.monotonic()
+        return max((level for at, level in self._levels if now - at <= window), default=0.0)
+
+def frame(amplitude):
+    # 10 ms di tono: RMS = amplitude / sqrt(2)
+    return tone(0.01, amplitude)
+
+def suppressed_counter():
+    return metrics.snapshot().get("echo_suppressed_frames", 0)
+
+@pytest.fixture
+def playing():
+    playback = FakePlayback()
+    playback.play(0.1)
+    return playback
+
+def test_idle_playback_passes_every_mode():
+    playback = FakePlayback()
+    playback.play(0.1, ago=1.0)
+    samples = frame(0.05)
+    for mode in ("off", "mute", "duck", "suppress"):
+        gate = EchoGate(playback, mode=mode, hangover=0.3)
+        assert gate.process(samples) is samples
+        assert gate.suppressed_frames == 0
+
+def test_off_passes_during_playback(playing):
+    gate = EchoGate(playing, mode="off")
+    before = suppressed_counter()
+    samples = frame(0.05)
+    assert gate.process(samples) is samples
+    assert gate.suppressed_frames == 0
+    assert suppressed_counter() == before
+
+def test_mute_zeroes_during_playback(playing):
+    gate = EchoGate(playing, mode="mute")
+    before = suppressed_counter()
+    for _ in range(3):
+        assert not gate.process(frame(0.5)).any()
+    assert gate.suppressed_frames == 3
+    assert suppressed_counter() == before + 3
+
+def test_duck_attenuates_during_playback(playing):
+    gate = EchoGate(playing, mode="duck", duck_gain=0.2)
+    samples = frame(0.5)
+    np.testing.assert_allclose(gate.process(samples), samples * 0.2)
+    assert gate.suppressed_frames == 1
+
+def test_suppress_keeps_speech_louder_than_echo(playing):
+    # Riferimento 0.1 RMS, coupling 0.6: sotto 0.06 RMS è eco, sopra è parlato
+    gate = EchoGate(playing, mode="suppress", coupling=0.6)
+    before = suppressed_counter()
+    echo = frame(0.05)
+    speech = frame(0.3)
+    assert not gate.process(echo).any()
+    assert gate.process(speech) is speech
+    assert gate.suppressed_frames == 1
+    assert suppressed_counter() == before + 1
+
+def test_hangover_covers_room_reverb():
+    playback = FakePlayback()
+    playback.play(0.1, ago=0.1)
+    gate = EchoGate(playback, mode="mute", hangover=0.3)
+    assert not gate.process(frame(0.05)).any()
+    playback.play(0.1, ago=0.5)
+    samples = frame(0.05)
+    assert gate.process(samples) is samples
+
+def test_capture_engine_stores_gated_frames(playing):
+    gate = EchoGate(playing, mode="mute")
+    signal = np.concatenate([tone(0.1, 0.3), silence(0.05)])
+    engine = CaptureEngine(samplerate=SAMPLE_RATE, block_duration=0.01, echo_gate=gate,
+                           stream_factory=lambda **kw: FakeInputStream(signal=signal, **kw))
+    engine.start()
+    engine.close()
+    assert engine.written == len(signal)
+    assert not engine.slice(0, engine.written).to_array().any()
+    assert gate.suppressed_frames == len(signal) // engine.block_len
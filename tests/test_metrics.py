@@ -0,0 +1,49 @@
+import threading
+
+from metrics import Histogram, PipelineMetrics
+
+def run_threads(target, count):
+    for _ in range(count):
+        thread = threading.Thread(target=target)
+        thread.start()
+        thread.join()
+
+def test_histogram_folds_shards_of_finished_threads():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    run_threads(lambda: [histogram.observe(0.05), histogram.observe(0.5)], 200)
+    counts, total = histogram.counts()
+    assert counts == [200, 200, 0]
+    assert abs(total - 200 * 0.55) < 1e-9
+    # Restano al più gli shard dei thread ancora vivi
+    assert len(histogram._shards) <= 1
+
+def test_histogram_keeps_live_shards_and_counts_them_once():
+    histogram = Histogram(buckets=(0.1,))
+    release = threading.Event()
+    observed = threading.Event()
+
+    def worker():
+        histogram.observe(0.05)
+        observed.set()
+        release.wait()
+        histogram.observe(0.05)
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    observed.wait()
+    assert histogram.counts()[0] == [1, 0]
+    release.set()
+    thread.join()
+    assert histogram.counts()[0] == [2, 0]
+    assert histogram.counts()[0] == [2, 0]
+
+def test_disabled_metrics_record_nothing():
+    metrics = PipelineMetrics(enabled=False)
+    metrics.incr("turns")
+    metrics.observe("first_audio_seconds", 0.4)
+    metrics.observe_stage("chat", 0.2)
+    with metrics.span("tts"):
+        pass
+    assert metrics.snapshot() == {}
+    assert metrics.percentile("first_audio_seconds", 95) is None
+    assert metrics.stage_summary() == []
@@ -0,0 +1,105 @@
+import asyncio
+import csv
+import os
+import threading
+
+import assistant
+from assistant import TTS_MAX_IN_FLIGHT, Cancelled, LogManager, Turn, TurnBudget, VoicePipeline, save_conversation
+from async_assistant import AsyncVoicePipeline
+
+SETTINGS = {"language": "it", "model": "gpt-4o-mini", "voice": "alloy", "pause": 0.5, "tts_cache": False}
+
+def respond_with(monkeypatch, tmp_path, deltas, settings=SETTINGS):
+    # Esegue lo stadio respond con uno stream GPT simulato; restituisce turno e log
+    monkeypatch.chdir(tmp_path)
+    log = LogManager()
+    pipeline = VoicePipeline(settings, log=log)
+    turn = Turn(1, user_text="Raccontami una storia")
+    turn.budget = TurnBudget(token=turn.token)
+    monkeypatch.setattr(assistant, "stream_chatgpt_response", lambda *args: deltas(turn))
+    pipeline.respond(turn, lambda _: None)
+    entries, _ = log.read_since(0)
+    return turn, [entry["system"] for entry in entries]
+
+def test_turn_cancelled_before_first_sentence_is_not_logged(monkeypatch, tmp_path):
+    def deltas(turn):
+        turn.token.cancel()
+        raise Cancelled()
+        yield
+
+    turn, messages = respond_with(monkeypatch, tmp_path, deltas)
+    assert turn.reply == ""
+    assert not any("[PARLO]" in message for message in messages)
+    assert not os.path.exists("conversazioni.csv")
+
+def test_turn_cancelled_after_first_sentence_is_logged_as_interrupted(monkeypatch, tmp_path):
+    def deltas(turn):
+        yield "C'era una volta un re. "
+        turn.token.cancel()
+        raise Cancelled()
+
+    turn, messages = respond_with(monkeypatch, tmp_path, deltas)
+    assert turn.reply == "C'era una volta un re."
+    assert "🤖 C'era una volta un re. (interrotta) [PARLO]" in messages
+    with open("conversazioni.csv", encoding="utf-8") as f:
+        assert "C'era una volta un re." in f.read()
+
+def read_rows():
+    with open("conversazioni.csv", newline="", encoding="utf-8") as f:
+        return list(csv.reader(f))
+
+def test_conversation_rows_carry_the_session_id(monkeypatch, tmp_path):
+    def deltas(turn):
+        yield "Ciao!"
+
+    respond_with(monkeypatch, tmp_path, deltas, {**SETTINGS, "session_id": "scheda-1"})
+    [row] = read_rows()
+    assert row[1:] == ["Raccontami una storia", "Ciao!", "scheda-1"]
+
+def test_concurrent_sessions_write_whole_rows(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    reply = "Una risposta lunga, " * 200
+
+    def write(session_id):
+        for turn in range(20):
+            save_conversation(f"Domanda {turn}", reply, session_id)
+
+    threads = [threading.Thread(target=write, args=(f"sessione-{index}",)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    rows = read_rows()
+    assert len(rows) == 8 * 20
+    assert all(len(row) == 4 and row[2] == reply for row in rows)
+    assert {row[3] for row in rows} == {f"sessione-{index}" for index in range(8)}
+
+def test_finished_turns_leave_the_in_flight_list():
+    pipeline = VoicePipeline(SETTINGS, log=LogManager())
+    for turn_id in range(1, 101):
+        turn = Turn(turn_id)
+        pipeline._track(turn)
+        if turn_id != 100:
+            turn.done.set()
+    assert [turn.id for turn in pipeline._in_flight] == [100]
+
+def test_tts_limit_is_shared_by_pipelines_on_one_loop(monkeypatch):
+    running, peak = 0, 0
+
+    async def speech_pcm(self, turn, text):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        yield b"\0\0"
+
+    monkeypatch.setattr(AsyncVoicePipeline, "speech_pcm", speech_pcm)
+    pipelines = [AsyncVoicePipeline(SETTINGS, log=LogManager()) for _ in range(3)]
+
+    async def main():
+        jobs = [pipeline._speech_job(Turn(1), "Ciao", asyncio.Queue()) for pipeline in pipelines for _ in range(TTS_MAX_IN_FLIGHT)]
+        await asyncio.gather(*jobs)
+
+    asyncio.run(main())
+    assert peak == TTS_MAX_IN_FLIGHT
@@ -0,0 +1,109 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import assistant
+from assistant import RESPONSE_CACHE_BYPASS, LogManager, Turn, TurnBudget, VoicePipeline
+from cache import ResponseCache
+
+SETTINGS = {"language": "it", "model": "gpt-4o-mini", "voice": "alloy", "pause": 0.5, "tts_cache": False}
+REPLY = "Sono un assistente vocale. Rispondo alle tue domande."
+
+class FakeStream:
+    def __init__(self, text):
+        self.chunks = [SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word + " "))]) for word in text.split()]
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        pass
+
+class CountingClient:
+    # Client OpenAI finto: conta le richieste di chat e risponde sempre REPLY
+    def __init__(self):
+        self.calls = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, stream=False, timeout=None):
+        self.calls.append(messages[-1]["content"])
+        if stream:
+            return FakeStream(REPLY)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=REPLY))])
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    fake = CountingClient()
+    monkeypatch.setattr(assistant, "get_openai_client", lambda: fake)
+    return fake
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache(str(tmp_path / "responses.sqlite3"), bypass=RESPONSE_CACHE_BYPASS)
+
+def ask(cache, question, **settings):
+    # Un turno dello stadio respond in una sessione nuova, con la cache condivisa
+    pipeline = VoicePipeline({**SETTINGS, **settings}, log=LogManager())
+    pipeline.response_cache = cache
+    turn = Turn(1, user_text=question)
+    turn.budget = TurnBudget(token=turn.token)
+    pipeline.respond(turn, lambda _: None)
+    return turn.reply
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_repeated_question_is_served_from_cache(client, cache, streaming):
+    first = ask(cache, "Chi sei?", streaming=streaming)
+    second = ask(cache, "chi  SEI", streaming=streaming)
+    assert first == second == REPLY
+    assert client.calls == ["Chi sei?"]
+
+def test_different_questions_and_models_miss(client, cache):
+    ask(cache, "Chi sei?")
+    ask(cache, "Cosa sai fare?")
+    ask(cache, "Chi sei?", model="gpt-4o")
+    assert len(client.calls) == 3
+
+def test_conversation_history_is_part_of_the_key(client, cache):
+    # Nella stessa sessione la seconda domanda ha una storia diversa: va di nuovo a GPT
+    pipeline = VoicePipeline(SETTINGS, log=LogManager())
+    pipeline.response_cache = cache
+    for turn_id in (1, 2):
+        turn = Turn(turn_id, user_text="Chi sei?")
+        turn.budget = TurnBudget(token=turn.token)
+        pipeline.respond(turn, lambda _: None)
+    assert len(client.calls) == 2
+
+def test_time_dependent_question_bypasses_cache(client, cache):
+    ask(cache, "Che tempo fa oggi a Roma?")
+    ask(cache, "Che tempo fa oggi a Roma?")
+    assert len(client.calls) == 2
+    assert cache.stats()["entries"] == 0
+
+def test_expired_and_evicted_entries_miss(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite3"), ttl=0.2, max_entries=2)
+    keys = [cache.key("gpt-4o-mini", question) for question in ("Uno", "Due", "Tre")]
+    for key in keys:
+        cache.put(key, REPLY)
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[2]) == REPLY
+    time.sleep(0.25)
+    assert cache.get(keys[2]) is None
+
+@pytest.mark.parametrize("question", [
+    "Che ore sono?",
+    "Che tempo fa oggi?",
+    "Quali sono le ultime notizie?",
+    "What time is it?",
+    "What is the weather like today?",
+    "What's the date?",
+    "Any news this morning?",
+    "What's the latest score of the match?",
+])
+def test_bypass_in_both_languages(cache, question):
+    assert cache.key("gpt-4o-mini", question) is None
+
+@pytest.mark.parametrize("question", ["Chi ha scritto la Divina Commedia?", "Who wrote the Divine Comedy?"])
+def test_timeless_questions_are_cacheable(cache, question):
+    assert cache.key("gpt-4o-mini", question) is not None
@@ -0,0 +1,77 @@
+import pytest
+
+import assistant
+import sessions
+from assistant import LogManager, PlaybackEngine
+from sessions import SessionLimit, SessionManager
+
+class FakeDevice:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+@pytest.fixture
+def loops(monkeypatch):
+    # voice_loop finto: registra le impostazioni e resta attivo fino allo Stop della sessione
+    started = []
+
+    def voice_loop(settings, stop, log, **devices):
+        started.append(settings)
+        stop.wait(5)
+
+    monkeypatch.setattr(sessions, "voice_loop", voice_loop)
+    return started
+
+def make_manager(max_sessions=2):
+    return SessionManager(max_sessions=max_sessions, idle_seconds=60, devices=lambda session_id, log: {"engine": FakeDevice()}, reap_interval=None)
+
+def test_session_id_reaches_the_pipeline_settings(loops):
+    manager = make_manager()
+    session = manager.open("scheda-1")
+    settings = {"language": "it"}
+    assert manager.start(session, settings)
+    manager.shutdown()
+    assert loops == [{"language": "it", "session_id": "scheda-1"}]
+    assert settings == {"language": "it"}
+
+def test_limit_stop_and_reap(loops):
+    manager = make_manager()
+    first, second = manager.open("a"), manager.open("b")
+    with pytest.raises(SessionLimit):
+        manager.open("c")
+    for session in (first, second):
+        manager.start(session, {})
+    manager.stop(first)
+    first_thread = first.thread
+    if first_thread is not None:
+        first_thread.join(timeout=2)
+    assert not first.running and second.running
+    engine = second.devices["engine"]
+    second_thread = second.thread
+    assert sorted(manager.reap(now=second.last_seen + 61)) == ["a", "b"]
+    second_thread.join(timeout=2)
+    assert engine.closed
+    assert len(manager) == 0
+
+def test_playback_errors_reach_the_session_log(monkeypatch):
+    class BrokenStream:
+        def __init__(self, **kwargs):
+            raise OSError("dispositivo audio scollegato")
+
+    monkeypatch.setattr(assistant.sd, "RawOutputStream", BrokenStream)
+    log = LogManager()
+    engine = sessions.default_devices("scheda-1", log)["engine"]
+    _, shared_before = assistant.log_manager.read_since(0)
+    try:
+        reply = engine.begin_reply()
+        engine.enqueue(b"\0\0" * 4800, reply)
+        engine.end_reply(reply=reply)
+        assert engine.flush(timeout=2)
+    finally:
+        engine.close()
+
+    entries, _ = log.read_since(0)
+    assert any("Errore riproduzione: dispositivo audio scollegato" in entry["system"] for entry in entries)
+    assert assistant.log_manager.read_since(0)[1] == shared_before
@@ -0,0 +1,55 @@
+import threading
+import time
+from functools import partial
+
+import pytest
+
+from assistant import STOP_TIMEOUT, CaptureEngine, LogManager, PlaybackEngine, voice_loop
+from fake_audio import NullOutputStream, SyntheticInputStream
+
+SETTINGS = {
+    "language": "it",
+    "model": "gpt-4o-mini",
+    "voice": "alloy",
+    "pause": 0,
+    "echo_gate": "off",
+    "warm_up": False,
+    "tts_cache": False,
+}
+
+def wait_for_log(log, text, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        entries, _ = log.read_since(0)
+        if any(text in entry["system"] for entry in entries):
+            return True
+        time.sleep(0.05)
+    return False
+
+@pytest.mark.parametrize("engine", ["threads", "async"])
+def test_stop_during_slow_chat_returns_quickly(stub_backend, engine):
+    # GPT impiega 10 s per il primo token: lo Stop arriva mentre la richiesta è in corso
+    server = stub_backend(chat_latency=10)
+    log = LogManager()
+    stop = threading.Event()
+    devices = {
+        "engine": PlaybackEngine(stream_factory=NullOutputStream),
+        "capture_engine": CaptureEngine(stream_factory=partial(SyntheticInputStream, speed=4.0)),
+    }
+    loop = threading.Thread(target=voice_loop, args=({**SETTINGS, "engine": engine}, stop, log), kwargs=devices, daemon=True)
+    loop.start()
+    try:
+        assert wait_for_log(log, "PENSO", timeout=10), "il turno non è arrivato alla richiesta GPT"
+        time.sleep(0.3)
+        assert server.snapshot().get("/v1/chat/completions", {}).get("requests")
+        started = time.monotonic()
+        stop.set()
+        loop.join(timeout=STOP_TIMEOUT * 5)
+        elapsed = time.monotonic() - started
+    finally:
+        stop.set()
+        loop.join(timeout=5)
+        devices["capture_engine"].close()
+        devices["engine"].close()
+    assert not loop.is_alive()
+    assert elapsed < STOP_TIMEOUT
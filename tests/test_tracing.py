@@ -0,0 +1,71 @@
+import threading
+import time
+from functools import partial
+
+import numpy as np
+import pytest
+
+from assistant import SAMPLE_RATE, CaptureEngine, LogManager, PlaybackEngine, voice_loop
+from fake_audio import NullOutputStream, SyntheticInputStream, tone_utterance
+from tracing import Trace
+
+SETTINGS = {
+    "language": "it",
+    "model": "gpt-4o-mini",
+    "voice": "alloy",
+    "pause": 0,
+    "echo_gate": "off",
+    "warm_up": False,
+    "tts_cache": False,
+    "context": False,
+}
+PHRASES = {"traced": "ciao come stai", "other": "biglietto per roma"}
+
+def devices(phrase):
+    signal = np.concatenate([tone_utterance(phrase.split(), SAMPLE_RATE), np.zeros(int(SAMPLE_RATE * 1.2), dtype=np.float32)])
+    return {
+        "engine": PlaybackEngine(stream_factory=partial(NullOutputStream, speed=8.0)),
+        "capture_engine": CaptureEngine(stream_factory=partial(SyntheticInputStream, signal=signal, speed=4.0)),
+    }
+
+def user_texts(log):
+    entries, _ = log.read_since(0)
+    return [entry["user"][2:] for entry in entries if entry["user"].startswith("👤 ")]
+
+@pytest.mark.parametrize("engine", ["threads", "async"])
+def test_trace_records_only_its_own_session(stub_backend, tmp_path, engine):
+    stub_backend(transcribe_tones=True, chat_latency=0.05, tts_latency=0.05)
+    path = str(tmp_path / "trace.zip")
+    stop = threading.Event()
+    logs = {name: LogManager() for name in PHRASES}
+    sessions = {name: devices(phrase) for name, phrase in PHRASES.items()}
+    loops = [
+        threading.Thread(
+            target=voice_loop,
+            args=({**SETTINGS, "engine": engine, **({"trace": path} if name == "traced" else {})}, stop, logs[name]),
+            kwargs=sessions[name], daemon=True,
+        )
+        for name in PHRASES
+    ]
+    for loop in loops:
+        loop.start()
+    time.sleep(4.0)
+    stop.set()
+    for loop in loops:
+        loop.join(timeout=5)
+    for device in sessions.values():
+        device["capture_engine"].close()
+        device["engine"].close()
+
+    # Entrambe le sessioni hanno parlato con il server nello stesso momento
+    assert PHRASES["other"] in user_texts(logs["other"])
+    assert PHRASES["traced"] in user_texts(logs["traced"])
+    trace = Trace(path)
+    try:
+        prompts = [event["request"]["messages"][-1]["content"] for event in trace.requests
+                   if event["path"].endswith("/chat/completions")]
+        assert prompts
+        assert all(prompt in PHRASES["traced"] for prompt in prompts)
+        assert {turn["user_text"] for turn in trace.turns if turn["user_text"]} <= {PHRASES["traced"]}
+    finally:
+        trace.close()
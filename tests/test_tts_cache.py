@@ -0,0 +1,133 @@
+import asyncio
+import os
+import threading
+import time
+
+from assistant import LogManager, Turn
+from async_assistant import AsyncVoicePipeline
+from cache import TtsCache
+
+SETTINGS = {"language": "it", "model": "gpt-4o-mini", "voice": "alloy", "pause": 0.5, "tts_cache": False}
+
+def producer(data, calls, delay=0.0):
+    def produce():
+        calls.append(data)
+        time.sleep(delay)
+        return data
+    return produce
+
+def fetch_concurrently(cache, key, produce, count):
+    results = [None] * count
+    errors = []
+
+    def worker(index):
+        try:
+            results[index] = cache.fetch(key, produce)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+def test_concurrent_acquires_make_one_upstream_call():
+    cache = TtsCache()
+    calls = []
+    results, errors = fetch_concurrently(cache, "ciao", producer(b"audio", calls, delay=0.1), 8)
+
+    assert errors == []
+    assert calls == [b"audio"]
+    assert results == [b"audio"] * 8
+    stats = cache.stats()
+    assert (stats["misses"], stats["hits"], stats["coalesced"]) == (1, 7, 7)
+
+def test_waiters_retry_when_the_leading_request_fails():
+    cache = TtsCache()
+    calls = []
+
+    def produce():
+        calls.append(None)
+        time.sleep(0.05)
+        if len(calls) == 1:
+            raise RuntimeError("TTS non disponibile")
+        return b"audio"
+
+    results, errors = fetch_concurrently(cache, "ciao", produce, 4)
+
+    assert len(errors) == 1
+    # Chi attendeva riprova: una sola nuova richiesta upstream serve tutti gli altri
+    assert len(calls) == 2
+    assert sorted(result for result in results if result is not None) == [b"audio"] * 3
+
+def test_memory_evicts_least_recently_used():
+    cache = TtsCache(memory_bytes=10)
+    calls = []
+    for key in ("a", "b"):
+        cache.fetch(key, producer(b"xxxx", calls))
+    cache.fetch("a", producer(b"xxxx", calls))
+    cache.fetch("c", producer(b"xxxx", calls))
+
+    assert list(cache._memory) == ["a", "c"]
+    assert cache.stats()["memory_bytes"] == 8
+    cache.fetch("b", producer(b"xxxx", calls))
+    assert len(calls) == 4
+
+def test_disk_cap_evicts_oldest_files(tmp_path):
+    directory = tmp_path / "tts"
+    cache = TtsCache(str(directory), memory_bytes=0, disk_bytes=10)
+    for key in ("a", "b", "c"):
+        cache.fetch(key, producer(key.encode() * 4, []))
+
+    assert sorted(os.listdir(directory)) == ["b.bin", "c.bin"]
+    assert cache.stats()["disk_bytes"] == 8
+    # L'indice ricostruito da un nuovo processo rispetta lo stesso tetto
+    reopened = TtsCache(str(directory), memory_bytes=0, disk_bytes=4)
+    assert sorted(os.listdir(directory)) == ["c.bin"]
+    assert reopened.fetch("c", producer(b"nuovo", [])) == b"cccc"
+
+def test_stale_temporary_files_are_removed_on_start(tmp_path):
+    (tmp_path / "a.bin.tmp").write_bytes(b"parziale")
+    (tmp_path / "b.bin").write_bytes(b"intero")
+    cache = TtsCache(str(tmp_path))
+
+    assert sorted(os.listdir(tmp_path)) == ["b.bin"]
+    assert cache.stats()["disk_bytes"] == len(b"intero")
+
+def test_failed_write_leaves_no_temporary_file(tmp_path, monkeypatch):
+    cache = TtsCache(str(tmp_path))
+
+    def replace(src, dst):
+        raise OSError("disco pieno")
+
+    monkeypatch.setattr(os, "replace", replace)
+    assert cache.fetch("a", producer(b"audio", [])) == b"audio"
+
+    assert os.listdir(tmp_path) == []
+    assert cache.stats()["disk_bytes"] == 0
+    assert cache.fetch("a", producer(b"altro", [])) == b"audio"
+
+def test_cancelled_acquire_tolerates_a_failed_lookup():
+    class FailingCache:
+        def acquire(self, key, cancelled=None):
+            time.sleep(0.05)
+            raise OSError("cache non leggibile")
+
+    pipeline = AsyncVoicePipeline(SETTINGS, log=LogManager())
+    pipeline.tts_cache = FailingCache()
+    errors = []
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        loop.set_exception_handler(lambda _, context: errors.append(context))
+        pipeline._loop = loop
+        task = asyncio.create_task(pipeline._cache_acquire(Turn(1), "ciao"))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await asyncio.sleep(0.1)
+
+    asyncio.run(main())
+    assert errors == []
@@ -0,0 +1,262 @@
+import contextvars
+import hashlib
+import io
+import json
+import math
+import threading
+import time
+import zipfile
+from datetime import datetime
+from functools import partial
+
+import httpx
+import numpy as np
+import scipy.io.wavfile
+from scipy.signal import resample_poly
+
+TRACE_VERSION = 1
+TRACE_AUDIO_RATE = 16000          # l'audio dei turni è salvato a 16 kHz int16, come quello inviato a Whisper
+
+# Traccia della pipeline in esecuzione: il client HTTP è condiviso tra le sessioni, quindi il
+# trasporto registra solo le richieste partite dal contesto della pipeline che ha avviato la traccia
+_active = contextvars.ContextVar("active_trace", default=None)
+
+def active_trace():
+    return _active.get()
+
+def start_trace(path, settings=None):
+    recorder = TraceRecorder(path, settings)
+    _active.set(recorder)
+    return recorder
+
+def stop_trace(recorder):
+    if _active.get() is recorder:
+        _active.set(None)
+    recorder.close()
+
+def bind_context(fn):
+    # I thread e i pool non ereditano il contesto: fn viene eseguita in una copia di quello
+    # corrente, così le sue richieste finiscono nella traccia della pipeline che l'ha avviata
+    return partial(contextvars.copy_context().run, fn)
+
+def endpoint(path):
+    # "/v1/chat/completions" anche dietro proxy con un prefisso diverso
+    index = path.find("/v1/")
+    return path[index:] if index >= 0 else path
+
+def request_key(content):
+    # Le richieste JSON identiche (stesso testo da sintetizzare, stessa conversazione) si riconoscono
+    # tra registrazione e replay; quelle multipart hanno un boundary casuale e vanno per ordine
+    return hashlib.sha256(content).hexdigest()[:16]
+
+class TraceRecorder:
+    # Traccia di una sessione in un file zip: meta.json, turns.jsonl (turni con tempi degli stadi),
+    # requests.jsonl (richieste API con tempi degli header e dei chunk), audio/ e bodies/
+    def __init__(self, path, settings=None):
+        self.path = path
+        self.settings = {key: value for key, value in (settings or {}).items() if key != "trace"}
+        self.started = time.monotonic()
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self.turns = []
+        self.requests = []
+        self._lock = threading.Lock()
+        self._zip = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+        self._closed = False
+
+    def _elapsed(self, at):
+        return round(at - self.started, 4)
+
+    def _write(self, name, data):
+        with self._lock:
+            if not self._closed:
+                self._zip.writestr(name, data)
+
+    def add_turn(self, turn):
+        # Audio salvato subito: il ring buffer del microfono viene riscritto dopo qualche secondo
+        recording = turn.recording
+        samples = np.asarray(recording.samples(), dtype=np.float32).reshape(-1)
+        samplerate = recording.engine.samplerate
+        if samplerate != TRACE_AUDIO_RATE:
+            divisor = math.gcd(samplerate, TRACE_AUDIO_RATE)
+            samples = resample_poly(samples, TRACE_AUDIO_RATE // divisor, samplerate // divisor)
+        buffer = io.BytesIO()
+        scipy.io.wavfile.write(buffer, TRACE_AUDIO_RATE, (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16))
+        name = f"audio/turn_{turn.id:04d}.wav"
+        self._write(name, buffer.getvalue())
+        with self._lock:
+            self.turns.append((turn, name))
+
+    def begin_request(self, request, content):
+        event = {
+            "start": self._elapsed(time.monotonic()),
+            "method": request.method,
+            "path": request.url.path,
+            "request_bytes": len(content),
+        }
+        if request.headers.get("content-type", "").startswith("application/json"):
+            event["key"] = request_key(content)
+            event["request"] = json.loads(content or b"null")
+        return event
+
+    def finish_request(self, event, status, content_type, started, headers_at, chunks, body, complete):
+        event.update({
+            "status": status,
+            "content_type": content_type,
+            "headers": round(headers_at - started, 4),
+            "chunks": chunks,
+            "duration": round(time.monotonic() - started, 4),
+            "complete": complete,
+        })
+        with self._lock:
+            event["id"] = len(self.requests) + 1
+            event["body"] = f"bodies/{event['id']:06d}.bin"
+            self.requests.append(event)
+        self._write(event["body"], body)
+
+    def fail_request(self, event, started, error):
+        # Errore di rete o timeout prima della risposta: resta nella traccia con status 0
+        event["error"] = f"{type(error).__name__}: {error}"
+        self.finish_request(event, 0, "", started, time.monotonic(), [], b"", False)
+
+    def _turn_entry(self, turn, audio):
+        # Tempi degli stadi relativi alla fine del parlato (captured_at)
+        return {
+            "turn": turn.id,
+            "audio": audio,
+            "captured": self._elapsed(turn.captured_at),
+            "duration": round(turn.recording.duration, 3),
+            "user_text": turn.user_text,
+            "reply": turn.reply,
+            "marks": {name: round(at - turn.captured_at, 4) for name, at in turn.marks.items()},
+        }
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            turns = [self._turn_entry(turn, audio) for turn, audio in self.turns]
+            requests = sorted(self.requests, key=lambda event: event["start"])
+            meta = {
+                "version": TRACE_VERSION,
+                "started": self.started_at,
+                "seconds": self._elapsed(time.monotonic()),
+                "settings": self.settings,
+            }
+            self._zip.writestr("meta.json", json.dumps(meta, indent=2, default=str))
+            self._zip.writestr("turns.jsonl", "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in turns))
+            self._zip.writestr("requests.jsonl", "".join(json.dumps(event, ensure_ascii=False) + "\n" for event in requests))
+            self._zip.close()
+            self._closed = True
+
+class _RecordingStream:
+    # Copia i chunk della risposta e il loro istante di arrivo; alla chiusura la richiesta entra nella traccia
+    def __init__(self, stream, recorder, event, response, started, headers_at):
+        self.stream = stream
+        self.recorder = recorder
+        self.event = event
+        self.response = response
+        self.started = started
+        self.headers_at = headers_at
+        self.chunks = []
+        self.body = bytearray()
+        self.complete = False
+        self.finished = False
+
+    def _record(self, chunk):
+        self.chunks.append([round(time.monotonic() - self.started, 4), len(chunk)])
+        self.body.extend(chunk)
+
+    def _finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        self.recorder.finish_request(
+            self.event, self.response.status_code, self.response.headers.get("content-type", ""),
+            self.started, self.headers_at, self.chunks, bytes(self.body), self.complete
+        )
+
+class RecordingStream(_RecordingStream, httpx.SyncByteStream):
+    def __iter__(self):
+        for chunk in self.stream:
+            self._record(chunk)
+            yield chunk
+        self.complete = True
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            self._finish()
+
+class AsyncRecordingStream(_RecordingStream, httpx.AsyncByteStream):
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            self._record(chunk)
+            yield chunk
+        self.complete = True
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            self._finish()
+
+class RecordingTransport(httpx.BaseTransport):
+    # Trasporto del client condiviso: senza traccia attiva nel contesto della richiesta inoltra e basta
+    def __init__(self, transport):
+        self.transport = transport
+
+    def handle_request(self, request):
+        recorder = _active.get()
+        if recorder is None:
+            return self.transport.handle_request(request)
+        started = time.monotonic()
+        event = recorder.begin_request(request, request.read())
+        try:
+            response = self.transport.handle_request(request)
+        except Exception as e:
+            recorder.fail_request(event, started, e)
+            raise
+        response.stream = RecordingStream(response.stream, recorder, event, response, started, time.monotonic())
+        return response
+
+    def close(self):
+        self.transport.close()
+
+class AsyncRecordingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport):
+        self.transport = transport
+
+    async def handle_async_request(self, request):
+        recorder = _active.get()
+        if recorder is None:
+            return await self.transport.handle_async_request(request)
+        started = time.monotonic()
+        event = recorder.begin_request(request, await request.aread())
+        try:
+            response = await self.transport.handle_async_request(request)
+        except Exception as e:
+            recorder.fail_request(event, started, e)
+            raise
+        response.stream = AsyncRecordingStream(response.stream, recorder, event, response, started, time.monotonic())
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+class Trace:
+    # Lettura di una traccia registrata da TraceRecorder
+    def __init__(self, path):
+        self.path = path
+        self._zip = zipfile.ZipFile(path)
+        self.meta = json.loads(self._zip.read("meta.json"))
+        self.turns = [json.loads(line) for line in self._zip.read("turns.jsonl").decode("utf-8").splitlines() if line]
+        self.requests = [json.loads(line) for line in self._zip.read("requests.jsonl").decode("utf-8").splitlines() if line]
+        self._lock = threading.Lock()
+
+    def read(self, name):
+        with self._lock:
+            return self._zip.read(name)
+
+    def close(self):
+        self._zip.close()